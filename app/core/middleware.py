@@ -48,3 +48,44 @@ class CookieAuthenticationMiddleware(MiddlewareMixin):
                     _thread_locals.user = user
             except Exception:
                 pass
+
+
+class BancoEmpresaMiddleware:
+    """
+    Garante que cada request comece no banco default: o alias do banco da
+    empresa (DatabaseManager.usar_banco_empresa) vale só até o fim do request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Import local: este módulo é carregado pelos models (auditoria) antes dos apps
+        from db_allnube_empresa.utils.database_utils import DatabaseManager
+
+        DatabaseManager.limpar_conexao_empresa()
+        try:
+            return self.get_response(request)
+        finally:
+            DatabaseManager.limpar_conexao_empresa()
+
+
+class ContextoEmpresaMiddleware:
+    """
+    Abre o registro de contextos de empresa do request (app.utils.contexto_empresa):
+    o contexto de cada usuário é montado na primeira leitura e reaproveitado por
+    todas as views, mixins e utilitários até o fim do request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Import local: este módulo é carregado pelos models (auditoria) antes dos apps
+        from app.utils import contexto_empresa
+
+        contexto_empresa.iniciar_request()
+        try:
+            return self.get_response(request)
+        finally:
+            contexto_empresa.encerrar_request()
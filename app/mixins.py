@@ -2,7 +2,7 @@
 
 from rest_framework.exceptions import PermissionDenied
 
-from empresa.models import Empresa, Funcionario
+from app.utils.contexto_empresa import obter_contexto
 
 
 class SystemAccessMixin:
@@ -31,24 +31,8 @@ class SystemAccessMixin:
         if not system_id:
             return True
 
-        # Verificar como dono
-        if Empresa.objects.filter(
-            usuario=request.user,
-            status='1',
-            sistema_id=system_id
-        ).exists():
-            return True
-
-        # Verificar como funcionário
-        if Funcionario.objects.filter(
-            user=request.user,
-            status='1',
-            empresa__status='1',
-            empresa__sistema_id=system_id
-        ).exists():
-            return True
-
-        return False
+        # Dono ou funcionário de empresa ativa no sistema (contexto do request, sem query)
+        return obter_contexto(request.user).tem_sistema(system_id)
 
 
 class EmpresaScopeMixin:
@@ -66,27 +50,8 @@ class EmpresaScopeMixin:
             if empresa_id:
                 return int(empresa_id)
 
-        # Buscar empresa do usuário
-        # 1. Como dono
-        empresa = Empresa.objects.filter(
-            usuario=request.user,
-            status='1'
-        ).first()
-
-        if empresa:
-            return empresa.id
-
-        # 2. Como funcionário
-        funcionario = Funcionario.objects.filter(
-            user=request.user,
-            status='1',
-            empresa__status='1'
-        ).select_related('empresa').first()
-
-        if funcionario:
-            return funcionario.empresa.id
-
-        return None
+        # Empresa do usuário (dono ou funcionário), lida do contexto do request
+        return obter_contexto(request.user).empresa_id
 
     def get_queryset(self):
         """Filtra queryset baseado na empresa do usuário"""
@@ -1,9 +1,11 @@
-import re
 from rest_framework import permissions
 from django.core.cache import cache
 
-from empresa.models import Funcionario, RotasPermitidas, Empresa
-from sistema.models import RotaSistema, GrupoRotaSistema, EmpresaSistema
+from empresa.models import Funcionario, Empresa
+from sistema.models import EmpresaSistema
+from app.utils.contexto_empresa import obter_contexto
+from sistema.utils.permissoes import invalidar_todas
+from sistema.utils.rotas import encontrar_rota, invalidar_rotas
 
 
 class HasSystemAccess(permissions.BasePermission):
@@ -164,6 +166,8 @@ class HasFuncionarioPermission(permissions.BasePermission):
     Verifica se:
     - Usuário é dono da empresa do funcionário
     - Usuário é o próprio funcionário
+
+    Consulta o conjunto de permissões materializado do usuário (sem query).
     """
 
     def has_permission(self, request, view):
@@ -176,31 +180,12 @@ class HasFuncionarioPermission(permissions.BasePermission):
         if not funcionario_id:
             return True
 
-        # Tentar obter do cache
-        cache_key = f"user_funcionario_access_{request.user.id}_{funcionario_id}"
-        cached_result = cache.get(cache_key)
-
-        if cached_result is not None:
-            return cached_result
-
         try:
-            funcionario = Funcionario.objects.select_related('empresa').get(id=funcionario_id, status='1')
-        except Funcionario.DoesNotExist:
-            cache.set(cache_key, False, 600)
+            funcionario_id = int(funcionario_id)
+        except (ValueError, TypeError):
             return False
 
-        # Usuário é dono da empresa do funcionário
-        if funcionario.empresa.usuario == request.user:
-            cache.set(cache_key, True, 3600)
-            return True
-
-        # Usuário é o próprio funcionário
-        if funcionario.user == request.user:
-            cache.set(cache_key, True, 3600)
-            return True
-
-        cache.set(cache_key, False, 600)
-        return False
+        return obter_contexto(request.user).permissoes.gerencia_funcionario(funcionario_id)
 
 
 class GlobalDefaultPermission(permissions.BasePermission):
@@ -296,13 +281,11 @@ class PodeAcessarRotasFuncionario(permissions.BasePermission):
     Verifica:
     - Acesso direto via RotasPermitidas
     - Acesso via GrupoRotaSistema
-    - Suporte a rotas com parâmetros (regex)
-    - Cache para otimização
-    """
+    - Suporte a rotas com parâmetros (template cadastrado em RotaSistema)
 
-    # Cache TTL em segundos
-    CACHE_TTL_ACCESS = 3600  # 1 hora para acesso positivo
-    CACHE_TTL_NEGATIVE = 600  # 10 minutos para acesso negativo
+    A decisão é uma consulta ao conjunto de permissões materializado do usuário
+    (sistema.utils.permissoes), invalidado pelos signals: sem query por request.
+    """
 
     def has_permission(self, request, view):
         user = request.user
@@ -311,145 +294,33 @@ class PodeAcessarRotasFuncionario(permissions.BasePermission):
         if user.is_superuser:
             return True
 
-        # Verifica se o usuário é funcionário ativo de alguma empresa
-        funcionarios = Funcionario.objects.filter(user=user, status='1')
+        try:
+            permissoes_usuario = obter_contexto(request.user).permissoes
+        except Exception as e:
+            print(f"Erro ao verificar acesso: {str(e)}")
+            return False
 
-        if not funcionarios.exists():
+        # Usuário precisa ser funcionário ativo de alguma empresa
+        if not permissoes_usuario.ativo:
             return False
 
         # Se é ADMIN em alguma empresa → PERMITE TUDO
-        if funcionarios.filter(role=Funcionario.ADMIN).exists():
+        if permissoes_usuario.admin:
             return True
 
         # Para funcionários não-ADMIN, verificar acesso específico à rota
-        return self._verificar_acesso_rota_funcionario(request, user)
-
-    def _verificar_acesso_rota_funcionario(self, request, user):
-        """
-        Verifica se o funcionário tem acesso à rota específica
-        """
-        try:
-            # Obter informações da rota atual
-            path = request.path
-            metodo = request.method.upper()
-
-            # Tentar obter do cache
-            cache_key = f"rota_access_{user.id}_{metodo}_{path}"
-            cached_result = cache.get(cache_key)
-
-            if cached_result is not None:
-                return cached_result
-
-            # Buscar a rota no sistema que corresponde ao path
-            rota_sistema = self._encontrar_rota_correspondente(path, metodo)
-
-            if not rota_sistema:
-                # Salvar resultado negativo no cache
-                cache.set(cache_key, False, self.CACHE_TTL_NEGATIVE)
-                return False
-
-            # Verificar acesso direto através de RotasPermitidas
-            acesso_direto = RotasPermitidas.objects.filter(
-                funcionario__user=user,
-                funcionario__status='1',
-                rota__rotas=rota_sistema,  # Grupo que contém esta rota
-                status='1'
-            ).exists()
-
-            if acesso_direto:
-                # Salvar acesso positivo no cache
-                cache.set(cache_key, True, self.CACHE_TTL_ACCESS)
-                return True
-
-            # Verificar acesso através de grupos de rotas
-            acesso_grupo = GrupoRotaSistema.objects.filter(
-                usuario=user,
-                rotas=rota_sistema
-            ).exists()
-
-            if acesso_grupo:
-                # Salvar acesso positivo no cache
-                cache.set(cache_key, True, self.CACHE_TTL_ACCESS)
-                return True
-
-            # Salvar resultado negativo no cache
-            cache.set(cache_key, False, self.CACHE_TTL_NEGATIVE)
+        rota_sistema = self._encontrar_rota_correspondente(request.path, request.method)
+        if not rota_sistema:
             return False
 
-        except Exception as e:
-            print(f"Erro ao verificar acesso: {str(e)}")
-            return False
+        return permissoes_usuario.pode_acessar(request.method, rota_sistema.path)
 
     def _encontrar_rota_correspondente(self, path, metodo):
         """
-        Encontra a rota do sistema que melhor corresponde ao path solicitado
-        Com suporte a cache e regex para parâmetros
+        Encontra a rota do sistema que corresponde ao path solicitado
+        (matcher compilado por processo: literais antes de parâmetros, barra final opcional)
         """
-        # Normalizar o path (remover trailing slash para consistência)
-        normalized_path = path.rstrip('/')
-
-        # Tentar obter do cache de rotas
-        cache_key = f"rota_match_{metodo}_{normalized_path}"
-        cached_rota_id = cache.get(cache_key)
-
-        if cached_rota_id:
-            try:
-                return RotaSistema.objects.get(id=cached_rota_id)
-            except RotaSistema.DoesNotExist:
-                pass
-
-        # Buscar TODAS as rotas do sistema com este método
-        rotas_possiveis = RotaSistema.objects.filter(metodo=metodo)
-
-        for rota in rotas_possiveis:
-            rota_path = rota.path.rstrip('/')
-
-            # Se a rota não tem parâmetros, fazer match exato
-            if '<' not in rota_path and '>' not in rota_path:
-                if normalized_path == rota_path:
-                    # Salvar no cache
-                    cache.set(cache_key, rota.id, self.CACHE_TTL_ACCESS)
-                    return rota
-                continue
-
-            # Se a rota tem parâmetros, fazer match por padrão
-            # Exemplo: rota_path = "/api/v1/nfes/<int:pk>/"
-            #          normalized_path = "/api/v1/nfes/123"
-
-            # Criar regex a partir do path da rota
-            pattern = self._convert_route_to_regex(rota_path)
-
-            if re.match(pattern, normalized_path):
-                # Salvar no cache
-                cache.set(cache_key, rota.id, self.CACHE_TTL_ACCESS)
-                return rota
-
-        return None
-
-    def _convert_route_to_regex(self, route_path):
-        """
-        Converte uma rota Django com parâmetros para regex
-        Exemplo: "/api/v1/nfes/<int:pk>/" → "^/api/v1/nfes/[0-9]+/?$"
-        """
-
-        # Normalizar o path
-        path = route_path.rstrip('/')
-
-        # Mapeamento de tipos de parâmetros para regex
-        param_patterns = {
-            r'<int:\w+>': r'[0-9]+',           # inteiro
-            r'<uuid:\w+>': r'[a-f0-9-]{36}',    # UUID
-            r'<slug:\w+>': r'[a-z0-9-]+',       # slug
-            r'<str:\w+>': r'[^/]+',             # string
-            r'<\w+>': r'[^/]+',                 # genérico
-        }
-
-        # Aplicar cada padrão
-        for pattern, replacement in param_patterns.items():
-            path = re.sub(pattern, replacement, path)
-
-        # Adicionar âncoras de início e fim, e tornar a barra final opcional
-        return f'^{path}/?$'
+        return encontrar_rota(path, metodo)
 
     def has_object_permission(self, request, view, obj):
         return self.has_permission(request, view)
@@ -514,16 +385,17 @@ class ClearPermissionCache(permissions.BasePermission):
         cache_keys = [
             "user_system_access_*",
             "user_empresa_access_*",
-            "user_funcionario_access_*",
             "user_independent_or_admin_*",
-            "rota_access_*",
-            "rota_match_*",
+            "permissoes_funcionario_*",
             "user_manage_rotas_*",
         ]
 
         for pattern in cache_keys:
             cache.delete_pattern(pattern)
 
+        invalidar_rotas()
+        invalidar_todas()
+
         return True
 
 
@@ -163,6 +163,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     # Utilizando Rest Framework
     'rest_framework',
     # Simplejwt
@@ -207,6 +208,8 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'app.core.middleware.CookieAuthenticationMiddleware',
+    'app.core.middleware.BancoEmpresaMiddleware',
+    'app.core.middleware.ContextoEmpresaMiddleware',
 ]
 
 ROOT_URLCONF = 'app.urls'
@@ -271,6 +274,9 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 # ==================== LOGS ====================
+# O FileHandler não cria o diretório (os .log não vão para o repositório)
+os.makedirs(os.path.join(BASE_DIR, 'logs'), exist_ok=True)
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -305,6 +311,17 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles/')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
+# Acervo de XMLs fiscais (gzip, endereçado por conteúdo): MEDIA_ROOT/<dir>/<empresa>/<hh>/<hh>/<sha256>.xml.gz
+XML_ARQUIVO_DIR = os.getenv('XML_ARQUIVO_DIR', 'xml_arquivo')
+XML_ARQUIVO_NIVEL_GZIP = int(os.getenv('XML_ARQUIVO_NIVEL_GZIP', '6'))
+# Threads que gravam o acervo fora do caminho crítico da distribuição DF-e
+XML_ARQUIVO_GRAVADORES = int(os.getenv('XML_ARQUIVO_GRAVADORES', '4'))
+
+# DANFE renderizado pela task nfe.tasks.gerar_danfe: MEDIA_ROOT/<dir>/<empresa>/<chave>-<versao do XML>.pdf
+DANFE_DIR = os.getenv('DANFE_DIR', 'danfe')
+# Segundos em que uma renderização enfileirada bloqueia novos enfileiramentos do mesmo PDF
+DANFE_RENDERIZACAO_TIMEOUT = int(os.getenv('DANFE_RENDERIZACAO_TIMEOUT', '600'))
+
 # ==================== FILE UPLOAD LIMIT ====================
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = 104857600  # 100MB
@@ -355,6 +372,33 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 APP_VERSION = '1.0.0'
 MAX_FILE_UPLOAD_SIZE = 104857600  # 100MB
 
+# Lote ZIP de NFe: processos que fazem o parse e threads (conexões) que gravam no banco
+NFE_LOTE_PROCESSOS = int(os.getenv('NFE_LOTE_PROCESSOS', os.cpu_count() or 2))
+NFE_LOTE_ESCRITORES = int(os.getenv('NFE_LOTE_ESCRITORES', '4'))
+NFE_LOTE_TAMANHO_BLOCO = int(os.getenv('NFE_LOTE_TAMANHO_BLOCO', '200'))
+
+# Exportação em ZIP (XML + DANFE): notas por task de renderização, nível do deflate e horas até o ZIP ser apagado
+NFE_EXPORTACAO_DANFES_POR_TASK = int(os.getenv('NFE_EXPORTACAO_DANFES_POR_TASK', '50'))
+NFE_EXPORTACAO_NIVEL_ZIP = int(os.getenv('NFE_EXPORTACAO_NIVEL_ZIP', '6'))
+NFE_EXPORTACAO_RETENCAO_HORAS = int(os.getenv('NFE_EXPORTACAO_RETENCAO_HORAS', '24'))
+
+# Bancos próprios das empresas: aliases mantidos por processo e intervalo (segundos) entre testes de conexão
+EMPRESA_DB_MAX_CONEXOES = int(os.getenv('EMPRESA_DB_MAX_CONEXOES', '32'))
+EMPRESA_DB_HEALTHCHECK_TTL = int(os.getenv('EMPRESA_DB_HEALTHCHECK_TTL', '300'))
+# Cache (segundos) de "empresa tem banco próprio?"; invalidado ao salvar/excluir ConexaoBanco
+EMPRESA_DB_TOPOLOGIA_TTL = int(os.getenv('EMPRESA_DB_TOPOLOGIA_TTL', '86400'))
+# Threads da leitura federada (matriz + filiais em bancos próprios consultados em paralelo)
+EMPRESA_DB_FANOUT_THREADS = int(os.getenv('EMPRESA_DB_FANOUT_THREADS', '8'))
+
+# Intervalo (segundos) em que cada processo confere se as rotas (RotaSistema) mudaram e remonta o matcher
+ROTAS_SISTEMA_VERIFICACAO_SEGUNDOS = int(os.getenv('ROTAS_SISTEMA_VERIFICACAO_SEGUNDOS', '30'))
+
+# Tempo (segundos) que o conjunto de permissões de cada usuário fica no cache (os signals invalidam antes)
+PERMISSOES_FUNCIONARIO_TTL = int(os.getenv('PERMISSOES_FUNCIONARIO_TTL', '3600'))
+
+# Tempo (segundos) que certificados A1 e sessões HTTPS com a SEFAZ ficam em cache por processo
+SEFAZ_CACHE_TTL = int(os.getenv('SEFAZ_CACHE_TTL', '1800'))
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Azevedo sistemas',
     'DESCRIPTION': 'Documentação dos sistemas da azevedo',
@@ -406,6 +450,15 @@ REDIS_DB = os.environ.get('REDIS_DB', '0')
 CELERY_BROKER_URL = f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}'
 CELERY_RESULT_BACKEND = f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}'
 
+# Cache do Django no Redis: compartilhado entre web e workers (resultados de tasks, rotas de banco)
+REDIS_CACHE_DB = os.environ.get('REDIS_CACHE_DB', '1')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_CACHE_DB}',
+    }
+}
+
 # Serialization
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
@@ -445,8 +498,29 @@ CELERY_BEAT_SCHEDULE = {
             'expires': 1800,  # Expira após 30 minutos
         }
     },
+    # Expurgo diário da auditoria de NSU (HistoricoNSU) além da retenção configurada
+    'expurgar-historico-nsu': {
+        'task': 'nfe.tasks.expurgar_historico_nsu',
+        'schedule': crontab(hour=3, minute=15),
+    },
+    # Remove os ZIPs de exportação de NFe além de NFE_EXPORTACAO_RETENCAO_HORAS
+    'expurgar-exportacoes-nfe': {
+        'task': 'nfe.tasks.expurgar_exportacoes_nfe',
+        'schedule': crontab(minute=45),
+    },
 }
 
+# Automação NFe: máximo de empresas consultando a mesma SEFAZ (UF) ao mesmo tempo
+NFE_AUTOMACAO_MAX_POR_UF = int(os.getenv('NFE_AUTOMACAO_MAX_POR_UF', '3'))
+# Páginas de distDFe (até 50 documentos cada) drenadas por empresa em cada execução
+NFE_AUTOMACAO_MAX_PAGINAS = int(os.getenv('NFE_AUTOMACAO_MAX_PAGINAS', '40'))
+# Espera exigida pela SEFAZ após cStat 137/656 ou backlog zerado (ultNSU == maxNSU)
+NFE_AUTOMACAO_ESPERA_SEFAZ_MINUTOS = int(os.getenv('NFE_AUTOMACAO_ESPERA_SEFAZ_MINUTOS', '60'))
+# O NSU atual vive no CursorNSU; HistoricoNSU é só auditoria (uma linha por página) e pode ser desligada
+NFE_HISTORICO_NSU_AUDITORIA = os.getenv('NFE_HISTORICO_NSU_AUDITORIA', 'True').lower() in ('true', '1', 't')
+# Dias mantidos na auditoria de NSU (0 = não expurga)
+NFE_HISTORICO_NSU_RETENCAO_DIAS = int(os.getenv('NFE_HISTORICO_NSU_RETENCAO_DIAS', '180'))
+
 # Lock timeout para evitar execução simultânea
 CELERY_TASK_SOFT_TIME_LIMIT = 60 * 25  # 25 minutos
 CELERY_TASK_TIME_LIMIT = 60 * 30  # 30 minutos
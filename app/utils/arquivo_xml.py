@@ -0,0 +1,146 @@
+"""
+Acervo de XMLs fiscais compactados e endereçados por conteúdo.
+
+Os documentos são guardados em gzip (o docZip da distribuição DF-e é gravado
+como chegou, sem descompactar e reserializar) em
+
+    MEDIA_ROOT/<XML_ARQUIVO_DIR>/<empresa_id>/<hh>/<hh>/<sha256>.xml.gz
+
+onde o sha256 é o dos bytes gravados. O mesmo documento recebido de novo cai
+no mesmo arquivo (NSUs repetidos entre empresas não se sobrescrevem) e os
+dois níveis de prefixo mantêm os diretórios pequenos.
+
+A leitura descompacta sob demanda e aceita também os arquivos soltos antigos
+(media/xml/*.xml), então os caminhos já gravados nos models continuam válidos.
+
+Uso:
+
+    caminho = salvar_gzip(empresa.id, base64.b64decode(doc_zip))
+    caminho, futuro = salvar_gzip_em_segundo_plano(empresa.id, conteudo_gzip)
+    caminho = salvar_xml(empresa.id, conteudo_xml)
+    with abrir(caminho) as arquivo:   # bytes do XML, descompactados em streaming
+        ...
+"""
+
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+EXTENSAO = '.xml.gz'
+
+_gravador = None
+_gravador_lock = threading.Lock()
+
+
+def _obter_gravador():
+    global _gravador
+    with _gravador_lock:
+        if _gravador is None:
+            _gravador = ThreadPoolExecutor(
+                max_workers=settings.XML_ARQUIVO_GRAVADORES,
+                thread_name_prefix='arquivo_xml',
+            )
+        return _gravador
+
+
+def caminho_absoluto(caminho):
+    """Caminho no disco de um XML do acervo ou de um arquivo solto (relativo ao MEDIA_ROOT)"""
+    caminho = str(caminho).replace('\\', '/')
+    if os.path.isabs(caminho):
+        return caminho
+    if caminho.startswith('media/'):
+        caminho = caminho[6:]
+    return os.path.join(settings.MEDIA_ROOT, caminho)
+
+
+def _caminho_relativo(empresa_id, digest):
+    return '/'.join([settings.XML_ARQUIVO_DIR, str(empresa_id), digest[:2], digest[2:4], f'{digest}{EXTENSAO}'])
+
+
+def caminho_gzip(empresa_id, conteudo_gzip):
+    """Caminho (relativo ao MEDIA_ROOT) que salvar_gzip usará para estes bytes"""
+    return _caminho_relativo(empresa_id, hashlib.sha256(conteudo_gzip).hexdigest())
+
+
+def salvar_gzip(empresa_id, conteudo_gzip):
+    """
+    Grava bytes já compactados (ex.: docZip decodificado do base64) e retorna o
+    caminho relativo ao MEDIA_ROOT. Se o conteúdo já existe no acervo, nada é gravado.
+    """
+    relativo = caminho_gzip(empresa_id, conteudo_gzip)
+    absoluto = caminho_absoluto(relativo)
+    if os.path.exists(absoluto):
+        return relativo
+
+    diretorio = os.path.dirname(absoluto)
+    os.makedirs(diretorio, exist_ok=True)
+
+    # Arquivo temporário + rename: leitores nunca veem um gzip pela metade
+    descritor, temporario = tempfile.mkstemp(dir=diretorio, suffix='.tmp')
+    try:
+        with os.fdopen(descritor, 'wb') as arquivo:
+            arquivo.write(conteudo_gzip)
+        os.replace(temporario, absoluto)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+    return relativo
+
+
+def salvar_gzip_em_segundo_plano(empresa_id, conteudo_gzip):
+    """
+    Como salvar_gzip, mas a gravação roda em uma thread do pool do acervo.
+    Retorna (caminho, future): o caminho já pode ser gravado nos models; quem
+    chamou espera o future antes de considerar o documento persistido.
+    """
+    return caminho_gzip(empresa_id, conteudo_gzip), _obter_gravador().submit(salvar_gzip, empresa_id, conteudo_gzip)
+
+
+def salvar_xml(empresa_id, conteudo):
+    """Compacta e grava um XML (bytes ou str); mtime fixo para o mesmo XML gerar o mesmo hash"""
+    if isinstance(conteudo, str):
+        conteudo = conteudo.encode('utf-8')
+    return salvar_gzip(empresa_id, gzip.compress(conteudo, compresslevel=settings.XML_ARQUIVO_NIVEL_GZIP, mtime=0))
+
+
+def abrir(caminho):
+    """Abre (binário) o XML; .xml.gz é descompactado em streaming durante a leitura"""
+    absoluto = caminho_absoluto(caminho)
+    if not os.path.exists(absoluto):
+        raise FileNotFoundError(f"Arquivo não encontrado: {absoluto}")
+
+    if absoluto.endswith('.gz'):
+        return gzip.open(absoluto, 'rb')
+    return open(absoluto, 'rb')
+
+
+def ler(caminho):
+    """Bytes do XML descompactado"""
+    with abrir(caminho) as arquivo:
+        return arquivo.read()
+
+
+def iterar(caminho, tamanho_bloco=64 * 1024):
+    """Gera o XML descompactado em blocos (para StreamingHttpResponse)"""
+    with abrir(caminho) as arquivo:
+        while True:
+            bloco = arquivo.read(tamanho_bloco)
+            if not bloco:
+                break
+            yield bloco
+
+
+def nome_base(caminho):
+    """Nome do arquivo sem .xml/.xml.gz (ex.: para nomear o PDF do DANFE)"""
+    nome = os.path.basename(str(caminho).replace('\\', '/'))
+    for extensao in (EXTENSAO, '.xml'):
+        if nome.endswith(extensao):
+            return nome[:-len(extensao)]
+    return os.path.splitext(nome)[0]
@@ -0,0 +1,161 @@
+"""
+Contexto de empresa (tenant) do usuário, resolvido uma vez por request.
+
+Tipo de usuário, empresa, matriz, filiais, banco próprio e sistemas liberados
+vêm do conjunto de permissões materializado (sistema.utils.permissoes): uma ida
+ao cache na primeira leitura e nenhuma query enquanto o conjunto estiver
+válido. Filiais e banco próprio só são resolvidos quando alguém os lê.
+
+O ContextoEmpresaMiddleware abre um registro por thread no início do request e
+o descarta no fim; obter_contexto(user) devolve sempre o mesmo objeto dentro do
+request (até um signal de permissões descartar os contextos). Fora de um
+request (tasks, shell) cada chamada monta um contexto novo.
+
+    contexto = obter_contexto(request.user)
+    contexto.matriz_sistema(3), contexto.sistema_liberado(empresa_id, 3)
+"""
+
+import threading
+from functools import cached_property
+
+from empresa.models import Empresa, Funcionario
+from sistema.utils.permissoes import PermissoesFuncionario, obter_permissoes
+
+_registro = threading.local()
+
+SUPERUSUARIO = 'superusuario'
+DONO = 'dono'
+FUNCIONARIO = 'funcionario'
+
+
+class ContextoEmpresa:
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def permissoes(self):
+        if not self.user.is_authenticated:
+            return PermissoesFuncionario(None, [], [], [], [], [])
+        return obter_permissoes(self.user.id)
+
+    @cached_property
+    def tipo_usuario(self):
+        """superusuario, dono (tem empresa ativa), funcionario (vínculo ativo) ou None"""
+        if self.user.is_superuser:
+            return SUPERUSUARIO
+        if any(status == '1' for _, _, status, _ in self.permissoes.empresas_dono):
+            return DONO
+        if self.permissoes.vinculos:
+            return FUNCIONARIO
+        return None
+
+    @cached_property
+    def empresa_id(self):
+        """Primeira empresa ativa de que é dono; senão a do primeiro vínculo em empresa ativa"""
+        for empresa_id, _, status, _ in self.permissoes.empresas_dono:
+            if status == '1':
+                return empresa_id
+        for _, empresa_id, _, _, status_empresa, _ in self.permissoes.vinculos:
+            if status_empresa == '1':
+                return empresa_id
+        return None
+
+    @cached_property
+    def matriz_id(self):
+        """Matriz da empresa do contexto (ela mesma quando não é filial)"""
+        if self.empresa_id is None:
+            return None
+        for empresa_id, matriz_id, _, _ in self.permissoes.empresas_dono:
+            if empresa_id == self.empresa_id:
+                return matriz_id or empresa_id
+        for _, empresa_id, _, matriz_id, _, _ in self.permissoes.vinculos:
+            if empresa_id == self.empresa_id:
+                return matriz_id or empresa_id
+        return self.empresa_id
+
+    @cached_property
+    def filiais_ids(self):
+        """Filiais ativas da matriz do contexto (única query do contexto, feita sob demanda)"""
+        if self.matriz_id is None:
+            return []
+        return list(
+            Empresa.objects.filter(matriz_filial_id=self.matriz_id, status='1').order_by('id')
+            .values_list('id', flat=True)
+        )
+
+    @cached_property
+    def banco_proprio(self):
+        # Import local: database_utils depende dos models de db_allnube_empresa
+        from db_allnube_empresa.utils.database_utils import DatabaseManager
+
+        if self.matriz_id is None:
+            return False
+        return DatabaseManager.empresa_tem_banco_proprio(self.matriz_id)
+
+    def matriz_sistema(self, sistema_id):
+        """
+        Mesma regra de obter_matriz_funcionario: empresa do vínculo de
+        funcionário no sistema; senão a matriz ativa do dono no sistema; senão
+        qualquer empresa ativa do dono no sistema.
+        """
+        for _, empresa_id, role, _, _, empresa_sistema in self.permissoes.vinculos:
+            if role == Funcionario.FUNCIONARIO and empresa_sistema == sistema_id:
+                return empresa_id
+
+        ativas = [
+            (empresa_id, matriz_id)
+            for empresa_id, matriz_id, status, empresa_sistema in self.permissoes.empresas_dono
+            if status == '1' and empresa_sistema == sistema_id
+        ]
+        for empresa_id, matriz_id in ativas:
+            if matriz_id is None:
+                return empresa_id
+        return ativas[0][0] if ativas else None
+
+    def tem_sistema(self, sistema_id):
+        """Dono de empresa ativa no sistema ou funcionário ativo de uma"""
+        if self.user.is_superuser:
+            return True
+        if any(status == '1' and sistema == sistema_id for _, _, status, sistema in self.permissoes.empresas_dono):
+            return True
+        return any(
+            status_empresa == '1' and sistema == sistema_id
+            for _, _, _, _, status_empresa, sistema in self.permissoes.vinculos
+        )
+
+    def conhece_empresa(self, empresa_id):
+        return empresa_id in self.permissoes.empresas
+
+    def sistema_liberado(self, empresa_id, sistema_id):
+        return self.permissoes.sistema_liberado(empresa_id, sistema_id)
+
+
+def iniciar_request():
+    _registro.contextos = {}
+
+
+def encerrar_request():
+    _registro.contextos = None
+
+
+def descartar_contextos():
+    """Permissões alteradas durante o request: os contextos são remontados na próxima leitura"""
+    if getattr(_registro, 'contextos', None):
+        _registro.contextos = {}
+
+
+def obter_contexto(user):
+    contextos = getattr(_registro, 'contextos', None)
+    if contextos is None:
+        return ContextoEmpresa(user)
+
+    contexto = contextos.get(user.pk)
+    if contexto is None:
+        contexto = contextos[user.pk] = ContextoEmpresa(user)
+    return contexto
+
+
+def contextos_do_request():
+    """Contextos já montados neste request (normalmente um só)"""
+    return list((getattr(_registro, 'contextos', None) or {}).values())
@@ -0,0 +1,84 @@
+"""
+DANFE em PDF, renderizado uma única vez por versão do XML.
+
+Os PDFs ficam em
+
+    MEDIA_ROOT/<DANFE_DIR>/<empresa_id>/<chave>-<versao>.pdf
+
+onde a versão identifica o conteúdo do XML (no acervo o nome do arquivo já é
+o sha256; para os XMLs soltos antigos o hash é calculado). Enquanto o XML da
+nota não muda, o mesmo PDF é servido direto do storage.
+
+A renderização roda na task nfe.tasks.gerar_danfe. A view só consulta o
+storage e, se o PDF ainda não existe, enfileira a task e responde 202; o
+cliente repete a chamada até receber o PDF. As chaves de cache abaixo evitam
+enfileirar a mesma renderização duas vezes e guardam a falha da última
+tentativa para a próxima consulta.
+
+Uso:
+
+    relativo = caminho_pdf(nota.empresa_id, nota.chave, nota.fileXml.name)
+    if not existe(relativo):
+        renderizar(nota.fileXml.name, relativo)
+"""
+
+import hashlib
+import os
+import tempfile
+
+from brazilfiscalreport.danfe import Danfe
+from django.conf import settings
+
+from app.utils import arquivo_xml
+
+
+def versao_xml(caminho_xml):
+    """Identificador curto do conteúdo do XML"""
+    nome = os.path.basename(str(caminho_xml).replace('\\', '/'))
+    if nome.endswith(arquivo_xml.EXTENSAO):
+        digest = arquivo_xml.nome_base(nome)
+    else:
+        digest = hashlib.sha256(arquivo_xml.ler(caminho_xml)).hexdigest()
+    return digest[:16]
+
+
+def caminho_pdf(empresa_id, chave, caminho_xml):
+    """Caminho (relativo ao MEDIA_ROOT) do DANFE desta versão do XML"""
+    return '/'.join([settings.DANFE_DIR, str(empresa_id), f'{chave}-{versao_xml(caminho_xml)}.pdf'])
+
+
+def existe(relativo):
+    return os.path.exists(arquivo_xml.caminho_absoluto(relativo))
+
+
+def chave_pendente(relativo):
+    return f'danfe:pendente:{relativo}'
+
+
+def chave_erro(relativo):
+    return f'danfe:erro:{relativo}'
+
+
+def renderizar(caminho_xml, relativo):
+    """Gera o PDF; se ele já existe (outra task chegou antes), nada é feito"""
+    absoluto = arquivo_xml.caminho_absoluto(relativo)
+    if os.path.exists(absoluto):
+        return relativo
+
+    diretorio = os.path.dirname(absoluto)
+    os.makedirs(diretorio, exist_ok=True)
+
+    danfe = Danfe(xml=arquivo_xml.ler(caminho_xml).decode('utf-8'))
+
+    # Arquivo temporário + rename: a view nunca serve um PDF pela metade
+    descritor, temporario = tempfile.mkstemp(dir=diretorio, suffix='.tmp')
+    os.close(descritor)
+    try:
+        danfe.output(temporario)
+        os.replace(temporario, absoluto)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+    return relativo
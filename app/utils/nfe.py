@@ -1,8 +1,9 @@
 import os
 import logging
 import xml.etree.ElementTree as ET
-from pynfe.processamento.comunicacao import ComunicacaoSefaz
 
+from app.utils import arquivo_xml
+from app.utils.sefaz import obter_comunicacao_sefaz
 from empresa.models import Empresa
 from nfe_resumo.models import ResumoNFe
 
@@ -60,12 +61,7 @@ class Nfe:
     def testar_conexao_sefaz(self):
         """Testa se a comunicação com a SEFAZ está funcionando"""
         try:
-            ComunicacaoSefaz(
-                self.uf,
-                self.certificado_path,
-                self.certificado_senha,
-                self.homologacao
-            )
+            obter_comunicacao_sefaz(self.empresa, self.uf, self.homologacao)
             logging.info("Comunicação com a SEFAZ inicializada com sucesso")
             return True
         except Exception as e:
@@ -95,12 +91,7 @@ class Nfe:
         Tenta baixar o XML completo da NF-e usando o webservice de download
         """
         try:
-            comunicacao = ComunicacaoSefaz(
-                self.uf,
-                self.certificado_path,
-                self.certificado_senha,
-                self.homologacao
-            )
+            comunicacao = obter_comunicacao_sefaz(self.empresa, self.uf, self.homologacao)
 
             # Método para download de NFe (depende da biblioteca)
             resposta = comunicacao.consulta_nota(
@@ -132,8 +123,8 @@ class Nfe:
                     return None
 
                 try:
-                    with open(self.resumo.file_xml.path, 'rb') as f:  # Abrir em modo binário
-                        xml_content = f.read().decode('utf-8')  # Decodificar para string
+                    # Acervo (.xml.gz) ou arquivo solto
+                    xml_content = arquivo_xml.ler(self.resumo.file_xml.name).decode('utf-8')
                 except Exception as e:
                     logging.error(f"Erro ao ler arquivo XML: {str(e)}")
                     return None
@@ -167,12 +158,7 @@ class Nfe:
     def consultar_nfe(self):
         """Consulta a NFe antes de manifestar"""
         try:
-            comunicacao = ComunicacaoSefaz(
-                self.uf,
-                self.certificado_path,
-                self.certificado_senha,
-                self.homologacao
-            )
+            comunicacao = obter_comunicacao_sefaz(self.empresa, self.uf, self.homologacao)
 
             if hasattr(comunicacao, 'consulta_nota'):
                 resposta = comunicacao.consulta_nota(
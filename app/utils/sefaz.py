@@ -0,0 +1,170 @@
+"""
+Cache (por processo) de certificados A1 e clientes ComunicacaoSefaz por empresa.
+
+O pynfe, a cada requisição, relê o .pfx, decodifica o PKCS#12, grava a chave e
+o certificado em arquivos temporários e abre uma conexão HTTPS nova. Aqui o
+certificado é decodificado uma única vez por (empresa, mtime do arquivo) e os
+clientes reutilizam uma requests.Session (keep-alive) por (UF, ambiente).
+
+As entradas expiram após SEFAZ_CACHE_TTL segundos ou quando o arquivo do
+certificado da empresa muda.
+
+Uso:
+
+    comunicacao = obter_comunicacao_sefaz(empresa, uf='AN', homologacao=False)
+    assinatura = obter_assinatura_a1(empresa)
+"""
+
+import os
+import re
+import time
+import atexit
+import tempfile
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+
+from pynfe.entidades.certificado import CertificadoA1
+from pynfe.processamento.assinatura import Assinatura, AssinaturaA1
+from pynfe.processamento.comunicacao import ComunicacaoSefaz
+from pynfe.utils import etree
+
+
+class ComunicacaoSefazCacheada(ComunicacaoSefaz):
+    """ComunicacaoSefaz que envia pela sessão HTTPS compartilhada (certificado já separado)"""
+
+    def __init__(self, uf, certificado, certificado_senha, homologacao=False, sessao=None):
+        super().__init__(uf, certificado, certificado_senha, homologacao)
+        self.sessao = sessao
+
+    def _post(self, url, xml, timeout=None):
+        # Mesmo tratamento do ComunicacaoSefaz._post, sem separar o .pfx a cada chamada
+        xml_declaration = '<?xml version="1.0" encoding="UTF-8"?>'
+
+        # limpa xml com caracteres bugados para infNFeSupl em NFC-e
+        xml = re.sub(
+            "<qrCode>(.*?)</qrCode>",
+            lambda x: x.group(0).replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", ""),
+            etree.tostring(xml, encoding="unicode").replace("\n", ""),
+        )
+
+        result = self.sessao.post(
+            url,
+            xml_declaration + xml,
+            headers=self._post_header(),
+            timeout=timeout,
+        )
+        result.encoding = "utf-8"
+        return result
+
+
+class _CertificadoEmpresa:
+    """Certificado decodificado de uma empresa + sessão HTTPS e clientes por (UF, ambiente)"""
+
+    def __init__(self, caminho, senha):
+        self.caminho = caminho
+        self.senha = senha
+        self.chave, self.cert = CertificadoA1(caminho).separar_arquivo(senha)
+        self.criado_em = time.monotonic()
+
+        # A sessão do requests precisa do par em arquivo; ficam até a entrada expirar
+        with tempfile.NamedTemporaryFile(suffix='.pem', delete=False) as arquivo_cert:
+            arquivo_cert.write(self.cert.encode('utf-8'))
+        with tempfile.NamedTemporaryFile(suffix='.pem', delete=False) as arquivo_chave:
+            arquivo_chave.write(self.chave)
+        self.arquivos = (arquivo_cert.name, arquivo_chave.name)
+
+        self.sessao = requests.Session()
+        self.sessao.cert = self.arquivos
+        self.sessao.verify = False
+        self.sessao.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
+        self.clientes = {}
+        self.assinatura = None
+
+    def expirado(self, ttl):
+        return time.monotonic() - self.criado_em > ttl
+
+    def cliente(self, uf, homologacao):
+        chave = (uf, homologacao)
+        if chave not in self.clientes:
+            self.clientes[chave] = ComunicacaoSefazCacheada(
+                uf, self.caminho, self.senha, homologacao, sessao=self.sessao
+            )
+        return self.clientes[chave]
+
+    def assinatura_a1(self):
+        if self.assinatura is None:
+            # Evita o AssinaturaA1.__init__, que decodificaria o .pfx de novo
+            assinatura = AssinaturaA1.__new__(AssinaturaA1)
+            Assinatura.__init__(assinatura, self.caminho, self.senha)
+            assinatura.key, assinatura.cert = self.chave, self.cert
+            self.assinatura = assinatura
+        return self.assinatura
+
+    def fechar(self):
+        self.sessao.close()
+        for caminho in self.arquivos:
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _obter_certificado(empresa):
+    if not empresa.file:
+        raise ValueError('Certificado não encontrado para a empresa')
+
+    caminho = empresa.file.path
+    chave = (empresa.id, os.path.getmtime(caminho))
+    ttl = settings.SEFAZ_CACHE_TTL
+
+    with _lock:
+        _remover_expirados(ttl)
+
+        certificado = _cache.get(chave)
+        if certificado is None:
+            # Certificado trocado: descarta as entradas antigas da empresa
+            for antiga in [c for c in _cache if c[0] == empresa.id]:
+                _cache.pop(antiga).fechar()
+
+            certificado = _CertificadoEmpresa(caminho, empresa.senha)
+            _cache[chave] = certificado
+
+        return certificado
+
+
+def _remover_expirados(ttl):
+    for chave in [c for c, certificado in _cache.items() if certificado.expirado(ttl)]:
+        _cache.pop(chave).fechar()
+
+
+def obter_comunicacao_sefaz(empresa, uf=None, homologacao=False):
+    """Cliente ComunicacaoSefaz da empresa (uf padrão: UF da empresa)"""
+    certificado = _obter_certificado(empresa)
+    with _lock:
+        return certificado.cliente((uf or empresa.uf).upper(), homologacao)
+
+
+def obter_assinatura_a1(empresa):
+    """AssinaturaA1 com a chave/certificado da empresa já carregados"""
+    certificado = _obter_certificado(empresa)
+    with _lock:
+        return certificado.assinatura_a1()
+
+
+def limpar_cache_sefaz(empresa_id=None):
+    """Remove do cache uma empresa (ou todas) fechando sessões e arquivos temporários"""
+    with _lock:
+        for chave in [c for c in _cache if empresa_id is None or c[0] == empresa_id]:
+            _cache.pop(chave).fechar()
+
+
+atexit.register(limpar_cache_sefaz)
@@ -1,5 +1,3 @@
-import re
-
 from django.contrib.auth import get_user_model
 from django.db.models import Q
 
@@ -7,7 +5,8 @@ from rest_framework.permissions import BasePermission
 from rest_framework.exceptions import PermissionDenied
 
 from empresa.models import Empresa
-from sistema.models import EmpresaSistema, RotaSistema, GrupoRotaSistema
+from sistema.models import EmpresaSistema, GrupoRotaSistema
+from sistema.utils.rotas import encontrar_rota
 from acesso.models import UsuarioEmpresa, UsuarioSistema, UsuarioPermissaoRota
 
 
@@ -399,7 +398,7 @@ class TemAcessoSistema(BasePermission):
         IDENTIFICA A ROTA ATUAL NO BANCO DE DADOS
 
         Busca a rota cadastrada que corresponde ao path e método da request.
-        Suporta URLs com parâmetros através de conversão para regex.
+        Suporta URLs com parâmetros ({id}, <int:pk>...) via sistema.utils.rotas.
 
         EXEMPLOS DE MATCH:
         - Path request: "/api/v1/nfes/123/" 
@@ -412,67 +411,12 @@ class TemAcessoSistema(BasePermission):
         Returns:
             RotaSistema: Objeto da rota encontrada ou None se não encontrada
         """
-        path = request.path
-        metodo = request.method.upper()
-
         try:
-            # Busca TODAS as rotas cadastradas no sistema com eager loading do sistema
-            # select_related('sistema') otimiza performance evitando N+1 queries
-            rotas = RotaSistema.objects.select_related('sistema').all()
-
-            # Itera por todas as rotas cadastradas para encontrar match
-            for rota in rotas:
-                # Verifica primeiro o método HTTP (filtro rápido)
-                if rota.metodo.upper() != metodo:
-                    continue  # Pula se método não coincide
-
-                # Converte o pattern da rota cadastrada para regex
-                pattern = self.converter_path_para_regex(rota.path)
-
-                # Verifica se o path da request match com o pattern da rota
-                if re.match(pattern, path):
-                    return rota  # Rota encontrada!
-
-            # Nenhuma rota cadastrada corresponde à request
-            return None
+            # Matcher compilado por processo (árvore de segmentos por método HTTP):
+            # custo proporcional ao tamanho do path, sem consultar o banco
+            return encontrar_rota(request.path, request.method)
 
         except Exception as e:
             # Em caso de erro no banco ou processamento, log e retorna None
             # Em produção, considerar logging do erro para debugging
             return None
-
-    def converter_path_para_regex(self, path):
-        """
-        CONVERSÃO DE PATH PARA REGEX - SUPORTE A PARÂMETROS
-
-        Converte paths com placeholders ({param}) para patterns regex
-        que podem matchar URLs com valores dinâmicos.
-
-        TRANSFORMAÇÕES:
-        - "/api/nfes/{id}/" → "^/api/nfes/[^/]+/$"
-        - "/api/users/{user_id}/posts/{post_id}/" → "^/api/users/[^/]+/posts/[^/]+/$"
-
-        Args:
-            path (str): Path da rota cadastrado (ex: "/api/nfes/{id}/")
-
-        Returns:
-            str: Pattern regex para matching
-        """
-        # FASE 1: Substitui placeholders {param} por grupos regex [^/]+
-        # [^/]+ = um ou mais caracteres que não sejam barra
-        pattern = re.sub(r'\{[^}]+\}', r'[^/]+', path)
-
-        # FASE 2: Escapa caracteres especiais do path (exceto placeholders)
-        # Ex: "/api.v1/nfes/" → "/api\.v1/nfes/" (ponto é escapado)
-        pattern = re.escape(pattern)
-
-        # FASE 3: Corrige as barras que foram escapadas indevidamente
-        pattern = pattern.replace(r'\/', '/')
-
-        # FASE 4: Corrige os placeholders que foram escapados
-        pattern = pattern.replace(r'[^/]+', '[^/]+')
-
-        # FASE 5: Adiciona âncoras para match exato
-        pattern = '^' + pattern + '$'
-
-        return pattern
@@ -1,10 +1,24 @@
+import json
+import base64
+import logging
+import operator
+from functools import reduce
+from collections import OrderedDict
+
 from rest_framework.pagination import PageNumberPagination
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
+from django.db import connections
+from django.db.models import F, Q, QuerySet
 from django.shortcuts import get_object_or_404
 
-from empresa.models import Funcionario, Empresa
+from empresa.models import Empresa
 from sistema.models import EmpresaSistema
+from app.utils.contexto_empresa import obter_contexto, contextos_do_request
+
+logger = logging.getLogger(__name__)
 
 
 class CustomPageSizePagination(PageNumberPagination):
@@ -13,6 +27,180 @@ class CustomPageSizePagination(PageNumberPagination):
     max_page_size = 100  # limite para evitar abuso
 
 
+class CursorOpcionalPagination(CustomPageSizePagination):
+    """
+    Paginação por página (padrão) ou, se o cliente pedir ?paginacao=cursor,
+    paginação por chave (keyset) sobre view.campos_cursor, sempre decrescente
+    (ex.: ('dhEmi', 'id') para notas, ('id',) para produtos/fornecedores).
+
+    No modo cursor não há COUNT(*) nem OFFSET: a página N custa o mesmo que a
+    primeira. ?contagem=estimada devolve em "count" a estimativa de linhas do
+    planner (EXPLAIN) em vez de None.
+    """
+    modo_query_param = 'paginacao'
+    cursor_query_param = 'cursor'
+    contagem_query_param = 'contagem'
+    campos_cursor_padrao = ('id',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        parametros = request.query_params
+        self.usando_cursor = parametros.get(self.modo_query_param) == 'cursor' or self.cursor_query_param in parametros
+        if not self.usando_cursor:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.campos = tuple(getattr(view, 'campos_cursor', self.campos_cursor_padrao))
+        self.page_size = self.get_page_size(request)
+        self.count = self._estimar_total(queryset) if request.query_params.get(
+            self.contagem_query_param) == 'estimada' else None
+
+        valores, self.anterior = self._decodificar_cursor(queryset.model, request)
+
+        queryset = self._ordenar(queryset)
+
+        if valores is not None:
+            queryset = queryset.filter(self._filtro_keyset(queryset.model, valores))
+
+        linhas = list(queryset[:self.page_size + 1])
+        self.tem_mais = len(linhas) > self.page_size
+        linhas = linhas[:self.page_size]
+        if self.anterior:
+            linhas.reverse()
+
+        self.tem_cursor = valores is not None
+        self.pagina = linhas
+        return linhas
+
+    def get_paginated_response(self, data):
+        if not self.usando_cursor:
+            return super().get_paginated_response(data)
+
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if not self.usando_cursor:
+            return super().get_next_link()
+        # Voltando pelo "previous" sempre há próxima página (a de onde viemos)
+        if not self.pagina or not (self.tem_mais if not self.anterior else True):
+            return None
+        return self._link(self.pagina[-1], anterior=False)
+
+    def get_previous_link(self):
+        if not self.usando_cursor:
+            return super().get_previous_link()
+        if not self.pagina or not (self.tem_mais if self.anterior else self.tem_cursor):
+            return None
+        return self._link(self.pagina[0], anterior=True)
+
+    def _link(self, linha, anterior):
+        valores = [self._serializar_valor(getattr(linha, campo)) for campo in self.campos]
+        cursor = base64.urlsafe_b64encode(json.dumps({'v': valores, 'a': anterior}).encode()).decode()
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def _decodificar_cursor(self, model, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            dados = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            valores = [
+                None if valor is None else model._meta.get_field(campo).to_python(valor)
+                for campo, valor in zip(self.campos, dados['v'])
+            ]
+            if len(valores) != len(self.campos):
+                raise ValueError('cursor incompleto')
+            return valores, bool(dados.get('a'))
+        except Exception:
+            raise NotFound('Cursor inválido.')
+
+    def _ordenar(self, queryset):
+        """
+        Decrescente com NULLs primeiro (crescente com NULLs por último ao voltar):
+        explícito para valer em qualquer backend, é a ordem padrão do PostgreSQL e
+        a dos índices '-campo'. A ConsultaFederada já aplica isso em cada shard.
+        """
+        if not isinstance(queryset, QuerySet):
+            return queryset.order_by(*(self.campos if self.anterior else [f'-{campo}' for campo in self.campos]))
+        if self.anterior:
+            return queryset.order_by(*[F(campo).asc(nulls_last=True) for campo in self.campos])
+        return queryset.order_by(*[F(campo).desc(nulls_first=True) for campo in self.campos])
+
+    def _filtro_keyset(self, model, valores):
+        """
+        Linhas depois (ou antes, se anterior) da chave na ordem de _ordenar
+        (decrescente, NULLs primeiro): (c1, c2, ...) < (v1, v2, ...) campo a campo.
+        """
+        condicoes = []
+        prefixo = Q()
+        for campo, valor in zip(self.campos, valores):
+            anulavel = model._meta.get_field(campo).null
+            if valor is None:
+                if not self.anterior:
+                    condicoes.append(prefixo & Q(**{f'{campo}__isnull': False}))
+                prefixo &= Q(**{f'{campo}__isnull': True})
+                continue
+
+            if self.anterior:
+                antes = Q(**{f'{campo}__gt': valor})
+                if anulavel:
+                    antes |= Q(**{f'{campo}__isnull': True})
+                condicoes.append(prefixo & antes)
+            else:
+                condicoes.append(prefixo & Q(**{f'{campo}__lt': valor}))
+            prefixo &= Q(**{campo: valor})
+
+        if not condicoes:
+            return Q(pk__in=[])
+        return reduce(operator.or_, condicoes)
+
+    def get_schema_operation_parameters(self, view):
+        parametros = super().get_schema_operation_parameters(view)
+        return parametros + [
+            {
+                'name': self.modo_query_param, 'required': False, 'in': 'query',
+                'description': 'Use "cursor" para paginação por chave (sem COUNT/OFFSET)',
+                'schema': {'type': 'string', 'enum': ['cursor']},
+            },
+            {
+                'name': self.cursor_query_param, 'required': False, 'in': 'query',
+                'description': 'Cursor retornado em next/previous', 'schema': {'type': 'string'},
+            },
+            {
+                'name': self.contagem_query_param, 'required': False, 'in': 'query',
+                'description': 'No modo cursor, "estimada" preenche count com a estimativa do banco',
+                'schema': {'type': 'string', 'enum': ['estimada']},
+            },
+        ]
+
+    @staticmethod
+    def _serializar_valor(valor):
+        if valor is None or isinstance(valor, (int, str)):
+            return valor
+        return valor.isoformat() if hasattr(valor, 'isoformat') else str(valor)
+
+    @staticmethod
+    def _estimar_total(queryset):
+        """Estimativa de linhas do planner (PostgreSQL), sem executar o COUNT(*)"""
+        try:
+            sql, params = queryset.order_by().query.sql_with_params()
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                plano = cursor.fetchone()[0]
+            if isinstance(plano, str):
+                plano = json.loads(plano)
+            return int(plano[0]['Plan']['Plan Rows'])
+        except Exception as e:
+            logger.warning(f"Erro ao estimar total da listagem: {e}")
+            return None
+
+
 def get_empresas_filtradas(user, documento):
     if documento:
         minha_empresa = get_object_or_404(Empresa, usuario_id=user.id, documento=documento)
@@ -29,6 +217,14 @@ def get_empresas_filtradas(user, documento):
 
 
 def verificaRestricaoAdministrativa(empresa_id, sistema_id):
+    # Aceita o id ou a própria Empresa (ex.: nota_fiscal.empresa)
+    empresa_id = getattr(empresa_id, 'pk', empresa_id)
+
+    # Empresa do escopo do usuário do request: resposta vem do contexto, sem query
+    for contexto in contextos_do_request():
+        if contexto.conhece_empresa(empresa_id):
+            return contexto.sistema_liberado(empresa_id, sistema_id)
+
     restricaoAdministrativa = EmpresaSistema.objects.filter(
         empresa=empresa_id,
         sistema=sistema_id,
@@ -45,44 +241,15 @@ def obter_matriz_funcionario(user):
     """
     Função utilitária para obter a matriz do funcionário
     Pode ser reutilizada em qualquer view
+
+    Lida do contexto de empresa do request (calculado uma vez por request).
     """
     try:
-        # Verifica se é funcionário ativo
-        funcionario = Funcionario.objects.filter(
-            user=user,
-            status='1',
-            role='funcionario',
-            empresa__sistema_id=3
-        ).select_related('empresa').first()
-
-        if funcionario:
-            empresa = funcionario.empresa
-            return empresa.id
-        else:
-            # Usuário não é funcionário - pega primeira matriz
-            matriz = Empresa.objects.filter(
-                usuario=user,
-                matriz_filial__isnull=True,
-                status='1',
-                sistema_id=3
-            ).first()
-
-            if matriz:
-                print(f"Matriz encontrada - Empresa ID: {matriz.id}")
-                return matriz.id
-            else:
-                filial = Empresa.objects.filter(
-                    usuario=user,
-                    status='1',
-                    sistema_id=3
-                ).first()
-
-                if filial:
-                    print(f"Matriz encontrada - Empresa ID: {filial.id}")
-                    return filial.id
+        matriz_id = obter_contexto(user).matriz_sistema(3)
 
+        if matriz_id is None:
             print("Nenhuma matriz encontrada")
-            return None
+        return matriz_id
 
     except Exception as e:
         print(f"Erro ao obter matriz: {e}")
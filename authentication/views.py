@@ -27,7 +27,7 @@ from app.permissions import UsuarioIndependenteOuAdmin
 from app.mixins import SystemAccessMixin
 from app.utils import utils
 
-from empresa.models import Empresa, Funcionario, ConexaoBanco, HistoricoNSU
+from empresa.models import Empresa, Funcionario, ConexaoBanco, CursorNSU, HistoricoNSU
 from sistema.models import EmpresaSistema
 
 from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter, OpenApiExample, OpenApiResponse
@@ -1395,7 +1395,8 @@ class UserAdminDeleteView(APIView):
                 # Remove vínculos com sistemas
                 EmpresaSistema.objects.filter(empresa=empresa).delete()
 
-                # Remove histórico NSU
+                # Remove cursor e histórico NSU
+                CursorNSU.objects.filter(empresa=empresa).delete()
                 HistoricoNSU.objects.filter(empresa=empresa).delete()
 
                 # Remove funcionários da empresa (exceto o dono)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class DbAllnubeEmpresaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'db_allnube_empresa'
+
+    def ready(self):
+        from db_allnube_empresa import signals  # noqa: F401
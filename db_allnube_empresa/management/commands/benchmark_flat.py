@@ -0,0 +1,148 @@
+"""
+Benchmark das listagens no banco próprio de uma empresa (modelos flat).
+
+Mede, com e sem os índices flat (migração 0004_flat_indexes), as queries que as
+listagens de NF-e e de produtos executam. O "sem índices" roda dentro de uma
+transação que faz DROP INDEX e é desfeita no final (os índices voltam).
+
+# Popular o banco da empresa 1 com 20.000 notas x 50 itens (1M de produtos) e medir
+python manage.py benchmark_flat --empresa_id 1 --popular 20000 --itens 50
+
+# Só medir (banco já populado)
+python manage.py benchmark_flat --empresa_id 1 --repeticoes 10
+
+Atenção: DROP INDEX bloqueia as tabelas até o rollback; use em banco de teste.
+"""
+
+import time
+import random
+import statistics
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils import timezone
+
+from db_allnube_empresa.models import NotaFiscalFlat, ProdutoFlat, ImpostoFlat
+from db_allnube_empresa.serializer import CarregadorNfeFlat
+from db_allnube_empresa.utils.database_utils import DatabaseManager, obter_alias_banco_empresa
+
+INDICES_FLAT = [
+    'nf_flat_emp_del_dhemi_id_idx',
+    'ide_flat_nota_idx',
+    'emitente_flat_nota_idx',
+    'destinatario_flat_nota_idx',
+    'produto_flat_nota_idx',
+    'imposto_flat_produto_idx',
+    'total_flat_nota_idx',
+    'transporte_flat_nota_idx',
+    'cobranca_flat_nota_idx',
+    'pagamento_flat_cobranca_idx',
+]
+
+
+class Command(BaseCommand):
+    help = 'Mede a latência das listagens flat com e sem os índices do banco da empresa'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--empresa_id', type=int, required=True, help='Empresa com banco próprio')
+        parser.add_argument('--popular', type=int, default=0, help='Quantidade de notas a inserir antes de medir')
+        parser.add_argument('--itens', type=int, default=50, help='Produtos por nota inserida')
+        parser.add_argument('--pagina', type=int, default=100, help='Tamanho da página medida')
+        parser.add_argument('--repeticoes', type=int, default=5, help='Execuções por cenário')
+
+    def handle(self, *args, **options):
+        empresa_id = options['empresa_id']
+        if not DatabaseManager.usar_banco_empresa(empresa_id):
+            raise CommandError(f"Empresa {empresa_id} não tem banco próprio acessível")
+
+        db_alias = obter_alias_banco_empresa()
+        try:
+            if options['popular']:
+                self.popular(empresa_id, options['popular'], options['itens'])
+
+            self.stdout.write(
+                f"Notas: {NotaFiscalFlat.objects.count()} | Produtos: {ProdutoFlat.objects.count()}"
+            )
+
+            com_indices = self.medir(empresa_id, options['pagina'], options['repeticoes'])
+
+            with transaction.atomic(using=db_alias):
+                with connections[db_alias].cursor() as cursor:
+                    for indice in INDICES_FLAT:
+                        cursor.execute(f'DROP INDEX IF EXISTS "{indice}"')
+                sem_indices = self.medir(empresa_id, options['pagina'], options['repeticoes'])
+                transaction.set_rollback(True, using=db_alias)
+
+            self.stdout.write(f"\n{'cenário':<28}{'sem índices (ms)':>20}{'com índices (ms)':>20}")
+            for cenario, tempo in com_indices.items():
+                self.stdout.write(f"{cenario:<28}{sem_indices[cenario]:>20.1f}{tempo:>20.1f}")
+        finally:
+            DatabaseManager.limpar_conexao_empresa()
+
+    def medir(self, empresa_id, pagina, repeticoes):
+        """Mediana (ms) de cada cenário"""
+        notas = NotaFiscalFlat.objects.filter(empresa_id=empresa_id, deleted_at__isnull=True)
+
+        def listar_notas():
+            pagina_notas = list(notas.order_by('-dhEmi')[:pagina])
+            # Filhos da página como o NfeFlatListSerializer carrega
+            CarregadorNfeFlat(nota.id for nota in pagina_notas)
+
+        def listar_produtos():
+            list(ProdutoFlat.objects.filter(
+                nota_fiscal_id__in=notas.values_list('id', flat=True)
+            ).order_by('-nota_fiscal_id')[:pagina])
+
+        cenarios = {
+            'listagem de notas': listar_notas,
+            'listagem de produtos': listar_produtos,
+        }
+
+        resultado = {}
+        for nome, cenario in cenarios.items():
+            tempos = []
+            for _ in range(repeticoes):
+                inicio = time.perf_counter()
+                cenario()
+                tempos.append((time.perf_counter() - inicio) * 1000)
+            resultado[nome] = statistics.median(tempos)
+        return resultado
+
+    def popular(self, empresa_id, quantidade, itens, bloco=500):
+        self.stdout.write(f"Inserindo {quantidade} notas com {itens} itens cada...")
+        agora = timezone.now()
+        prefixo = f'{int(time.time()):010d}'
+
+        for inicio in range(0, quantidade, bloco):
+            notas = NotaFiscalFlat.objects.bulk_create([
+                NotaFiscalFlat(
+                    empresa_id=empresa_id,
+                    chave=f'{prefixo}{numero:034d}',
+                    versao='4.00',
+                    tpAmb=1,
+                    dhEmi=agora - timedelta(minutes=random.randint(0, 525600)),
+                )
+                for numero in range(inicio, min(inicio + bloco, quantidade))
+            ])
+
+            produtos = ProdutoFlat.objects.bulk_create([
+                ProdutoFlat(
+                    nota_fiscal_id=nota.id,
+                    nItem=item + 1,
+                    cProd=f'P{item:05d}',
+                    xProd=f'Produto {item}',
+                    vProd=Decimal('10.00'),
+                    indTot=1,
+                )
+                for nota in notas
+                for item in range(itens)
+            ], batch_size=5000)
+
+            ImpostoFlat.objects.bulk_create([
+                ImpostoFlat(produto_id=produto.id, vTotTrib=Decimal('1.00'))
+                for produto in produtos
+            ], batch_size=5000)
+
+            self.stdout.write(f"  {min(inicio + bloco, quantidade)}/{quantidade}")
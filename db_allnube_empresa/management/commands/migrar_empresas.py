@@ -25,9 +25,9 @@ python manage.py migrar_empresas --testar
 
 from django.core.management.base import BaseCommand
 from django.db import connections
-from django.conf import settings
 from django.core.management import call_command
 from empresa.models import Empresa, ConexaoBanco
+from db_allnube_empresa.utils.database_utils import registro_conexoes
 
 
 class Command(BaseCommand):
@@ -82,8 +82,6 @@ class Command(BaseCommand):
     def configurar_banco_empresa(self, empresa_id):
         try:
             conexao = ConexaoBanco.objects.get(empresa_id=empresa_id, status=True)
-            db_alias = f'empresa_{empresa_id}'
-
             db_config = {
                 'ENGINE': 'django.db.backends.postgresql',
                 'NAME': conexao.get_database(),
@@ -104,12 +102,7 @@ class Command(BaseCommand):
                 }
             }
 
-            if db_alias not in settings.DATABASES:
-                settings.DATABASES[db_alias] = db_config
-                connections.databases[db_alias] = db_config
-
-            settings.EMPRESA_DATABASE_ALIAS = db_alias
-            return db_alias
+            return registro_conexoes.registrar(empresa_id, db_config)
 
         except Exception as e:
             self.stdout.write(self.style.ERROR(f"Erro ao configurar banco da empresa {empresa_id}: {e}"))
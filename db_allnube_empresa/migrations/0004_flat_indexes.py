@@ -0,0 +1,59 @@
+# Generated by Django 5.2.1 on 2026-10-16 21:10
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY não roda dentro de transação; evita travar
+    # as tabelas flat (milhões de produtos) durante o migrar_empresas --cliente
+    atomic = False
+
+    dependencies = [
+        ('db_allnube_empresa', '0003_alter_destinatarioflat_xpais'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='notafiscalflat',
+            index=models.Index(
+                fields=['empresa_id', 'deleted_at', '-dhEmi', '-id'], name='nf_flat_emp_del_dhemi_id_idx'
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name='ideflat',
+            index=models.Index(fields=['nota_fiscal_id'], name='ide_flat_nota_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='emitenteflat',
+            index=models.Index(fields=['nota_fiscal_id'], name='emitente_flat_nota_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='destinatarioflat',
+            index=models.Index(fields=['nota_fiscal_id'], name='destinatario_flat_nota_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='produtoflat',
+            index=models.Index(fields=['nota_fiscal_id'], name='produto_flat_nota_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='impostoflat',
+            index=models.Index(fields=['produto_id'], name='imposto_flat_produto_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='totalflat',
+            index=models.Index(fields=['nota_fiscal_id'], name='total_flat_nota_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transporteflat',
+            index=models.Index(fields=['nota_fiscal_id'], name='transporte_flat_nota_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='cobrancaflat',
+            index=models.Index(fields=['nota_fiscal_id'], name='cobranca_flat_nota_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='pagamentoflat',
+            index=models.Index(fields=['cobranca_id'], name='pagamento_flat_cobranca_idx'),
+        ),
+    ]
@@ -1,10 +1,10 @@
 from django.db import models
-from django.conf import settings
+from db_allnube_empresa.utils.database_utils import obter_alias_banco_empresa
 
 
 class FlatBaseManager(models.Manager):
     def get_queryset(self):
-        db_alias = getattr(settings, 'EMPRESA_DATABASE_ALIAS', 'default')
+        db_alias = obter_alias_banco_empresa()
         return super().get_queryset().using(db_alias)
 
 
@@ -16,8 +16,8 @@ class FlatBaseModel(models.Model):
         managed = True
 
     def save(self, *args, **kwargs):
-        db_alias = getattr(settings, 'EMPRESA_DATABASE_ALIAS', 'default')
-        kwargs['using'] = db_alias
+        # Instância lida de um banco (ex.: filial com banco próprio) grava nele mesmo
+        kwargs['using'] = self._state.db or obter_alias_banco_empresa()
         super().save(*args, **kwargs)
 
 
@@ -41,13 +41,16 @@ class NotaFiscalFlat(FlatBaseModel):
         verbose_name = 'Nota Fiscal (Flat)'
         verbose_name_plural = 'Notas Fiscais (Flat)'
         managed = True
+        indexes = [
+            # Listagens: empresa_id + deleted_at IS NULL ordenado por -dhEmi, -id (chave do cursor)
+            models.Index(fields=['empresa_id', 'deleted_at', '-dhEmi', '-id'], name='nf_flat_emp_del_dhemi_id_idx'),
+        ]
 
     def __str__(self):
         return f"NF-e {self.chave}"
 
     def save(self, *args, **kwargs):
-        db_alias = getattr(settings, 'EMPRESA_DATABASE_ALIAS', 'default')
-        kwargs['using'] = db_alias
+        kwargs['using'] = self._state.db or obter_alias_banco_empresa()
         super().save(*args, **kwargs)
 
 
@@ -78,13 +81,15 @@ class IdeFlat(FlatBaseModel):
         verbose_name = 'IDE (Flat)'
         verbose_name_plural = 'IDEs (Flat)'
         managed = True
+        indexes = [
+            models.Index(fields=['nota_fiscal_id'], name='ide_flat_nota_idx'),
+        ]
 
     def __str__(self):
         return f"Serie {self.serie}"
 
     def save(self, *args, **kwargs):
-        db_alias = getattr(settings, 'EMPRESA_DATABASE_ALIAS', 'default')
-        kwargs['using'] = db_alias
+        kwargs['using'] = self._state.db or obter_alias_banco_empresa()
         super().save(*args, **kwargs)
 
 
@@ -113,13 +118,15 @@ class EmitenteFlat(FlatBaseModel):
         verbose_name = 'Emitente (Flat)'
         verbose_name_plural = 'Emitentes (Flat)'
         managed = True
+        indexes = [
+            models.Index(fields=['nota_fiscal_id'], name='emitente_flat_nota_idx'),
+        ]
 
     def __str__(self):
         return f"{self.xNome} - {self.xFant}"
 
     def save(self, *args, **kwargs):
-        db_alias = getattr(settings, 'EMPRESA_DATABASE_ALIAS', 'default')
-        kwargs['using'] = db_alias
+        kwargs['using'] = self._state.db or obter_alias_banco_empresa()
         super().save(*args, **kwargs)
 
 
@@ -147,13 +154,15 @@ class DestinatarioFlat(FlatBaseModel):
         verbose_name = 'Destinatario (Flat)'
         verbose_name_plural = 'Destinatarios (Flat)'
         managed = True
+        indexes = [
+            models.Index(fields=['nota_fiscal_id'], name='destinatario_flat_nota_idx'),
+        ]
 
     def __str__(self):
         return f"{self.xNome} - {self.xMun}"
 
     def save(self, *args, **kwargs):
-        db_alias = getattr(settings, 'EMPRESA_DATABASE_ALIAS', 'default')
-        kwargs['using'] = db_alias
+        kwargs['using'] = self._state.db or obter_alias_banco_empresa()
         super().save(*args, **kwargs)
 
 
@@ -181,13 +190,15 @@ class ProdutoFlat(FlatBaseModel):
         verbose_name = 'Produto (Flat)'
         verbose_name_plural = 'Produtos (Flat)'
         managed = True
+        indexes = [
+            models.Index(fields=['nota_fiscal_id'], name='produto_flat_nota_idx'),
+        ]
 
     def __str__(self):
         return f"{self.nItem} - {self.xProd}"
 
     def save(self, *args, **kwargs):
-        db_alias = getattr(settings, 'EMPRESA_DATABASE_ALIAS', 'default')
-        kwargs['using'] = db_alias
+        kwargs['using'] = self._state.db or obter_alias_banco_empresa()
         super().save(*args, **kwargs)
 
 
@@ -207,13 +218,15 @@ class ImpostoFlat(FlatBaseModel):
         verbose_name = 'Imposto (Flat)'
         verbose_name_plural = 'Impostos (Flat)'
         managed = True
+        indexes = [
+            models.Index(fields=['produto_id'], name='imposto_flat_produto_idx'),
+        ]
 
     def __str__(self):
         return f"Imposto - {self.vTotTrib}"
 
     def save(self, *args, **kwargs):
-        db_alias = getattr(settings, 'EMPRESA_DATABASE_ALIAS', 'default')
-        kwargs['using'] = db_alias
+        kwargs['using'] = self._state.db or obter_alias_banco_empresa()
         super().save(*args, **kwargs)
 
 
@@ -247,13 +260,15 @@ class TotalFlat(FlatBaseModel):
         verbose_name = 'Total (Flat)'
         verbose_name_plural = 'Totais (Flat)'
         managed = True
+        indexes = [
+            models.Index(fields=['nota_fiscal_id'], name='total_flat_nota_idx'),
+        ]
 
     def __str__(self):
         return f"Total - {self.vNF}"
 
     def save(self, *args, **kwargs):
-        db_alias = getattr(settings, 'EMPRESA_DATABASE_ALIAS', 'default')
-        kwargs['using'] = db_alias
+        kwargs['using'] = self._state.db or obter_alias_banco_empresa()
         super().save(*args, **kwargs)
 
 
@@ -269,13 +284,15 @@ class TransporteFlat(FlatBaseModel):
         verbose_name = 'Transporte (Flat)'
         verbose_name_plural = 'Transportes (Flat)'
         managed = True
+        indexes = [
+            models.Index(fields=['nota_fiscal_id'], name='transporte_flat_nota_idx'),
+        ]
 
     def __str__(self):
         return f"Transporte - {self.modFrete}"
 
     def save(self, *args, **kwargs):
-        db_alias = getattr(settings, 'EMPRESA_DATABASE_ALIAS', 'default')
-        kwargs['using'] = db_alias
+        kwargs['using'] = self._state.db or obter_alias_banco_empresa()
         super().save(*args, **kwargs)
 
 
@@ -293,13 +310,15 @@ class CobrancaFlat(FlatBaseModel):
         verbose_name = 'Cobrança (Flat)'
         verbose_name_plural = 'Cobranças (Flat)'
         managed = True
+        indexes = [
+            models.Index(fields=['nota_fiscal_id'], name='cobranca_flat_nota_idx'),
+        ]
 
     def __str__(self):
         return f"Cobrança - {self.nFat}"
 
     def save(self, *args, **kwargs):
-        db_alias = getattr(settings, 'EMPRESA_DATABASE_ALIAS', 'default')
-        kwargs['using'] = db_alias
+        kwargs['using'] = self._state.db or obter_alias_banco_empresa()
         super().save(*args, **kwargs)
 
 
@@ -317,11 +336,13 @@ class PagamentoFlat(FlatBaseModel):
         verbose_name = 'Pagamento (Flat)'
         verbose_name_plural = 'Pagamentos (Flat)'
         managed = True
+        indexes = [
+            models.Index(fields=['cobranca_id'], name='pagamento_flat_cobranca_idx'),
+        ]
 
     def __str__(self):
         return f"Pagamento - {self.tPag}"
 
     def save(self, *args, **kwargs):
-        db_alias = getattr(settings, 'EMPRESA_DATABASE_ALIAS', 'default')
-        kwargs['using'] = db_alias
+        kwargs['using'] = self._state.db or obter_alias_banco_empresa()
         super().save(*args, **kwargs)
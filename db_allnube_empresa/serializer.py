@@ -28,11 +28,110 @@ class ImpostoFlatModelSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+def _por_banco(objetos):
+    """Agrupa objetos pelo banco de onde vieram (leitura federada mistura bancos)"""
+    bancos = {}
+    for objeto in objetos:
+        bancos.setdefault(objeto._state.db, []).append(objeto.id)
+    return bancos
+
+
+def _agrupar(queryset, campo, unico=False):
+    """
+    Agrupa em memória as linhas de uma tabela flat pelo id "pai" (campo inteiro).
+    Com unico=True mantém só a primeira linha (menor id), como o .first() fazia.
+    """
+    agrupado = {}
+    for linha in queryset.order_by('id'):
+        chave = getattr(linha, campo)
+        if unico:
+            agrupado.setdefault(chave, linha)
+        else:
+            agrupado.setdefault(chave, []).append(linha)
+    return agrupado
+
+
+class CarregadorNfeFlat:
+    """
+    Carrega de uma vez os filhos de uma página de notas flat.
+
+    As tabelas flat ligam-se por ids inteiros (sem FK), então prefetch_related
+    não se aplica: cada tabela filha é lida uma única vez com __in sobre os ids
+    da página e agrupada em memória. Custo fixo de 9 queries por página (por
+    banco, quando a página vem de uma leitura federada).
+    """
+
+    def __init__(self, notas_ids, using=None):
+        notas_ids = list(notas_ids)
+        self.notas_ids = set(notas_ids)
+        self.using = using
+
+        self.ides = _agrupar(
+            self._tabela(models.IdeFlat).filter(nota_fiscal_id__in=notas_ids), 'nota_fiscal_id', unico=True
+        )
+        self.emitentes = _agrupar(
+            self._tabela(models.EmitenteFlat).filter(nota_fiscal_id__in=notas_ids), 'nota_fiscal_id', unico=True
+        )
+        self.destinatarios = _agrupar(
+            self._tabela(models.DestinatarioFlat).filter(nota_fiscal_id__in=notas_ids), 'nota_fiscal_id', unico=True
+        )
+        self.totais = _agrupar(
+            self._tabela(models.TotalFlat).filter(nota_fiscal_id__in=notas_ids), 'nota_fiscal_id', unico=True
+        )
+        self.transportes = _agrupar(
+            self._tabela(models.TransporteFlat).filter(nota_fiscal_id__in=notas_ids), 'nota_fiscal_id', unico=True
+        )
+        self.cobrancas = _agrupar(
+            self._tabela(models.CobrancaFlat).filter(nota_fiscal_id__in=notas_ids), 'nota_fiscal_id', unico=True
+        )
+
+        # Pagamentos são relacionados via cobranca
+        cobrancas_ids = [cobranca.id for cobranca in self.cobrancas.values()]
+        self.pagamentos = _agrupar(self._tabela(models.PagamentoFlat).filter(cobranca_id__in=cobrancas_ids), 'cobranca_id')
+
+        self.produtos = _agrupar(self._tabela(models.ProdutoFlat).filter(nota_fiscal_id__in=notas_ids), 'nota_fiscal_id')
+        produtos_ids = [produto.id for produtos in self.produtos.values() for produto in produtos]
+        self.impostos = CarregadorImpostoFlat(produtos_ids, using=using)
+
+    def _tabela(self, model):
+        return model.objects.using(self.using) if self.using else model.objects
+
+    def pagamentos_da_nota(self, nota_id):
+        cobranca = self.cobrancas.get(nota_id)
+        return self.pagamentos.get(cobranca.id, []) if cobranca else []
+
+
+class CarregadorImpostoFlat:
+    """Impostos de uma lista de produtos flat em uma única query"""
+
+    def __init__(self, produtos_ids, using=None):
+        impostos = models.ImpostoFlat.objects.using(using) if using else models.ImpostoFlat.objects
+        self.impostos = _agrupar(
+            impostos.filter(produto_id__in=list(produtos_ids)), 'produto_id', unico=True
+        )
+
+    def get(self, produto_id):
+        return self.impostos.get(produto_id)
+
+
+class ProdutoFlatListSerializer(serializers.ListSerializer):
+    """Carrega os impostos de todos os produtos da lista antes de serializar"""
+
+    def to_representation(self, data):
+        produtos = list(data.all() if hasattr(data, 'all') else data)
+        if 'carregador_impostos' not in self.child.context:
+            self.child.context['carregador_impostos'] = {
+                banco: CarregadorImpostoFlat(ids, using=banco) for banco, ids in _por_banco(produtos).items()
+            }
+        return super().to_representation(produtos)
+
+
 class ProdutoFlatModelSerializer(serializers.ModelSerializer):
     imposto = serializers.SerializerMethodField()
 
     class Meta:
         model = models.ProdutoFlat
+        list_serializer_class = ProdutoFlatListSerializer
         fields = [
             'id', 'nItem', 'cProd', 'cEAN', 'xProd', 'NCM', 'CFOP',
             'uCom', 'qCom', 'vUnCom', 'vProd', 'uTrib', 'qTrib',
@@ -40,11 +139,11 @@ class ProdutoFlatModelSerializer(serializers.ModelSerializer):
         ]
 
     def get_imposto(self, obj):
-        try:
-            imposto = models.ImpostoFlat.objects.filter(produto_id=obj.id).first()
-            return ImpostoFlatModelSerializer(imposto).data if imposto else None
-        except models.ImpostoFlat.DoesNotExist:
-            return None
+        carregador = self.context.get('carregador_impostos', {}).get(obj._state.db)
+        if carregador is None:
+            carregador = CarregadorImpostoFlat([obj.id], using=obj._state.db)
+        imposto = carregador.get(obj.id)
+        return ImpostoFlatModelSerializer(imposto).data if imposto else None
 
 
 class TotalFlatModelSerializer(serializers.ModelSerializer):
@@ -71,6 +170,17 @@ class PagamentoFlatModelSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class NfeFlatListSerializer(serializers.ListSerializer):
+    """Carrega os filhos de todas as notas da página antes de serializar"""
+
+    def to_representation(self, data):
+        notas = list(data.all() if hasattr(data, 'all') else data)
+        self.child.context['carregador_nfe_flat'] = {
+            banco: CarregadorNfeFlat(ids, using=banco) for banco, ids in _por_banco(notas).items()
+        }
+        return super().to_representation(notas)
+
+
 class NfeFlatModelSerializer(serializers.ModelSerializer):
     # Campos para criação (write_only)
     empresa_id = serializers.IntegerField(write_only=True)
@@ -91,6 +201,7 @@ class NfeFlatModelSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = models.NotaFiscalFlat
+        list_serializer_class = NfeFlatListSerializer
         fields = [
             'id', 'chave', 'versao', 'dhEmi', 'dhSaiEnt', 'tpAmb',
             'fileXml', 'filePdf', 'created_at', 'updated_at', 'deleted_at',
@@ -99,65 +210,49 @@ class NfeFlatModelSerializer(serializers.ModelSerializer):
             'transporte', 'cobranca', 'pagamentos'  # Campos read_only
         ]
 
+    def _carregador(self, obj):
+        # Listagens recebem o carregador da página via NfeFlatListSerializer
+        carregadores = self.context.setdefault('carregador_nfe_flat', {})
+        carregador = carregadores.get(obj._state.db)
+        if carregador is None or obj.id not in carregador.notas_ids:
+            carregador = CarregadorNfeFlat([obj.id], using=obj._state.db)
+            carregadores[obj._state.db] = carregador
+        return carregador
+
     def get_ide(self, obj):
-        try:
-            ide = models.IdeFlat.objects.filter(nota_fiscal_id=obj.id).first()
-            return IdeFlatModelSerializer(ide).data if ide else None
-        except Exception:
-            return None
+        ide = self._carregador(obj).ides.get(obj.id)
+        return IdeFlatModelSerializer(ide).data if ide else None
 
     def get_emitente(self, obj):
-        try:
-            emitente = models.EmitenteFlat.objects.filter(nota_fiscal_id=obj.id).first()
-            return EmitenteFlatModelSerializer(emitente).data if emitente else None
-        except Exception:
-            return None
+        emitente = self._carregador(obj).emitentes.get(obj.id)
+        return EmitenteFlatModelSerializer(emitente).data if emitente else None
 
     def get_destinatario(self, obj):
-        try:
-            destinatario = models.DestinatarioFlat.objects.filter(nota_fiscal_id=obj.id).first()
-            return DestinatarioFlatModelSerializer(destinatario).data if destinatario else None
-        except Exception:
-            return None
+        destinatario = self._carregador(obj).destinatarios.get(obj.id)
+        return DestinatarioFlatModelSerializer(destinatario).data if destinatario else None
 
     def get_produtos(self, obj):
-        try:
-            produtos = models.ProdutoFlat.objects.filter(nota_fiscal_id=obj.id)
-            return ProdutoFlatModelSerializer(produtos, many=True).data
-        except Exception:
-            return []
+        carregador = self._carregador(obj)
+        produtos = carregador.produtos.get(obj.id, [])
+        return ProdutoFlatModelSerializer(
+            produtos, many=True, context={'carregador_impostos': {carregador.using: carregador.impostos}}
+        ).data
 
     def get_total(self, obj):
-        try:
-            total = models.TotalFlat.objects.filter(nota_fiscal_id=obj.id).first()
-            return TotalFlatModelSerializer(total).data if total else None
-        except Exception:
-            return None
+        total = self._carregador(obj).totais.get(obj.id)
+        return TotalFlatModelSerializer(total).data if total else None
 
     def get_transporte(self, obj):
-        try:
-            transporte = models.TransporteFlat.objects.filter(nota_fiscal_id=obj.id).first()
-            return TransporteFlatModelSerializer(transporte).data if transporte else None
-        except Exception:
-            return None
+        transporte = self._carregador(obj).transportes.get(obj.id)
+        return TransporteFlatModelSerializer(transporte).data if transporte else None
 
     def get_cobranca(self, obj):
-        try:
-            cobranca = models.CobrancaFlat.objects.filter(nota_fiscal_id=obj.id).first()
-            return CobrancaFlatModelSerializer(cobranca).data if cobranca else None
-        except Exception:
-            return None
+        cobranca = self._carregador(obj).cobrancas.get(obj.id)
+        return CobrancaFlatModelSerializer(cobranca).data if cobranca else None
 
     def get_pagamentos(self, obj):
-        try:
-            # Pagamentos são relacionados via cobranca
-            cobranca = models.CobrancaFlat.objects.filter(nota_fiscal_id=obj.id).first()
-            if cobranca:
-                pagamentos = models.PagamentoFlat.objects.filter(cobranca_id=cobranca.id)
-                return PagamentoFlatModelSerializer(pagamentos, many=True).data
-            return []
-        except Exception:
-            return []
+        pagamentos = self._carregador(obj).pagamentos_da_nota(obj.id)
+        return PagamentoFlatModelSerializer(pagamentos, many=True).data
 
 
 class NfeFlatSerializer(serializers.ModelSerializer):
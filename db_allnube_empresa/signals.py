@@ -0,0 +1,12 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from empresa.models import ConexaoBanco
+from db_allnube_empresa.utils.database_utils import DatabaseManager
+
+
+@receiver(post_save, sender=ConexaoBanco)
+@receiver(post_delete, sender=ConexaoBanco)
+def invalidar_topologia_empresa(sender, instance, **kwargs):
+    """Conexão criada, alterada ou removida: a rota da empresa precisa ser recalculada"""
+    DatabaseManager.invalidar_empresa(instance.empresa_id)
@@ -1,3 +1,154 @@
-from django.test import TestCase
+from datetime import datetime, timezone as dt_timezone
 
-# Create your tests here.
+from django.db import connections
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from db_allnube_empresa.models import NotaFiscalFlat
+from db_allnube_empresa.utils.database_utils import RegistroConexoes
+from db_allnube_empresa.utils.leitura_federada import ConsultaFederada, FiltroFederadoMixin
+
+ALIAS_FILIAL = 'empresa_teste_filial'
+
+
+def _data(dia):
+    return datetime(2025, 1, dia, tzinfo=dt_timezone.utc)
+
+
+class _FiltroAmbiente:
+    def filter_queryset(self, queryset):
+        return queryset.filter(tpAmb=1)
+
+
+class _ViewFederada(FiltroFederadoMixin, _FiltroAmbiente):
+    pass
+
+
+class ConsultaFederadaTests(TransactionTestCase):
+    """Dois bancos (aliases) intercalados como um queryset só"""
+
+    @classmethod
+    def setUpClass(cls):
+        # Segundo alias apontando para o mesmo banco de teste, como faz o RegistroConexoes
+        # (registrado em runtime: por isso entra em databases só aqui)
+        connections.databases[ALIAS_FILIAL] = dict(connections['default'].settings_dict)
+        cls.databases = {'default', ALIAS_FILIAL}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[ALIAS_FILIAL].close()
+        del connections[ALIAS_FILIAL]
+        connections.databases.pop(ALIAS_FILIAL, None)
+
+    def setUp(self):
+        # Matriz (empresa 1) no default, filial (empresa 2) no outro alias
+        self.ids = {}
+        for nome, empresa_id, dia, ambiente in [
+            ('m3', 1, 3, 1), ('m1', 1, 1, 1), ('mN', 1, None, 1),
+            ('f2', 2, 2, 1), ('fN', 2, None, 2), ('f4', 2, 4, 1),
+        ]:
+            alias = 'default' if empresa_id == 1 else ALIAS_FILIAL
+            nota = NotaFiscalFlat(
+                empresa_id=empresa_id, chave=nome.ljust(44, '0'), versao='4.00', tpAmb=ambiente,
+                dhEmi=_data(dia) if dia else None,
+            )
+            nota.save(using=alias)
+            self.ids[nome] = nota.id
+
+    def _consulta(self, *ordenacao):
+        return ConsultaFederada(NotaFiscalFlat, {
+            'default': NotaFiscalFlat.objects.using('default').filter(empresa_id=1),
+            ALIAS_FILIAL: NotaFiscalFlat.objects.using(ALIAS_FILIAL).filter(empresa_id=2),
+        }).order_by(*ordenacao)
+
+    def _nomes(self, notas):
+        por_id = {nota_id: nome for nome, nota_id in self.ids.items()}
+        return [por_id[nota.id] for nota in notas]
+
+    def test_intercala_com_null_primeiro_no_decrescente(self):
+        notas = list(self._consulta('-dhEmi', '-id'))
+
+        self.assertEqual(self._nomes(notas)[2:], ['f4', 'm3', 'f2', 'm1'])
+        self.assertEqual(set(self._nomes(notas)[:2]), {'mN', 'fN'})
+
+    def test_null_por_ultimo_no_crescente(self):
+        nomes = self._nomes(self._consulta('dhEmi', 'id')[:])
+
+        self.assertEqual(nomes[:4], ['m1', 'f2', 'm3', 'f4'])
+        self.assertEqual(set(nomes[4:]), {'mN', 'fN'})
+
+    def test_count_e_fatiamento(self):
+        consulta = self._consulta('-dhEmi', '-id')
+
+        self.assertEqual(consulta.count(), 6)
+        self.assertEqual(self._nomes(consulta[2:4]), ['f4', 'm3'])
+        self.assertEqual(self._nomes([consulta[5]]), ['m1'])
+
+    def test_filter_queryset_em_todos_os_bancos(self):
+        consulta = _ViewFederada().filter_queryset(self._consulta('-dhEmi', '-id'))
+
+        self.assertIsInstance(consulta, ConsultaFederada)
+        self.assertEqual(consulta.count(), 5)
+        self.assertNotIn('fN', self._nomes(consulta))
+
+    def test_banco_de_devolve_queryset_do_shard(self):
+        queryset = self._consulta('-dhEmi').banco_de(chave='f2'.ljust(44, '0'))
+
+        self.assertEqual(queryset.db, ALIAS_FILIAL)
+        nota = queryset.get(chave='f2'.ljust(44, '0'))
+        nota.deleted_at = _data(5)
+        nota.save()
+
+        # Grava no banco de onde a nota foi lida, não no alias do contexto (default)
+        self.assertEqual(nota._state.db, ALIAS_FILIAL)
+        self.assertIsNotNone(NotaFiscalFlat.objects.using(ALIAS_FILIAL).get(pk=nota.pk).deleted_at)
+
+
+@override_settings(EMPRESA_DB_MAX_CONEXOES=2)
+class RegistroConexoesTests(SimpleTestCase):
+    """Alias versionado pela configuração e wrapper desta thread descartado"""
+
+    def setUp(self):
+        self.registro = RegistroConexoes()
+        self.addCleanup(self._limpar)
+
+    def _limpar(self):
+        for alias in [alias for alias in connections.databases if alias.startswith('empresa_')]:
+            RegistroConexoes._descartar_wrapper(alias)
+            connections.databases.pop(alias, None)
+
+    def _config(self, nome):
+        config = dict(connections['default'].settings_dict)
+        config['NAME'] = nome
+        return config
+
+    def test_credencial_nova_vira_outro_alias(self):
+        antigo = self.registro.registrar(1, self._config('banco_antigo'))
+        self.assertEqual(connections[antigo].settings_dict['NAME'], 'banco_antigo')
+
+        novo = self.registro.registrar(1, self._config('banco_novo'))
+
+        self.assertNotEqual(novo, antigo)
+        self.assertEqual(self.registro.alias_valido(1), novo)
+        self.assertEqual(connections[novo].settings_dict['NAME'], 'banco_novo')
+        # Wrapper antigo desta thread descartado; a configuração fica para as outras threads
+        self.assertFalse(hasattr(connections._connections, antigo))
+        self.assertIn(antigo, connections.databases)
+
+    def test_mesma_configuracao_mantem_o_alias(self):
+        alias = self.registro.registrar(1, self._config('banco'))
+
+        self.assertEqual(self.registro.registrar(1, self._config('banco')), alias)
+
+    def test_lru_descarta_o_menos_usado(self):
+        aliases = [self.registro.registrar(empresa_id, self._config(f'banco_{empresa_id}')) for empresa_id in (1, 2)]
+        for alias in aliases:
+            connections[alias]  # wrappers criados nesta thread
+        self.registro.alias_valido(1)  # empresa 1 passa a ser a mais recente
+
+        self.registro.registrar(3, self._config('banco_3'))
+
+        self.assertEqual(self.registro.alias_valido(1), aliases[0])
+        self.assertIsNone(self.registro.alias_valido(2))
+        self.assertFalse(hasattr(connections._connections, aliases[1]))
@@ -1,8 +1,116 @@
+import time
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+
 from django.db import connections
 from django.conf import settings
+from django.core.cache import cache
 from empresa.models import ConexaoBanco
 
 
+# Alias do banco usado pelos modelos flat no contexto atual (request / task / thread)
+_alias_banco_empresa = contextvars.ContextVar('alias_banco_empresa', default='default')
+
+
+def obter_alias_banco_empresa():
+    """Alias que os modelos flat devem usar no contexto atual"""
+    return _alias_banco_empresa.get()
+
+
+class RegistroConexoes:
+    """
+    Registro (LRU, por processo) dos aliases de banco das empresas já configurados.
+
+    Cada alias guarda o momento do último SELECT 1 bem-sucedido; enquanto estiver
+    dentro de EMPRESA_DB_HEALTHCHECK_TTL não há nova consulta ao ConexaoBanco nem
+    novo teste de conexão. Acima de EMPRESA_DB_MAX_CONEXOES o menos usado é removido.
+
+    O nome do alias leva uma assinatura da configuração (empresa_<id>_<hash>):
+    credenciais novas no ConexaoBanco viram outro alias, com outra conexão, em
+    todas as threads. O connections[alias] de cada thread é um wrapper próprio,
+    então um alias que sai do registro (credencial trocada ou LRU) só tem o
+    wrapper desta thread fechado e descartado; a configuração continua em
+    DATABASES para o close_old_connections das demais threads fechar as
+    conexões delas pelo CONN_MAX_AGE.
+    """
+
+    CAMPOS_CONEXAO = ('NAME', 'USER', 'PASSWORD', 'HOST', 'PORT')
+
+    def __init__(self):
+        self._aliases = OrderedDict()  # alias -> último teste (monotonic)
+        self._por_empresa = {}  # empresa_id -> alias atual
+        self._lock = threading.Lock()
+
+    @classmethod
+    def nome_alias(cls, empresa_id, db_config):
+        assinatura = '|'.join(str(db_config.get(campo)) for campo in cls.CAMPOS_CONEXAO)
+        return f'empresa_{empresa_id}_{hashlib.sha1(assinatura.encode()).hexdigest()[:12]}'
+
+    def alias_valido(self, empresa_id):
+        """Alias atual da empresa se o último teste ainda está no TTL, senão None"""
+        with self._lock:
+            db_alias = self._por_empresa.get(empresa_id)
+            verificado_em = self._aliases.get(db_alias)
+            if verificado_em is None:
+                return None
+            if time.monotonic() - verificado_em > settings.EMPRESA_DB_HEALTHCHECK_TTL:
+                return None
+            self._aliases.move_to_end(db_alias)
+            return db_alias
+
+    def registrar(self, empresa_id, db_config):
+        """Registra a configuração da empresa e devolve o alias a usar"""
+        db_alias = self.nome_alias(empresa_id, db_config)
+        with self._lock:
+            anterior = self._por_empresa.get(empresa_id)
+            if anterior is not None and anterior != db_alias:
+                # Credenciais mudaram no ConexaoBanco: o alias novo é outra conexão
+                self._aposentar(anterior)
+
+            if db_alias not in connections.databases:
+                settings.DATABASES[db_alias] = db_config
+                connections.databases[db_alias] = db_config
+            self._por_empresa[empresa_id] = db_alias
+            self._aliases[db_alias] = time.monotonic()
+            self._aliases.move_to_end(db_alias)
+
+            while len(self._aliases) > settings.EMPRESA_DB_MAX_CONEXOES:
+                antigo = next(iter(self._aliases))
+                self._aposentar(antigo)
+        return db_alias
+
+    def remover(self, empresa_id):
+        with self._lock:
+            db_alias = self._por_empresa.get(empresa_id)
+            if db_alias is not None:
+                self._aposentar(db_alias)
+
+    def _aposentar(self, db_alias):
+        self._aliases.pop(db_alias, None)
+        for empresa_id, atual in list(self._por_empresa.items()):
+            if atual == db_alias:
+                del self._por_empresa[empresa_id]
+        self._descartar_wrapper(db_alias)
+
+    @staticmethod
+    def _descartar_wrapper(db_alias):
+        # Só o wrapper desta thread: connections[alias] devolveria a conexão (e a
+        # configuração) antiga enquanto ele existir
+        try:
+            connections[db_alias].close()
+        except Exception:
+            pass
+        try:
+            del connections[db_alias]
+        except AttributeError:
+            pass
+
+
+registro_conexoes = RegistroConexoes()
+
+
 class DatabaseManager:
     """Gerenciar conexões com bancos de empresas"""
 
@@ -11,6 +119,11 @@ class DatabaseManager:
         """
         Configura a conexão com o banco da empresa e retorna o alias
         """
+        # Já configurado e testado recentemente: nenhuma query nem SELECT 1
+        db_alias = registro_conexoes.alias_valido(empresa_id)
+        if db_alias:
+            return db_alias
+
         try:
             # VERIFICAÇÃO SEGURA - primeiro verifica se existe
             if not DatabaseManager.empresa_tem_banco_proprio(empresa_id):
@@ -18,11 +131,6 @@ class DatabaseManager:
                 return None
 
             conexao = ConexaoBanco.objects.get(empresa_id=empresa_id)
-            db_alias = f'empresa_{empresa_id}'
-
-            # Verifica se já existe para evitar reconfiguração
-            if db_alias in settings.DATABASES:
-                return db_alias
 
             db_config = {
                 'ENGINE': 'django.db.backends.postgresql',
@@ -41,9 +149,8 @@ class DatabaseManager:
                 'AUTOCOMMIT': True,
             }
 
-            # Adiciona conexão
-            settings.DATABASES[db_alias] = db_config
-            connections.databases[db_alias] = db_config
+            # Adiciona conexão (mantém a existente se a configuração não mudou)
+            db_alias = registro_conexoes.registrar(empresa_id, db_config)
 
             # Testa a conexão
             try:
@@ -54,10 +161,7 @@ class DatabaseManager:
             except Exception as conn_error:
                 print(f"Erro ao conectar no banco da empresa {empresa_id}: {conn_error}")
                 # Remove a conexão problemática
-                if db_alias in settings.DATABASES:
-                    del settings.DATABASES[db_alias]
-                if db_alias in connections.databases:
-                    del connections.databases[db_alias]
+                registro_conexoes.remover(empresa_id)
                 return None
 
         except ConexaoBanco.DoesNotExist:
@@ -67,27 +171,61 @@ class DatabaseManager:
             print(f"Erro ao configurar banco da empresa {empresa_id}: {e}")
             return None
 
+    @staticmethod
+    def chave_cache_banco_proprio(empresa_id):
+        return f'empresa_banco_proprio_{empresa_id}'
+
     @staticmethod
     def empresa_tem_banco_proprio(empresa_id):
         """
         Verifica se a empresa tem banco próprio configurado
+        (cacheado; os signals de ConexaoBanco invalidam a chave)
         """
+        cache_key = DatabaseManager.chave_cache_banco_proprio(empresa_id)
+        try:
+            cached_result = cache.get(cache_key)
+        except Exception as e:
+            print(f"Erro ao ler cache de banco próprio da empresa {empresa_id}: {e}")
+            cached_result = None
+
+        if cached_result is not None:
+            return cached_result
+
         try:
             # VERIFICAÇÃO SEGURA - sem usar campo 'status'
-            return ConexaoBanco.objects.filter(empresa_id=empresa_id, status=True).exists()
+            tem_banco = ConexaoBanco.objects.filter(empresa_id=empresa_id, status=True).exists()
         except Exception as e:
             print(f"Erro ao verificar banco próprio da empresa {empresa_id}: {e}")
             return False
 
+        try:
+            cache.set(cache_key, tem_banco, settings.EMPRESA_DB_TOPOLOGIA_TTL)
+        except Exception as e:
+            print(f"Erro ao gravar cache de banco próprio da empresa {empresa_id}: {e}")
+        return tem_banco
+
+    @staticmethod
+    def invalidar_empresa(empresa_id):
+        """
+        Descarta o cache de topologia e o alias registrado neste processo
+        (os demais processos refazem o teste quando o TTL do registro vencer)
+        """
+        try:
+            cache.delete(DatabaseManager.chave_cache_banco_proprio(empresa_id))
+        except Exception as e:
+            print(f"Erro ao invalidar cache de banco próprio da empresa {empresa_id}: {e}")
+        registro_conexoes.remover(empresa_id)
+
     @staticmethod
     def usar_banco_empresa(empresa_id):
         """
         Define qual banco usar para as próximas queries dos modelos flat
+        (apenas no contexto atual: request, task ou thread)
         """
         try:
             db_alias = DatabaseManager.configurar_conexao_empresa(empresa_id)
             if db_alias:
-                settings.EMPRESA_DATABASE_ALIAS = db_alias
+                _alias_banco_empresa.set(db_alias)
                 return True
             return False
         except Exception as e:
@@ -99,5 +237,4 @@ class DatabaseManager:
         """
         Limpa a configuração do banco da empresa
         """
-        if hasattr(settings, 'EMPRESA_DATABASE_ALIAS'):
-            delattr(settings, 'EMPRESA_DATABASE_ALIAS')
+        _alias_banco_empresa.set('default')
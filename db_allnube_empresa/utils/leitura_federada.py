@@ -0,0 +1,216 @@
+"""
+Leitura federada dos modelos flat quando matriz e filiais têm bancos próprios.
+
+Cada empresa com ConexaoBanco vira um "shard" (alias empresa_<id>_<hash>); filiais sem
+banco próprio são lidas no shard da matriz, como as views já faziam. As
+consultas de todos os shards rodam em paralelo (uma conexão por alias em cada
+thread do pool) e as páginas ordenadas são intercaladas com heapq.merge, então
+a latência de uma página é a do shard mais lento, não a soma.
+
+Uso:
+
+    consulta = ConsultaFederada.da_matriz(
+        NotaFiscalFlat, matriz_id, filiais_ids,
+        lambda queryset, empresas_ids: queryset.filter(empresa_id__in=empresas_ids, deleted_at__isnull=True),
+        ordenacao=('-dhEmi', '-id'),
+    )
+
+A ConsultaFederada se comporta como um queryset para filtros (filter/aplicar),
+ordenação e fatiamento, o que basta para o DjangoFilterBackend (via aplicar) e
+para as paginações do projeto. Não tem .get: views de detalhe usam banco_de()
+para obter o queryset do shard que tem a linha.
+"""
+
+import heapq
+import threading
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+
+from db_allnube_empresa.utils.database_utils import DatabaseManager
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _obter_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.EMPRESA_DB_FANOUT_THREADS,
+                thread_name_prefix='leitura_federada',
+            )
+        return _executor
+
+
+def _executar_no_shard(alias, funcao):
+    # Threads do pool não passam pelo request_finished: descarta conexões velhas aqui
+    connections[alias].close_if_unusable_or_obsolete()
+    return funcao()
+
+
+def _expressoes_ordenacao(campos):
+    """
+    NULL explícito na ponta em que _chave_ordenacao o põe (primeiro no
+    decrescente, último no crescente): cada shard devolve na mesma ordem do
+    merge em qualquer backend, não só no PostgreSQL.
+    """
+    return [
+        F(campo[1:]).desc(nulls_first=True) if campo.startswith('-') else F(campo).asc(nulls_last=True)
+        for campo in campos
+    ]
+
+
+def _chave_ordenacao(campos):
+    """Chave comparável para heapq.merge; NULL fica onde o PostgreSQL o põe (maior valor)"""
+    nomes = [campo.lstrip('-') for campo in campos]
+
+    def chave(objeto):
+        valores = []
+        for nome in nomes:
+            valor = getattr(objeto, nome)
+            valores.append((1, 0) if valor is None else (0, valor))
+        return tuple(valores)
+
+    return chave
+
+
+class ConsultaFederada:
+    """Mesma consulta aplicada a vários bancos, com resultados intercalados na ordem pedida"""
+
+    def __init__(self, model, querysets, ordenacao=()):
+        self.model = model
+        self.querysets = querysets  # {alias: queryset já com .using(alias)}
+        self.ordenacao = tuple(ordenacao)
+        self._contagem = None
+
+    @classmethod
+    def da_matriz(cls, model, matriz_id, filiais_ids, montar_queryset, ordenacao=('-id',)):
+        """
+        Um shard por empresa com banco próprio; filiais sem banco vão para o da matriz.
+        montar_queryset(queryset, empresas_ids) aplica os filtros de cada shard.
+        """
+        empresas_por_alias = {}
+        alias_matriz = DatabaseManager.configurar_conexao_empresa(matriz_id)
+        for empresa_id in [matriz_id, *filiais_ids]:
+            alias = None
+            if empresa_id != matriz_id and DatabaseManager.empresa_tem_banco_proprio(empresa_id):
+                alias = DatabaseManager.configurar_conexao_empresa(empresa_id)
+            alias = alias or alias_matriz
+            if alias:
+                empresas_por_alias.setdefault(alias, []).append(empresa_id)
+
+        querysets = {
+            alias: montar_queryset(model.objects.using(alias), empresas_ids)
+            for alias, empresas_ids in empresas_por_alias.items()
+        }
+        return cls(model, querysets).order_by(*ordenacao)
+
+    @property
+    def multiplos_bancos(self):
+        return len(self.querysets) > 1
+
+    def simplificar(self):
+        """Com um único banco devolve o queryset puro (sem custo de fan-out)"""
+        if len(self.querysets) == 1:
+            return next(iter(self.querysets.values())).order_by(*_expressoes_ordenacao(self.ordenacao))
+        if not self.querysets:
+            return self.model.objects.none()
+        return self
+
+    def banco_de(self, **filtros):
+        """
+        Queryset puro do banco que tem a linha (para detalhe/edição: get_object
+        precisa de um queryset de verdade e a instância volta com _state.db do
+        shard). Se mais de um banco casar, vence o primeiro shard (o da matriz).
+        """
+        encontrados = self._em_paralelo(lambda queryset: queryset.filter(**filtros).exists())
+        for alias, queryset in self.querysets.items():
+            if encontrados.get(alias):
+                return queryset
+        return self.model.objects.none()
+
+    def _clonar(self, querysets=None, ordenacao=None):
+        return ConsultaFederada(
+            self.model,
+            querysets if querysets is not None else dict(self.querysets),
+            ordenacao if ordenacao is not None else self.ordenacao,
+        )
+
+    def aplicar(self, funcao):
+        """Aplica funcao(queryset) -> queryset em todos os shards (filtros, filterset...)"""
+        return self._clonar({alias: funcao(queryset) for alias, queryset in self.querysets.items()})
+
+    def filter(self, *args, **kwargs):
+        return self.aplicar(lambda queryset: queryset.filter(*args, **kwargs))
+
+    def order_by(self, *campos):
+        direcoes = {campo.startswith('-') for campo in campos}
+        if len(direcoes) > 1:
+            raise ValueError('ConsultaFederada só intercala ordenações com uma única direção')
+        consulta = self.aplicar(lambda queryset: queryset.order_by(*_expressoes_ordenacao(campos)))
+        consulta.ordenacao = tuple(campos)
+        return consulta
+
+    def none(self):
+        return self._clonar({})
+
+    def _em_paralelo(self, funcao):
+        """{alias: funcao(queryset)} executado concorrentemente"""
+        if not self.querysets:
+            return {}
+        if len(self.querysets) == 1:
+            alias, queryset = next(iter(self.querysets.items()))
+            return {alias: funcao(queryset)}
+
+        executor = _obter_executor()
+        futuros = {
+            alias: executor.submit(_executar_no_shard, alias, lambda queryset=queryset: funcao(queryset))
+            for alias, queryset in self.querysets.items()
+        }
+        return {alias: futuro.result() for alias, futuro in futuros.items()}
+
+    def count(self):
+        if self._contagem is None:
+            self._contagem = sum(self._em_paralelo(lambda queryset: queryset.count()).values())
+        return self._contagem
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        if item.step:
+            raise ValueError('ConsultaFederada não suporta passo no fatiamento')
+
+        inicio = item.start or 0
+        fim = item.stop
+
+        # Cada shard devolve no máximo "fim" linhas já ordenadas; o merge corta a página
+        if fim is None:
+            paginas = self._em_paralelo(lambda queryset: list(queryset))
+        else:
+            paginas = self._em_paralelo(lambda queryset: list(queryset[:fim]))
+
+        descendente = bool(self.ordenacao) and self.ordenacao[0].startswith('-')
+        intercalado = heapq.merge(
+            *paginas.values(), key=_chave_ordenacao(self.ordenacao), reverse=descendente
+        )
+        return list(islice(intercalado, inicio, fim))
+
+
+class FiltroFederadoMixin:
+    """Para views genéricas: aplica os filter_backends em cada banco da ConsultaFederada"""
+
+    def filter_queryset(self, queryset):
+        if isinstance(queryset, ConsultaFederada):
+            return queryset.aplicar(super().filter_queryset)
+        return super().filter_queryset(queryset)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-16 20:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('empresa', '0012_empresa_nfe_hora_inicio_nfe_hora_fim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='empresa',
+            name='nfe_proxima_consulta',
+            field=models.DateTimeField(blank=True, help_text='Próxima consulta à distribuição DF-e permitida pela SEFAZ (cStat 137/656)', null=True),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.1 on 2026-10-16 22:10
+
+import django.db.models.deletion
+from django.contrib.postgres.indexes import BrinIndex
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def popular_cursor_nsu(apps, schema_editor):
+    """Cria o cursor de cada empresa a partir do registro mais recente do HistoricoNSU"""
+    Empresa = apps.get_model('empresa', 'Empresa')
+    HistoricoNSU = apps.get_model('empresa', 'HistoricoNSU')
+    CursorNSU = apps.get_model('empresa', 'CursorNSU')
+
+    ultimo_nsu = HistoricoNSU.objects.filter(empresa_id=OuterRef('pk')).order_by('-created_at', '-id').values('nsu')[:1]
+    empresas = Empresa.objects.annotate(ult_nsu=Subquery(ultimo_nsu)).filter(ult_nsu__isnull=False)
+
+    CursorNSU.objects.bulk_create(
+        [
+            CursorNSU(empresa_id=empresa_id, ult_nsu=ult_nsu, max_nsu=ult_nsu)
+            for empresa_id, ult_nsu in empresas.values_list('id', 'ult_nsu').iterator()
+        ],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+    # Índices do HistoricoNSU criados sem bloquear a tabela (já grande em produção)
+    atomic = False
+
+    dependencies = [
+        ('empresa', '0013_empresa_nfe_proxima_consulta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CursorNSU',
+            fields=[
+                ('empresa', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='cursor_nsu', serialize=False, to='empresa.empresa')),
+                ('ult_nsu', models.BigIntegerField(default=0)),
+                ('max_nsu', models.BigIntegerField(default=0)),
+                ('ultimo_cstat', models.CharField(blank=True, max_length=3, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(popular_cursor_nsu, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='historiconsu',
+            index=models.Index(fields=['empresa', '-created_at'], name='historico_nsu_emp_criado_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='historiconsu',
+            index=BrinIndex(fields=['created_at'], name='historico_nsu_criado_brin'),
+        ),
+    ]
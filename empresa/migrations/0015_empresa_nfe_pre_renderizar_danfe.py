@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-16 22:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('empresa', '0014_cursornsu_historiconsu_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='empresa',
+            name='nfe_pre_renderizar_danfe',
+            field=models.BooleanField(default=False, help_text='Gera o DANFE em segundo plano assim que a NFe chega pela distribuição DF-e'),
+        ),
+    ]
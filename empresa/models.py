@@ -1,5 +1,9 @@
 from django.contrib.auth.models import User
-from django.db import models
+from django.contrib.postgres.indexes import BrinIndex
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
 
 from django.conf import settings
 from cryptography.fernet import Fernet
@@ -58,6 +62,8 @@ class Empresa(models.Model):
     senha = models.CharField(max_length=255)
     nfe_hora_inicio = models.IntegerField(default=0, help_text="Hora de início da automação NFe (0-23)")
     nfe_hora_fim = models.IntegerField(default=6, help_text="Hora de fim da automação NFe (0-23)")
+    nfe_proxima_consulta = models.DateTimeField(null=True, blank=True, help_text="Próxima consulta à distribuição DF-e permitida pela SEFAZ (cStat 137/656)")
+    nfe_pre_renderizar_danfe = models.BooleanField(default=False, help_text="Gera o DANFE em segundo plano assim que a NFe chega pela distribuição DF-e")
     file = models.FileField(upload_to='certificados/', null=True, blank=True)
     status = models.CharField(max_length=1, choices=STATUS_CHOICES)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -90,15 +96,79 @@ class Empresa(models.Model):
 
 
 class HistoricoNSU(models.Model):
+    """
+    Auditoria (append-only) dos avanços do CursorNSU: uma linha por página da
+    distribuição DF-e, gravada só com NFE_HISTORICO_NSU_AUDITORIA ligado.
+    O NSU atual é lido do CursorNSU, nunca desta tabela.
+    """
     empresa = models.ForeignKey(Empresa, on_delete=models.CASCADE, related_name='historico_empresa')
     nsu = models.IntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['empresa', '-created_at'], name='historico_nsu_emp_criado_idx'),
+            # Tabela só cresce em ordem de created_at: BRIN atende o expurgo por período com poucas páginas
+            BrinIndex(fields=['created_at'], name='historico_nsu_criado_brin'),
+        ]
+
     def __str__(self):
         return self.empresa.razao_social
 
 
+class CursorNSU(models.Model):
+    """
+    Posição da empresa na distribuição DF-e (uma linha por empresa).
+
+    A leitura é um lookup pela PK e o avanço é um único UPDATE monotônico
+    (GREATEST): páginas reprocessadas ou fora de ordem não fazem o cursor voltar.
+    """
+    empresa = models.OneToOneField(Empresa, on_delete=models.CASCADE, primary_key=True, related_name='cursor_nsu')
+    ult_nsu = models.BigIntegerField(default=0)
+    max_nsu = models.BigIntegerField(default=0)
+    ultimo_cstat = models.CharField(max_length=3, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.empresa_id} - NSU {self.ult_nsu}'
+
+    @classmethod
+    def obter_nsu(cls, empresa_id):
+        """Último NSU processado da empresa (0 se nunca consultou)"""
+        nsu = cls.objects.filter(pk=empresa_id).values_list('ult_nsu', flat=True).first()
+        return int(nsu) if nsu else 0
+
+    @classmethod
+    def avancar(cls, empresa_id, ult_nsu, max_nsu=None, cstat=None, auditar=True):
+        """Avança o cursor até ult_nsu (nunca recua) e registra a auditoria opcional"""
+        ult_nsu = int(ult_nsu)
+        campos = {
+            'ult_nsu': Greatest(F('ult_nsu'), Value(ult_nsu)),
+            'updated_at': timezone.now(),
+        }
+        if max_nsu is not None:
+            campos['max_nsu'] = Greatest(F('max_nsu'), Value(int(max_nsu)))
+        if cstat is not None:
+            campos['ultimo_cstat'] = cstat
+
+        if not cls.objects.filter(pk=empresa_id).update(**campos):
+            try:
+                with transaction.atomic():
+                    cls.objects.create(
+                        empresa_id=empresa_id,
+                        ult_nsu=ult_nsu,
+                        max_nsu=max(ult_nsu, int(max_nsu or 0)),
+                        ultimo_cstat=cstat,
+                    )
+            except IntegrityError:
+                # Outra execução criou o cursor entre o UPDATE e o INSERT
+                cls.objects.filter(pk=empresa_id).update(**campos)
+
+        if auditar and settings.NFE_HISTORICO_NSU_AUDITORIA:
+            HistoricoNSU.objects.create(empresa_id=empresa_id, nsu=ult_nsu)
+
+
 class ConexaoBanco(models.Model):
     empresa = models.OneToOneField('Empresa', on_delete=models.CASCADE, related_name='conexao_banco', unique=True)
     _host = models.BinaryField(db_column='host')
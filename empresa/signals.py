@@ -0,0 +1,31 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from empresa.models import Empresa, Funcionario, RotasPermitidas
+from sistema.utils import permissoes
+
+
+@receiver(post_save, sender=Funcionario)
+@receiver(post_delete, sender=Funcionario)
+def invalidar_permissoes_funcionario(sender, instance, **kwargs):
+    """O próprio funcionário e o dono da empresa (que gerencia o funcionário)"""
+    usuarios = {instance.user_id}
+    usuarios.update(Empresa.objects.filter(pk=instance.empresa_id).values_list('usuario_id', flat=True))
+    permissoes.invalidar_usuarios(usuarios)
+
+
+@receiver(post_save, sender=RotasPermitidas)
+@receiver(post_delete, sender=RotasPermitidas)
+def invalidar_permissoes_rotas_permitidas(sender, instance, **kwargs):
+    permissoes.invalidar_usuarios(
+        Funcionario.objects.filter(pk=instance.funcionario_id).values_list('user_id', flat=True)
+    )
+
+
+@receiver(post_save, sender=Empresa)
+@receiver(post_delete, sender=Empresa)
+def invalidar_permissoes_empresa(sender, instance, **kwargs):
+    """Empresa criada, removida ou com dono/matriz alterados muda o escopo de quem está ligado a ela"""
+    usuarios = permissoes.usuarios_da_empresa(instance.pk)
+    usuarios.add(instance.usuario_id)
+    permissoes.invalidar_usuarios(usuarios)
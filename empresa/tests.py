@@ -1,3 +1,97 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 
-# Create your tests here.
+from app.utils import contexto_empresa
+from app.utils.utils import obter_matriz_funcionario, verificaRestricaoAdministrativa
+from empresa.models import Empresa, CursorNSU, Funcionario, HistoricoNSU
+from sistema.models import EmpresaSistema, Sistema
+
+
+class CursorNSUTests(TestCase):
+    """O cursor de NSU é uma linha por empresa e nunca recua"""
+
+    @classmethod
+    def setUpTestData(cls):
+        usuario = User.objects.create_user(username='nsu', password='nsu')
+        cls.empresa = Empresa.objects.create(
+            usuario=usuario, razao_social='Empresa NSU', documento='55666777000188',
+            uf='SP', senha='123', status='1'
+        )
+
+    def test_empresa_sem_cursor_comeca_do_zero(self):
+        self.assertEqual(CursorNSU.obter_nsu(self.empresa.id), 0)
+
+    @override_settings(NFE_HISTORICO_NSU_AUDITORIA=False)
+    def test_avanca_sem_recuar(self):
+        CursorNSU.avancar(self.empresa.id, 150, max_nsu=300, cstat='138')
+        CursorNSU.avancar(self.empresa.id, 100, max_nsu=300, cstat='138')
+
+        cursor = CursorNSU.objects.get(pk=self.empresa.id)
+        self.assertEqual(cursor.ult_nsu, 150)
+        self.assertEqual(cursor.max_nsu, 300)
+        self.assertEqual(cursor.ultimo_cstat, '138')
+        self.assertEqual(CursorNSU.objects.filter(empresa=self.empresa).count(), 1)
+        self.assertFalse(HistoricoNSU.objects.exists())
+
+    @override_settings(NFE_HISTORICO_NSU_AUDITORIA=True)
+    def test_auditoria_opcional(self):
+        CursorNSU.avancar(self.empresa.id, 50)
+        CursorNSU.avancar(self.empresa.id, 50, cstat='137', auditar=False)
+
+        self.assertEqual(list(HistoricoNSU.objects.values_list('nsu', flat=True)), [50])
+        self.assertEqual(CursorNSU.obter_nsu(self.empresa.id), 50)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ContextoEmpresaTests(TestCase):
+    """Empresa, matriz e sistemas do usuário resolvidos uma vez por request"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sistema = Sistema.objects.create(id=3, nome='NF-e')
+        cls.dono = User.objects.create_user(username='dono-contexto', password='x')
+        cls.usuario = User.objects.create_user(username='func-contexto', password='x')
+        cls.matriz = Empresa.objects.create(
+            usuario=cls.dono, sistema=cls.sistema, razao_social='Matriz', documento='10111222000133',
+            uf='SP', senha='123', status='1'
+        )
+        cls.filial = Empresa.objects.create(
+            usuario=cls.dono, sistema=cls.sistema, matriz_filial=cls.matriz, razao_social='Filial',
+            documento='10111222000214', uf='SP', senha='123', status='1'
+        )
+        Funcionario.objects.create(user=cls.usuario, empresa=cls.filial, role=Funcionario.FUNCIONARIO, status='1')
+
+    def setUp(self):
+        cache.clear()
+        contexto_empresa.iniciar_request()
+        self.addCleanup(contexto_empresa.encerrar_request)
+
+    def test_matriz_e_restricao_sem_query_no_mesmo_request(self):
+        self.assertEqual(obter_matriz_funcionario(self.dono), self.matriz.id)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(obter_matriz_funcionario(self.dono), self.matriz.id)
+            self.assertTrue(verificaRestricaoAdministrativa(self.filial, 3))
+            contexto = contexto_empresa.obter_contexto(self.dono)
+            self.assertEqual(contexto.tipo_usuario, contexto_empresa.DONO)
+            self.assertEqual(contexto.empresa_id, self.matriz.id)
+            self.assertTrue(contexto.tem_sistema(3))
+
+        self.assertEqual(contexto.filiais_ids, [self.filial.id])
+
+    def test_funcionario_usa_empresa_do_vinculo(self):
+        contexto = contexto_empresa.obter_contexto(self.usuario)
+
+        self.assertEqual(obter_matriz_funcionario(self.usuario), self.filial.id)
+        self.assertEqual(contexto.tipo_usuario, contexto_empresa.FUNCIONARIO)
+        self.assertEqual(contexto.matriz_id, self.matriz.id)
+
+    def test_alteracao_no_request_descarta_o_contexto(self):
+        contexto_empresa.obter_contexto(self.dono).permissoes
+        with self.assertNumQueries(0):
+            self.assertTrue(verificaRestricaoAdministrativa(self.matriz.id, 3))
+
+        EmpresaSistema.objects.create(empresa=self.matriz, sistema=self.sistema, ativo=False)
+
+        self.assertFalse(verificaRestricaoAdministrativa(self.matriz.id, 3))
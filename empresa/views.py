@@ -1226,8 +1226,9 @@ class DeletarEmpresaAdminAPIView(APIView):
             if qtd_filiais > 0:
                 resultado['acoes'].append(f"{qtd_filiais} filial(is) removida(s)")
 
-            # 6. Remove histórico NSU (se existir)
-            from empresa.models import HistoricoNSU
+            # 6. Remove cursor e histórico NSU (se existir)
+            from empresa.models import CursorNSU, HistoricoNSU
+            CursorNSU.objects.filter(empresa=empresa).delete()
             historicos = HistoricoNSU.objects.filter(empresa=empresa)
             qtd_historicos = historicos.count()
             historicos.delete()
@@ -0,0 +1,78 @@
+"""
+Geração de XMLs procNFe sintéticos para os comandos de benchmark.
+
+Não é um comando (o prefixo "_" faz o Django ignorá-lo na listagem).
+"""
+
+import random
+import uuid
+from datetime import datetime
+
+NAMESPACE_NFE = 'http://www.portalfiscal.inf.br/nfe'
+
+
+def gerar_chave():
+    """Gera uma chave de 44 dígitos aleatória (não valida o DV)"""
+    return '35' + ''.join(random.choices('0123456789', k=42))
+
+
+def _item(n):
+    return (
+        f'<det nItem="{n}">'
+        '<prod>'
+        f'<cProd>P{n:06d}</cProd><cEAN>SEM GTIN</cEAN>'
+        f'<xProd>PRODUTO SINTETICO {n}</xProd>'
+        '<NCM>84713012</NCM><CFOP>5102</CFOP><uCom>UN</uCom>'
+        '<qCom>2.0000</qCom><vUnCom>10.5000</vUnCom><vProd>21.00</vProd>'
+        '<cEANTrib>SEM GTIN</cEANTrib><uTrib>UN</uTrib>'
+        '<qTrib>2.0000</qTrib><vUnTrib>10.5000</vUnTrib><indTot>1</indTot>'
+        '</prod>'
+        '<imposto><vTotTrib>3.15</vTotTrib>'
+        '<ICMS><ICMS00><orig>0</orig><CST>00</CST></ICMS00></ICMS>'
+        '</imposto>'
+        '</det>'
+    )
+
+
+def gerar_xml_nfe(qtd_itens=500, chave=None, qtd_pagamentos=2):
+    """Retorna (chave, xml em bytes) de um procNFe com `qtd_itens` itens"""
+    chave = chave or gerar_chave()
+    dh_emi = datetime.now().strftime('%Y-%m-%dT%H:%M:%S-03:00')
+    itens = ''.join(_item(n) for n in range(1, qtd_itens + 1))
+    pagamentos = ''.join(
+        f'<pag><tPag>01</tPag><vPag>{qtd_itens * 21 / qtd_pagamentos:.2f}</vPag></pag>'
+        for _ in range(qtd_pagamentos)
+    )
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<nfeProc xmlns="{NAMESPACE_NFE}" versao="4.00">'
+        '<NFe>'
+        f'<infNFe Id="NFe{chave}" versao="4.00">'
+        '<ide><cUF>35</cUF><natOp>VENDA</natOp><mod>55</mod><serie>1</serie>'
+        f'<nNF>{random.randint(1, 999999)}</nNF><dhEmi>{dh_emi}</dhEmi>'
+        '<tpNF>1</tpNF><idDest>1</idDest><cMunFG>3550308</cMunFG><tpImp>1</tpImp>'
+        '<tpEmis>1</tpEmis><cDV>0</cDV><tpAmb>1</tpAmb><finNFe>1</finNFe>'
+        '<indFinal>0</indFinal><indPres>9</indPres><procEmi>0</procEmi><verProc>1.0</verProc></ide>'
+        '<emit><CNPJ>11222333000181</CNPJ><xNome>EMITENTE SINTETICO LTDA</xNome>'
+        '<enderEmit><xLgr>RUA A</xLgr><nro>1</nro><xBairro>CENTRO</xBairro><cMun>3550308</cMun>'
+        '<xMun>SAO PAULO</xMun><UF>SP</UF><CEP>01001000</CEP><cPais>1058</cPais><xPais>BRASIL</xPais>'
+        '</enderEmit><IE>111111111111</IE><CRT>3</CRT></emit>'
+        '<dest><CNPJ>44555666000199</CNPJ><xNome>DESTINATARIO SINTETICO LTDA</xNome>'
+        '<enderDest><xLgr>RUA B</xLgr><nro>2</nro><xBairro>CENTRO</xBairro><cMun>3550308</cMun>'
+        '<xMun>SAO PAULO</xMun><UF>SP</UF><CEP>01001000</CEP><cPais>1058</cPais><xPais>BRASIL</xPais>'
+        '</enderDest><indIEDest>1</indIEDest><IE>222222222222</IE></dest>'
+        f'{itens}'
+        '<total><ICMSTot><vBC>0.00</vBC><vICMS>0.00</vICMS><vICMSDeson>0.00</vICMSDeson>'
+        '<vFCP>0.00</vFCP><vBCST>0.00</vBCST><vST>0.00</vST><vFCPST>0.00</vFCPST>'
+        f'<vFCPSTRet>0.00</vFCPSTRet><vProd>{qtd_itens * 21:.2f}</vProd><vFrete>0.00</vFrete>'
+        '<vSeg>0.00</vSeg><vDesc>0.00</vDesc><vII>0.00</vII><vIPI>0.00</vIPI>'
+        '<vIPIDevol>0.00</vIPIDevol><vPIS>0.00</vPIS><vCOFINS>0.00</vCOFINS><vOutro>0.00</vOutro>'
+        f'<vNF>{qtd_itens * 21:.2f}</vNF><vTotTrib>0.00</vTotTrib></ICMSTot></total>'
+        '<transp><modFrete>9</modFrete><vol><qVol>1</qVol></vol></transp>'
+        f'<cobr><fat><nFat>{uuid.uuid4().hex[:8]}</nFat><vOrig>{qtd_itens * 21:.2f}</vOrig>'
+        f'<vDesc>0.00</vDesc><vLiq>{qtd_itens * 21:.2f}</vLiq></fat>{pagamentos}</cobr>'
+        '</infNFe>'
+        '</NFe>'
+        '</nfeProc>'
+    )
+    return chave, xml.encode('utf-8')
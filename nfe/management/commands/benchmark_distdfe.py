@@ -0,0 +1,70 @@
+"""
+Mede o custo de CPU por docZip da distribuição DF-e (sem tocar no banco).
+
+Compara o caminho antigo (descompacta -> tostring -> grava XML -> relê ->
+reparseia) com o atual (descompacta e parseia uma vez; o gzip vai para o acervo
+como chegou). Usa time.process_time, então a espera de disco não entra na conta.
+
+Uso:
+
+    python manage.py benchmark_distdfe
+    python manage.py benchmark_distdfe --documentos 500 --itens 20
+"""
+
+import base64
+import gzip
+import os
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+
+from django.core.management.base import BaseCommand
+from lxml import etree
+from pynfe.utils.descompactar import DescompactaGzip
+
+from nfe.processor.nfe_parser import extrair_dados_nfe
+
+from ._nfe_sintetica import gerar_xml_nfe
+
+
+def _caminho_antigo(doc_zip, diretorio, indice):
+    xml_descompactado = DescompactaGzip.descompacta(doc_zip)
+    conteudo = etree.tostring(xml_descompactado, encoding='utf-8').decode('utf-8')
+    caminho = os.path.join(diretorio, f'nfe_nsu-{indice}.xml')
+    with open(caminho, 'w', encoding='utf-8') as f:
+        f.write(conteudo)
+    with open(caminho, 'r', encoding='utf-8') as f:
+        return extrair_dados_nfe(ET.fromstring(f.read()))
+
+
+def _caminho_atual(doc_zip, diretorio, indice):
+    conteudo_gzip = base64.b64decode(doc_zip)
+    return extrair_dados_nfe(etree.fromstring(gzip.decompress(conteudo_gzip)))
+
+
+class Command(BaseCommand):
+    help = 'Benchmark da distribuição DF-e: CPU por documento (reparse via disco x parse único).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documentos', type=int, default=200, help='Quantidade de docZip por rodada')
+        parser.add_argument('--itens', type=int, default=10, help='Itens (<det>) por nota')
+
+    def handle(self, *args, **options):
+        documentos = []
+        for _ in range(options['documentos']):
+            _, conteudo = gerar_xml_nfe(options['itens'])
+            documentos.append(base64.b64encode(gzip.compress(conteudo)).decode('ascii'))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(documentos)} docZip com {options['itens']} itens cada"
+        ))
+
+        with tempfile.TemporaryDirectory() as diretorio:
+            for nome, funcao in (('antigo', _caminho_antigo), ('atual', _caminho_atual)):
+                inicio = time.process_time()
+                for indice, doc_zip in enumerate(documentos):
+                    funcao(doc_zip, diretorio, indice)
+                duracao = time.process_time() - inicio
+                self.stdout.write(
+                    f"  {nome:<7} {duracao * 1000:.1f} ms CPU | {duracao * 1000 / len(documentos):.3f} ms/doc"
+                )
@@ -0,0 +1,90 @@
+"""
+Mede a vazão da exportação em ZIP (XML + DANFE) para um mês sintético.
+
+Grava N notas sintéticas no acervo de um MEDIA_ROOT temporário, gera os
+DANFEs em blocos num pool de processos (o mesmo renderizar_danfes usado pelas
+tasks, simulando N workers) e escreve o ZIP com escrever_zip. Mostra notas por
+segundo de cada fase, tamanho do ZIP e o quanto o pico de memória cresceu
+durante a compactação (que não deve depender da quantidade de notas). Não toca
+no banco.
+
+Uso:
+
+    python manage.py benchmark_exportacao_nfe
+    python manage.py benchmark_exportacao_nfe --notas 5000 --processos 8
+    python manage.py benchmark_exportacao_nfe --sem_danfe
+"""
+
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from app.utils import arquivo_xml, danfe
+from nfe.processor.nfe_exportacao import escrever_zip, renderizar_danfes
+
+from ._nfe_sintetica import gerar_xml_nfe
+
+EMPRESA_ID = 1
+
+
+class Command(BaseCommand):
+    help = 'Benchmark da exportação em ZIP: notas/segundo para gerar DANFEs e compactar.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notas', type=int, default=5000, help='Notas do mês sintético')
+        parser.add_argument('--itens', type=int, default=10, help='Itens (<det>) por nota')
+        parser.add_argument('--processos', type=int, default=os.cpu_count() or 2, help='Processos que geram os DANFEs')
+        parser.add_argument('--sem_danfe', action='store_true', help='Exporta só os XMLs')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            self.stdout.write(self.style.SUCCESS(f"Gerando {options['notas']} notas sintéticas..."))
+            notas = []
+            for _ in range(options['notas']):
+                chave, conteudo = gerar_xml_nfe(options['itens'])
+                notas.append((EMPRESA_ID, chave, arquivo_xml.salvar_xml(EMPRESA_ID, conteudo)))
+
+            if not options['sem_danfe']:
+                self._medir_danfes(notas, options['processos'])
+
+            destino = os.path.join(media, 'exportacoes', 'benchmark.zip')
+            documentos = (
+                (chave, caminho_xml, None if options['sem_danfe'] else danfe.caminho_pdf(empresa_id, chave, caminho_xml))
+                for empresa_id, chave, caminho_xml in notas
+            )
+
+            memoria_antes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            inicio = time.perf_counter()
+            resultado = escrever_zip(destino, documentos)
+            duracao = time.perf_counter() - inicio
+            # ru_maxrss vem em KB no Linux
+            memoria = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memoria_antes
+
+            self.stdout.write(
+                f"  ZIP       {len(notas) / duracao:.0f} notas/s | {duracao:.1f} s | "
+                f"{os.path.getsize(destino) / 1024 / 1024:.1f} MB | pico +{memoria / 1024:.1f} MB | "
+                f"{resultado['xmls']} XML(s), {resultado['danfes']} DANFE(s), {len(resultado['erros'])} erro(s)"
+            )
+
+    def _medir_danfes(self, notas, processos):
+        tamanho = settings.NFE_EXPORTACAO_DANFES_POR_TASK
+        blocos = [notas[inicio:inicio + tamanho] for inicio in range(0, len(notas), tamanho)]
+
+        inicio = time.perf_counter()
+        # fork: os processos herdam o MEDIA_ROOT temporário
+        with ProcessPoolExecutor(max_workers=processos, mp_context=multiprocessing.get_context('fork')) as pool:
+            gerados = [item for bloco in pool.map(renderizar_danfes, blocos) for item in bloco]
+        duracao = time.perf_counter() - inicio
+
+        erros = sum(1 for _, _, erro in gerados if erro)
+        self.stdout.write(
+            f"  DANFEs    {len(notas) / duracao:.0f} notas/s | {duracao:.1f} s | "
+            f"{processos} processo(s), {len(blocos)} bloco(s) de {tamanho} | {erros} erro(s)"
+        )
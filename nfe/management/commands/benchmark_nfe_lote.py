@@ -0,0 +1,91 @@
+"""
+Mede documentos por segundo do NFeLoteProcessor para um ZIP sintético.
+
+Compara o modo sequencial (processar_zip: extractall + um XML por vez) com o
+modo paralelo (processar_zip_paralelo: leitura direta do ZIP, parse num pool
+de processos e gravação em threads). Os registros criados são removidos ao
+final de cada execução.
+
+Uso:
+
+    python manage.py benchmark_nfe_lote --empresa_id 1
+    python manage.py benchmark_nfe_lote --empresa_id 1 --arquivos 10000 --processos 4 --escritores 4
+"""
+
+import io
+import os
+import time
+import zipfile
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+
+from app.utils import arquivo_xml
+from empresa.models import Empresa
+from nfe.models import NotaFiscal
+from nfe.processor.nfe_lote_zip import NFeLoteProcessor
+
+from ._nfe_sintetica import gerar_xml_nfe
+
+
+class Command(BaseCommand):
+    help = 'Benchmark do lote ZIP: documentos/segundo (sequencial x paralelo).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--empresa_id', type=int, required=True, help='Empresa usada como dona das notas sintéticas')
+        parser.add_argument('--arquivos', type=int, default=10000, help='Quantidade de XMLs no ZIP')
+        parser.add_argument('--itens', type=int, default=5, help='Itens (<det>) por nota')
+        parser.add_argument('--processos', type=int, default=None, help='Processos de parse (padrão: NFE_LOTE_PROCESSOS)')
+        parser.add_argument('--escritores', type=int, default=None, help='Threads de gravação (padrão: NFE_LOTE_ESCRITORES)')
+        parser.add_argument('--sem_sequencial', action='store_true', help='Mede apenas o modo paralelo')
+
+    def handle(self, *args, **options):
+        try:
+            empresa = Empresa.objects.get(pk=options['empresa_id'])
+        except Empresa.DoesNotExist:
+            raise CommandError(f"Empresa {options['empresa_id']} não encontrada")
+
+        conteudo_zip, chaves = self._gerar_zip(options['arquivos'], options['itens'])
+        self.stdout.write(
+            f"ZIP sintético: {options['arquivos']} XMLs, {len(conteudo_zip) / 1024 / 1024:.1f} MB\n"
+        )
+
+        modos = [('paralelo', lambda p: p.processar_zip_paralelo(options['processos'], options['escritores']))]
+        if not options['sem_sequencial']:
+            modos.insert(0, ('sequencial', lambda p: p.processar_zip()))
+
+        for titulo, executar in modos:
+            try:
+                processor = NFeLoteProcessor(empresa, 0, SimpleUploadedFile('lote.zip', conteudo_zip))
+                inicio = time.perf_counter()
+                resultados = executar(processor)
+                duracao = time.perf_counter() - inicio
+            finally:
+                self._limpar(chaves)
+
+            processados = resultados['nfe_processadas'] + resultados['eventos_processados'] + resultados['resumos_processados']
+            self.stdout.write(self.style.SUCCESS(titulo))
+            self.stdout.write(f"  processados: {processados} | erros: {len(resultados['erros'])}")
+            self.stdout.write(f"  tempo: {duracao:.1f} s | {processados / duracao:.1f} documentos/s\n")
+
+    @staticmethod
+    def _gerar_zip(quantidade, itens):
+        buffer = io.BytesIO()
+        chaves = []
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+            for _ in range(quantidade):
+                chave, xml = gerar_xml_nfe(itens)
+                zip_ref.writestr(f'benchmark-{chave}.xml', xml)
+                chaves.append(chave)
+        return buffer.getvalue(), chaves
+
+    @staticmethod
+    def _limpar(chaves):
+        for i in range(0, len(chaves), 500):
+            notas = NotaFiscal.objects.filter(chave__in=chaves[i:i + 500])
+            # XMLs gravados no acervo pelo lote
+            for caminho in notas.exclude(fileXml='').values_list('fileXml', flat=True):
+                absoluto = arquivo_xml.caminho_absoluto(caminho)
+                if os.path.exists(absoluto):
+                    os.remove(absoluto)
+            notas.delete()
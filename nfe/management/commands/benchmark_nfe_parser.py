@@ -0,0 +1,72 @@
+"""
+Mede o pico de memória da extração do XML da NFe (sem tocar no banco).
+
+Compara a leitura completa (arquivo em str + ElementTree inteira) com a leitura
+em streaming (lxml.etree.iterparse) para notas com quantidades crescentes de
+itens. Cada medição roda em um processo filho e usa o ru_maxrss do filho, que
+também enxerga a memória alocada pelo libxml2 (o tracemalloc não enxerga).
+
+Uso:
+
+    python manage.py benchmark_nfe_parser
+    python manage.py benchmark_nfe_parser --itens 500 5000 50000
+"""
+
+import os
+import resource
+import tempfile
+import time
+import multiprocessing
+import xml.etree.ElementTree as ET
+
+from django.core.management.base import BaseCommand
+
+from nfe.processor.nfe_parser import extrair_dados_nfe, extrair_dados_nfe_arquivo
+
+from ._nfe_sintetica import gerar_xml_nfe
+
+
+def _extrair_completo(caminho):
+    with open(caminho, 'r', encoding='utf-8') as f:
+        conteudo = f.read()
+    return extrair_dados_nfe(ET.fromstring(conteudo))
+
+
+def _medir(modo, caminho, fila):
+    antes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    inicio = time.perf_counter()
+    dados = extrair_dados_nfe_arquivo(caminho) if modo == 'streaming' else _extrair_completo(caminho)
+    duracao = time.perf_counter() - inicio
+    depois = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss vem em KB no Linux
+    fila.put({'itens': len(dados.itens), 'kb': depois - antes, 'ms': duracao * 1000})
+
+
+class Command(BaseCommand):
+    help = 'Benchmark da extração do XML: pico de memória e tempo (árvore completa x iterparse).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--itens', type=int, nargs='+', default=[500, 5000, 50000], help='Quantidades de itens (<det>) a medir')
+
+    def handle(self, *args, **options):
+        contexto = multiprocessing.get_context('fork')
+
+        for qtd in options['itens']:
+            _, conteudo = gerar_xml_nfe(qtd)
+            with tempfile.NamedTemporaryFile(suffix='.xml', delete=False) as f:
+                f.write(conteudo)
+                caminho = f.name
+
+            try:
+                self.stdout.write(self.style.SUCCESS(f"{qtd} itens ({len(conteudo) / 1024 / 1024:.1f} MB)"))
+                for modo in ('completo', 'streaming'):
+                    fila = contexto.Queue()
+                    processo = contexto.Process(target=_medir, args=(modo, caminho, fila))
+                    processo.start()
+                    resultado = fila.get()
+                    processo.join()
+                    self.stdout.write(
+                        f"  {modo:<10} pico +{resultado['kb'] / 1024:.1f} MB | {resultado['ms']:.1f} ms | {resultado['itens']} itens"
+                    )
+            finally:
+                os.remove(caminho)
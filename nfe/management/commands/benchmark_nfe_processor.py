@@ -0,0 +1,135 @@
+"""
+Mede quantidade de INSERTs e latência do NFeProcessor para uma nota grande.
+
+Compara a gravação de itens linha a linha (comportamento antigo: um
+Produto.objects.create + um Imposto.objects.create por <det>) com a gravação
+em lote (bulk_create) usada hoje pelo NFeProcessor. Tudo roda dentro de uma
+transação que é desfeita no final, então o banco não é alterado. Se a empresa
+tem banco próprio, as linhas *Flat gravadas nele entram na mesma conta e também
+são desfeitas (uma transação e uma captura de queries por banco).
+
+Uso:
+
+    python manage.py benchmark_nfe_processor --empresa_id 1
+    python manage.py benchmark_nfe_processor --empresa_id 1 --itens 500 --repeticoes 5
+"""
+
+import os
+import time
+import uuid
+import statistics
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.test.utils import CaptureQueriesContext
+
+from db_allnube_empresa.models import NotaFiscalFlat
+from db_allnube_empresa.utils.database_utils import DatabaseManager
+from empresa.models import Empresa
+from nfe.models import Produto, Imposto, NotaFiscal
+from nfe.processor.nfe_parser import como_dict
+from nfe.processor.nfe_processor import NFeProcessor
+
+from ._nfe_sintetica import gerar_xml_nfe
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark do NFeProcessor: INSERTs por nota e latência (linha a linha x bulk_create).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--empresa_id', type=int, required=True, help='Empresa usada como dona das notas sintéticas')
+        parser.add_argument('--itens', type=int, default=500, help='Quantidade de itens (<det>) por nota')
+        parser.add_argument('--repeticoes', type=int, default=3, help='Quantidade de execuções de cada modo')
+
+    def handle(self, *args, **options):
+        try:
+            empresa = Empresa.objects.get(pk=options['empresa_id'])
+        except Empresa.DoesNotExist:
+            raise CommandError(f"Empresa {options['empresa_id']} não encontrada")
+
+        itens = options['itens']
+        repeticoes = options['repeticoes']
+
+        # O NFeProcessor também grava as tabelas flat no banco da empresa (mesmo alias)
+        alias_empresa = None
+        if DatabaseManager.empresa_tem_banco_proprio(empresa.id):
+            alias_empresa = DatabaseManager.configurar_conexao_empresa(empresa.id)
+            if not alias_empresa:
+                raise CommandError(f"Não foi possível conectar ao banco próprio da empresa {empresa.id}")
+
+        self.stdout.write(f"Nota sintética com {itens} itens, {repeticoes} repetição(ões) por modo\n")
+        if alias_empresa:
+            self.stdout.write(f"Banco próprio da empresa: {alias_empresa} (gravações desfeitas e contadas)\n")
+
+        linha_a_linha = [self._medir(empresa, itens, False, alias_empresa) for _ in range(repeticoes)]
+        em_lote = [self._medir(empresa, itens, True, alias_empresa) for _ in range(repeticoes)]
+
+        self._relatorio('Linha a linha (antes)', linha_a_linha)
+        self._relatorio('bulk_create (depois)', em_lote)
+
+    def _medir(self, empresa, itens, bulk, alias_empresa=None):
+        chave, conteudo = gerar_xml_nfe(itens)
+        relativo = os.path.join('xml', f'benchmark-{uuid.uuid4().hex}.xml')
+        absoluto = os.path.join(settings.MEDIA_ROOT, relativo)
+        os.makedirs(os.path.dirname(absoluto), exist_ok=True)
+
+        with open(absoluto, 'wb') as f:
+            f.write(conteudo)
+
+        try:
+            processor = NFeProcessor(empresa, 0, relativo)
+            if not bulk:
+                processor._criar_produto_impostos_default = (
+                    lambda nota: self._produtos_linha_a_linha(processor, nota)
+                )
+
+            aliases = ['default'] + ([alias_empresa] if alias_empresa else [])
+            try:
+                with ExitStack() as pilha:
+                    for alias in aliases:
+                        pilha.enter_context(transaction.atomic(using=alias))
+                    capturas = [pilha.enter_context(CaptureQueriesContext(connections[alias])) for alias in aliases]
+
+                    inicio = time.perf_counter()
+                    processor.processar()
+                    duracao = time.perf_counter() - inicio
+                    raise _Rollback()
+            except _Rollback:
+                pass
+
+            queries = [q['sql'] for ctx in capturas for q in ctx.captured_queries]
+            inserts = sum(1 for sql in queries if sql.lstrip().upper().startswith('INSERT'))
+            return {
+                'queries': len(queries),
+                'inserts': inserts,
+                'queries_empresa': len(capturas[1].captured_queries) if alias_empresa else None,
+                'ms': duracao * 1000,
+            }
+        finally:
+            os.remove(absoluto)
+            NotaFiscal.objects.filter(chave=chave).delete()
+            if alias_empresa:
+                NotaFiscalFlat.objects.using(alias_empresa).filter(chave=chave).delete()
+
+    @staticmethod
+    def _produtos_linha_a_linha(processor, nota):
+        """Reproduz o comportamento anterior ao bulk_create (referência do benchmark)"""
+        for item in processor.dados.itens:
+            produto = Produto.objects.create(nota_fiscal=nota, **como_dict(item.produto))
+            if item.imposto is not None:
+                Imposto.objects.create(produto=produto, **como_dict(item.imposto))
+
+    def _relatorio(self, titulo, medicoes):
+        tempos = [m['ms'] for m in medicoes]
+        self.stdout.write(self.style.SUCCESS(titulo))
+        self.stdout.write(f"  queries por nota: {medicoes[-1]['queries']}")
+        if medicoes[-1]['queries_empresa'] is not None:
+            self.stdout.write(f"    no banco da empresa: {medicoes[-1]['queries_empresa']}")
+        self.stdout.write(f"  INSERTs por nota: {medicoes[-1]['inserts']}")
+        self.stdout.write(f"  latência (ms):    média {statistics.mean(tempos):.1f} | mín {min(tempos):.1f} | máx {max(tempos):.1f}\n")
@@ -0,0 +1,102 @@
+"""
+Move os XMLs soltos (media/xml/*.xml) para o acervo compactado.
+
+Cada arquivo referenciado por NotaFiscal, ResumoNFe ou EventoNFe é gravado no
+acervo da empresa dona do registro (gzip, endereçado por conteúdo) e o caminho
+é atualizado no registro e, quando a empresa tem banco próprio, na
+NotaFiscalFlat correspondente. Os arquivos antigos só são apagados com --remover.
+
+# Ver quantos registros seriam migrados
+python manage.py migrar_xml_acervo --simular
+
+# Migrar uma empresa e apagar os arquivos soltos
+python manage.py migrar_xml_acervo --empresa_id 1 --remover
+"""
+
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.utils import arquivo_xml
+from db_allnube_empresa.models import NotaFiscalFlat
+from db_allnube_empresa.utils.database_utils import DatabaseManager
+from nfe.models import NotaFiscal
+from nfe_evento.models import EventoNFe
+from nfe_resumo.models import ResumoNFe
+
+MODELOS_XML = ((NotaFiscal, 'fileXml'), (ResumoNFe, 'file_xml'), (EventoNFe, 'file_xml'))
+
+
+class Command(BaseCommand):
+    help = 'Migra os XMLs soltos em media/xml para o acervo compactado (gzip, por empresa)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--empresa_id', type=int, help='Migra apenas os XMLs desta empresa')
+        parser.add_argument('--remover', action='store_true', help='Apaga o arquivo solto após migrar')
+        parser.add_argument('--simular', action='store_true', help='Só conta os registros a migrar')
+
+    def handle(self, *args, **options):
+        totais = {'migrados': 0, 'ausentes': 0, 'bytes_antes': 0, 'bytes_depois': 0}
+        migrados = {}  # (empresa_id, caminho antigo) -> caminho no acervo
+
+        for model, campo in MODELOS_XML:
+            registros = model.objects.exclude(**{f'{campo}__startswith': settings.XML_ARQUIVO_DIR})
+            registros = registros.exclude(**{f'{campo}__isnull': True}).exclude(**{campo: ''})
+            if options['empresa_id']:
+                registros = registros.filter(empresa_id=options['empresa_id'])
+
+            if options['simular']:
+                self.stdout.write(f"{model.__name__}: {registros.count()} registro(s) a migrar")
+                continue
+
+            for pk, empresa_id, caminho in registros.values_list('pk', 'empresa_id', campo).iterator(chunk_size=1000):
+                novo = migrados.get((empresa_id, caminho))
+                if novo is None:
+                    absoluto = arquivo_xml.caminho_absoluto(caminho)
+                    if not os.path.exists(absoluto):
+                        totais['ausentes'] += 1
+                        continue
+
+                    novo = arquivo_xml.salvar_xml(empresa_id, arquivo_xml.ler(caminho))
+                    migrados[(empresa_id, caminho)] = novo
+                    totais['bytes_antes'] += os.path.getsize(absoluto)
+                    totais['bytes_depois'] += os.path.getsize(arquivo_xml.caminho_absoluto(novo))
+
+                model.objects.filter(pk=pk).update(**{campo: novo})
+                if model is NotaFiscal:
+                    self._atualizar_flat(empresa_id, caminho, novo)
+                totais['migrados'] += 1
+
+        if options['simular']:
+            return
+
+        if options['remover']:
+            for caminho in {caminho for _, caminho in migrados}:
+                # NSUs repetidos: o mesmo arquivo solto pode ainda ser usado por outra empresa
+                if any(model.objects.filter(**{campo: caminho}).exists() for model, campo in MODELOS_XML):
+                    continue
+                absoluto = arquivo_xml.caminho_absoluto(caminho)
+                if os.path.exists(absoluto):
+                    os.remove(absoluto)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{totais['migrados']} registro(s) migrado(s), {len(migrados)} arquivo(s), "
+            f"{totais['ausentes']} arquivo(s) ausente(s)"
+        ))
+        if totais['bytes_antes']:
+            self.stdout.write(
+                f"Tamanho: {totais['bytes_antes'] / 1024 / 1024:.1f} MB -> "
+                f"{totais['bytes_depois'] / 1024 / 1024:.1f} MB"
+            )
+
+    @staticmethod
+    def _atualizar_flat(empresa_id, caminho, novo):
+        """Mesmo caminho na NotaFiscalFlat do banco próprio da empresa (se houver)"""
+        if not DatabaseManager.empresa_tem_banco_proprio(empresa_id):
+            return
+        try:
+            if DatabaseManager.usar_banco_empresa(empresa_id):
+                NotaFiscalFlat.objects.filter(empresa_id=empresa_id, fileXml=caminho).update(fileXml=novo)
+        finally:
+            DatabaseManager.limpar_conexao_empresa()
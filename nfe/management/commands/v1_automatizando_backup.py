@@ -10,7 +10,7 @@ from pynfe.processamento.comunicacao import ComunicacaoSefaz
 from pynfe.utils.flags import NAMESPACE_NFE
 from pynfe.utils.descompactar import DescompactaGzip
 
-from empresa.models import Empresa, HistoricoNSU
+from empresa.models import Empresa, CursorNSU
 
 
 class Command(BaseCommand):
@@ -52,8 +52,7 @@ class Command(BaseCommand):
             try:
                 # Pega último NSU do banco ou usa 0 se não houver
                 try:
-                    ultimo_nsu = empresa.historico_empresa.order_by('-created_at').first()
-                    nsu_para_consulta = int(ultimo_nsu.nsu) if ultimo_nsu else 0
+                    nsu_para_consulta = CursorNSU.obter_nsu(empresa.id)
                 except Exception as e:
                     self.stderr.write(f'[WARN] Erro ao buscar NSU anterior: {e}')
                     nsu_para_consulta = 0
@@ -132,7 +131,7 @@ class Command(BaseCommand):
                     max_nsu_nodes = resposta.xpath('//ns:retDistDFeInt/ns:maxNSU', namespaces=ns)
                     if max_nsu_nodes:
                         novo_nsu = int(max_nsu_nodes[0].text)
-                        HistoricoNSU.objects.create(empresa=empresa, nsu=novo_nsu)
+                        CursorNSU.avancar(empresa.id, novo_nsu)
                         self.stdout.write(f'[OK] NSU atualizado para {empresa.razao_social}: {novo_nsu}')
 
             except Exception as e:
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.1 on 2026-10-16 21:30
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY não roda dentro de transação
+    atomic = False
+
+    dependencies = [
+        ('nfe', '0002_increase_address_field_lengths'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name='notafiscal',
+            index=models.Index(
+                condition=models.Q(('deleted_at__isnull', True)),
+                fields=['empresa', '-dhEmi', '-id'],
+                name='nf_empresa_dhemi_id_ativa_idx',
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name='notafiscal',
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper('chave'), name='gin_trgm_ops'
+                ),
+                name='nf_chave_trgm_idx',
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name='emitente',
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper('CNPJ'), name='gin_trgm_ops'
+                ),
+                name='emitente_cnpj_trgm_idx',
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name='emitente',
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper('xNome'), name='gin_trgm_ops'
+                ),
+                name='emitente_xnome_trgm_idx',
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name='produto',
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper('xProd'), name='gin_trgm_ops'
+                ),
+                name='produto_xprod_trgm_idx',
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name='produto',
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper('cProd'), name='gin_trgm_ops'
+                ),
+                name='produto_cprod_trgm_idx',
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name='produto',
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper('cEAN'), name='gin_trgm_ops'
+                ),
+                name='produto_cean_trgm_idx',
+            ),
+        ),
+    ]
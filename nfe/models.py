@@ -1,4 +1,7 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models import Q
+from django.db.models.functions import Upper
 from empresa.models import Empresa
 
 
@@ -15,6 +18,18 @@ class NotaFiscal(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     deleted_at = models.DateTimeField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Listagens: notas ativas da empresa ordenadas por -dhEmi, -id (chave do cursor)
+            models.Index(
+                fields=['empresa', '-dhEmi', '-id'],
+                condition=Q(deleted_at__isnull=True),
+                name='nf_empresa_dhemi_id_ativa_idx',
+            ),
+            # icontains vira UPPER(col) LIKE '%...%': trigram sobre a mesma expressão
+            GinIndex(OpClass(Upper('chave'), name='gin_trgm_ops'), name='nf_chave_trgm_idx'),
+        ]
+
     def __str__(self):
         return f"NF-e {self.chave}"
 
@@ -62,6 +77,12 @@ class Emitente(models.Model):
     xPais = models.CharField(max_length=60, null=True, blank=True)
     fone = models.CharField(max_length=20, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            GinIndex(OpClass(Upper('CNPJ'), name='gin_trgm_ops'), name='emitente_cnpj_trgm_idx'),
+            GinIndex(OpClass(Upper('xNome'), name='gin_trgm_ops'), name='emitente_xnome_trgm_idx'),
+        ]
+
     def __str__(self):
         return f"{self.xNome} - {self.xFant}"
 
@@ -105,6 +126,13 @@ class Produto(models.Model):
     vUnTrib = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True)
     indTot = models.IntegerField()
 
+    class Meta:
+        indexes = [
+            GinIndex(OpClass(Upper('xProd'), name='gin_trgm_ops'), name='produto_xprod_trgm_idx'),
+            GinIndex(OpClass(Upper('cProd'), name='gin_trgm_ops'), name='produto_cprod_trgm_idx'),
+            GinIndex(OpClass(Upper('cEAN'), name='gin_trgm_ops'), name='produto_cean_trgm_idx'),
+        ]
+
     def __str__(self):
         return f"{self.nItem} - {self.xProd}"
 
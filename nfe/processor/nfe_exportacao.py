@@ -0,0 +1,106 @@
+"""
+Exportação em ZIP dos XMLs e DANFEs de um conjunto de notas.
+
+O ZIP é escrito membro a membro direto no disco: cada XML é descompactado do
+acervo em blocos e cada PDF é copiado em blocos, então nem o arquivo final nem
+um documento inteiro ficam em memória. Estrutura do ZIP:
+
+    xml/<chave>.xml
+    danfe/<chave>.pdf
+
+Os DANFEs que ainda não existem são gerados antes por renderizar_danfes, em
+blocos distribuídos entre workers (tasks do Celery ou, no benchmark, processos).
+"""
+
+import os
+import time
+import zipfile
+
+from django.conf import settings
+
+from app.utils import arquivo_xml, danfe
+
+
+def _blocos_arquivo(caminho, tamanho_bloco=64 * 1024):
+    with open(arquivo_xml.caminho_absoluto(caminho), 'rb') as arquivo:
+        while True:
+            bloco = arquivo.read(tamanho_bloco)
+            if not bloco:
+                break
+            yield bloco
+
+
+def _gravar_membro(zip_ref, nome, blocos, comprimir):
+    if comprimir:
+        # Nome em str: o membro usa o deflate/nível configurado no ZipFile
+        info = nome
+    else:
+        # O PDF já sai comprimido do gerador: recomprimir só gasta CPU
+        info = zipfile.ZipInfo(nome, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_STORED
+    with zip_ref.open(info, 'w') as membro:
+        for bloco in blocos:
+            membro.write(bloco)
+
+
+def escrever_zip(destino, documentos, progresso=None):
+    """
+    Escreve o ZIP em destino (caminho absoluto) e retorna os contadores.
+
+    documentos: iterável de (chave, caminho do XML, caminho do PDF ou None),
+    caminhos relativos ao MEDIA_ROOT. Documentos ausentes no disco entram em
+    'erros' e não interrompem a exportação.
+
+    progresso: callable(concluidos, resultado) chamado a cada nota escrita.
+    """
+    resultado = {'xmls': 0, 'danfes': 0, 'erros': []}
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+
+    # Escreve em .tmp e renomeia: o download nunca encontra um ZIP pela metade
+    temporario = f'{destino}.tmp'
+    try:
+        with zipfile.ZipFile(
+                temporario, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=settings.NFE_EXPORTACAO_NIVEL_ZIP
+        ) as zip_ref:
+            for concluidos, (chave, caminho_xml, caminho_pdf) in enumerate(documentos, start=1):
+                if caminho_xml and os.path.exists(arquivo_xml.caminho_absoluto(caminho_xml)):
+                    _gravar_membro(zip_ref, f'xml/{chave}.xml', arquivo_xml.iterar(caminho_xml), comprimir=True)
+                    resultado['xmls'] += 1
+                else:
+                    resultado['erros'].append({'chave': chave, 'erro': 'XML não encontrado'})
+
+                if caminho_pdf:
+                    if danfe.existe(caminho_pdf):
+                        _gravar_membro(zip_ref, f'danfe/{chave}.pdf', _blocos_arquivo(caminho_pdf), comprimir=False)
+                        resultado['danfes'] += 1
+                    else:
+                        resultado['erros'].append({'chave': chave, 'erro': 'DANFE não encontrado'})
+
+                if progresso:
+                    progresso(concluidos, resultado)
+
+        os.replace(temporario, destino)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+    return resultado
+
+
+def renderizar_danfes(notas):
+    """
+    Gera os DANFEs que faltam de um bloco de notas.
+
+    notas: lista de (empresa_id, chave, caminho do XML). Retorna uma lista de
+    (chave, caminho do PDF, erro); falhas de uma nota não interrompem o bloco.
+    """
+    gerados = []
+    for empresa_id, chave, caminho_xml in notas:
+        try:
+            relativo = danfe.caminho_pdf(empresa_id, chave, caminho_xml)
+            danfe.renderizar(caminho_xml, relativo)
+            gerados.append((chave, relativo, None))
+        except Exception as e:
+            gerados.append((chave, None, str(e)))
+    return gerados
@@ -2,20 +2,88 @@ import os
 import re
 import zipfile
 import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
+import django
 from django.conf import settings
-from django.db import IntegrityError
+from django.db import IntegrityError, connections, transaction
 
+from app.utils import arquivo_xml
 from nfe.processor.nfe_processor import NFeProcessor
+from nfe.processor.nfe_parser import identificar_tipo_documento, extrair_dados_nfe
 from nfe_evento.processor.evento_processor import EventoNFeProcessor
 from nfe_resumo.processor.resumo_processor import ResumoNFeProcessor
 
 from lxml import etree
 
+TIPOS_SUPORTADOS = ('nfeProc', 'procEventoNFe', 'resNFe', 'resEvento')
+
+# Pools de classificação do processo, por quantidade de processos
+_parsers = {}
+_parsers_lock = threading.Lock()
+
+
+def _obter_parsers(processos):
+    """
+    Pool de processos compartilhado por todos os lotes do processo: no worker
+    Celery com --pool=threads, lotes concorrentes dividem os mesmos filhos em vez
+    de cada um abrir os seus.
+
+    Os filhos saem de um forkserver (ou spawn), nunca de um fork do processo com
+    threads: um fork herdaria travados os locks de banco, Redis e logging que
+    outra thread estivesse segurando. Por isso cada filho configura o Django
+    (django.setup) antes de receber o primeiro bloco.
+    """
+    with _parsers_lock:
+        parsers = _parsers.get(processos)
+        if parsers is None:
+            metodo = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            parsers = _parsers[processos] = ProcessPoolExecutor(
+                max_workers=processos, mp_context=multiprocessing.get_context(metodo), initializer=django.setup
+            )
+        return parsers
+
+
+def _descartar_parsers(processos):
+    """Pool quebrado (filho morto): o próximo lote cria outro"""
+    with _parsers_lock:
+        parsers = _parsers.pop(processos, None)
+    if parsers:
+        parsers.shutdown(wait=False, cancel_futures=True)
+
+
+def _classificar_xml(conteudo):
+    """
+    Executado no pool de processos: identifica o tipo do XML e, quando é uma
+    NFe, já devolve os dados extraídos (NFeDados) para a thread que grava.
+
+    Retorna (tipo, dados, erro).
+    """
+    try:
+        root = etree.fromstring(conteudo)
+    except etree.XMLSyntaxError as e:
+        return None, None, f'Erro ao analisar XML: {str(e)}'
+
+    tipo = root.tag.split('}')[-1]
+    if tipo not in TIPOS_SUPORTADOS:
+        return tipo, None, f'Tipo de XML não suportado: {tipo}'
+
+    if tipo == 'nfeProc':
+        try:
+            return tipo, extrair_dados_nfe(root), None
+        except ValueError as e:
+            return tipo, None, str(e)
+
+    return tipo, None, None
+
 
 class NFeLoteProcessor:
     def __init__(self, empresa, nsu, arquivo_zip):
         self.empresa = empresa
+        # NSU atual da empresa: XMLs de lote não vêm da distribuição, então o cursor não avança
         self.nsu = nsu
         self.arquivo_zip = arquivo_zip
 
@@ -57,15 +125,26 @@ class NFeLoteProcessor:
             'erro': mensagem_erro
         })
 
-    def processar_zip(self):
-        """Processa o arquivo ZIP e extrai os XMLs"""
-        resultados = {
+    @staticmethod
+    def _resultados_vazios():
+        return {
             'nfe_processadas': 0,
             'eventos_processados': 0,
             'resumos_processados': 0,
             'erros': []
         }
 
+    @staticmethod
+    def _somar_resultados(total, parcial):
+        total['nfe_processadas'] += parcial['nfe_processadas']
+        total['eventos_processados'] += parcial['eventos_processados']
+        total['resumos_processados'] += parcial['resumos_processados']
+        total['erros'].extend(parcial['erros'])
+
+    def processar_zip(self):
+        """Processa o arquivo ZIP e extrai os XMLs"""
+        resultados = self._resultados_vazios()
+
         # Criar diretório temporário
         with tempfile.TemporaryDirectory() as temp_dir:
             # Salvar o arquivo ZIP temporariamente
@@ -99,20 +178,20 @@ class NFeLoteProcessor:
 
     def _processar_xml(self, empresa, nsu, xml_path, resultados):
         """Processa um arquivo XML individual e roteia para o endpoint correto"""
-        # Ler e analisar o XML para determinar o tipo
-        with open(xml_path, 'r', encoding='utf-8') as f:
-            xml_content = f.read()
-
         # Determinar o tipo do XML pela raiz - IGNORAR O NOME DO ARQUIVO
-        root_element = self._obter_elemento_raiz(xml_content)
+        # (lê só o primeiro evento do iterparse, sem carregar o arquivo inteiro)
+        root_element = self._obter_elemento_raiz(xml_path)
 
         # Salvar o arquivo na pasta media
         nome_arquivo = os.path.basename(xml_path)
-        caminho_relativo = self._salvar_arquivo_media(xml_content, nome_arquivo)
+        caminho_relativo = self._salvar_arquivo_media(xml_path, nome_arquivo)
 
-        # Roteamento baseado no CONTEÚDO do XML, não no nome do arquivo
+        self._rotear(empresa, nsu, root_element, caminho_relativo, resultados)
+
+    def _rotear(self, empresa, nsu, root_element, caminho_relativo, resultados, dados=None):
+        """Roteamento baseado no CONTEÚDO do XML, não no nome do arquivo"""
         if root_element == 'nfeProc':
-            self._enviar_para_nfe(empresa, nsu, caminho_relativo, resultados)
+            self._enviar_para_nfe(empresa, nsu, caminho_relativo, resultados, dados=dados)
         elif root_element == 'procEventoNFe':
             self._enviar_para_evento(empresa, nsu, caminho_relativo, resultados)
         elif root_element in ['resNFe', 'resEvento']:  # ACEITA AMBOS
@@ -120,29 +199,198 @@ class NFeLoteProcessor:
         else:
             raise ValueError(f'Tipo de XML não suportado: {root_element}')
 
-    def _obter_elemento_raiz(self, xml_content):
+    def _obter_elemento_raiz(self, xml_path):
         """Obtém o elemento raiz do XML"""
+        return identificar_tipo_documento(xml_path)
+
+    def _salvar_arquivo_media(self, xml_path, nome_arquivo):
+        """Grava o arquivo XML no acervo compactado e retorna o caminho relativo"""
+        with open(xml_path, 'rb') as arquivo:
+            return self._salvar_conteudo_media(arquivo.read(), nome_arquivo)
+
+    def _salvar_conteudo_media(self, conteudo, nome_arquivo):
+        """
+        Grava os bytes de um membro do ZIP no acervo compactado e retorna o caminho
+        relativo. O nome original não é usado: lotes diferentes com o mesmo nome de
+        arquivo não se sobrescrevem.
+        """
+        return arquivo_xml.salvar_xml(self.empresa.id, conteudo)
+
+    # ========== MODO PARALELO ==========
+
+    def processar_zip_paralelo(self, processos=None, escritores=None, tamanho_bloco=None, progresso=None):
+        """
+        Processa o ZIP sem extraí-lo para o disco.
+
+        Os membros são lidos direto do ZipFile em blocos; cada bloco é
+        classificado (e as NFe já extraídas) num pool de processos e depois
+        gravado por um conjunto limitado de threads, cada uma com a sua
+        conexão de banco (uma transação por bloco, ver _gravar_bloco). Enquanto
+        um bloco é gravado o próximo já está sendo processado. O retorno é o
+        mesmo dicionário de processar_zip().
+
+        O pool de processos é o do módulo (_obter_parsers), compartilhado entre
+        os lotes que rodam ao mesmo tempo no processo.
+
+        progresso: callable(concluidos, total, resultados) chamado a cada
+        bloco gravado (usado pela task Celery para reportar o andamento).
+        """
+        processos = processos or settings.NFE_LOTE_PROCESSOS
+        escritores = escritores or settings.NFE_LOTE_ESCRITORES
+        tamanho_bloco = tamanho_bloco or settings.NFE_LOTE_TAMANHO_BLOCO
+
+        resultados = self._resultados_vazios()
+
+        # Processos daemon (ex.: worker prefork do Celery) não podem criar filhos:
+        # nesse caso a classificação roda no próprio processo
+        usar_processos = processos > 1 and not multiprocessing.current_process().daemon
+        parsers = _obter_parsers(processos) if usar_processos else None
+        mapear = parsers.map if parsers else map
+
         try:
-            root = etree.fromstring(xml_content.encode('utf-8'))
-            return root.tag.split('}')[-1]  # Remove namespace
-        except Exception as e:
-            raise ValueError(f'Erro ao analisar XML: {str(e)}')
+            with zipfile.ZipFile(self.arquivo_zip, 'r') as zip_ref, \
+                    ThreadPoolExecutor(max_workers=escritores) as gravadores:
+                membros = self._membros_xml(zip_ref)
+                pendentes = []
+
+                def concluir(pendente):
+                    self._somar_resultados(resultados, pendente.result())
+                    if progresso:
+                        progresso(self._concluidos(resultados), len(membros), resultados)
+
+                for bloco in self._blocos_zip(zip_ref, membros, tamanho_bloco):
+                    documentos = []
+                    classificados = mapear(_classificar_xml, [conteudo for _, conteudo in bloco])
+
+                    for (nome, conteudo), (tipo, dados, erro) in zip(bloco, classificados):
+                        if erro:
+                            resultados['erros'].append({'arquivo': nome, 'erro': erro})
+                            continue
+                        documentos.append((nome, conteudo, tipo, dados))
+
+                    if documentos:
+                        pendentes.append(gravadores.submit(self._gravar_bloco, documentos))
+
+                    # Limita a quantidade de blocos lidos aguardando gravação
+                    while len(pendentes) >= escritores * 2:
+                        concluir(pendentes.pop(0))
+
+                for pendente in pendentes:
+                    concluir(pendente)
 
-    def _salvar_arquivo_media(self, xml_content, nome_arquivo):
-        """Salva o arquivo XML na pasta media e retorna o caminho relativo"""
-        media_dir = os.path.join(settings.MEDIA_ROOT, 'xml')
-        os.makedirs(media_dir, exist_ok=True)
+                if progresso:
+                    progresso(self._concluidos(resultados), len(membros), resultados)
+        except BrokenProcessPool:
+            _descartar_parsers(processos)
+            raise
 
-        caminho_completo = os.path.join(media_dir, nome_arquivo)
+        return resultados
+
+    @staticmethod
+    def _concluidos(resultados):
+        processados = resultados['nfe_processadas'] + resultados['eventos_processados'] + resultados['resumos_processados']
+        return processados + len(resultados['erros'])
+
+    @staticmethod
+    def _membros_xml(zip_ref):
+        """Lista os XMLs do ZIP (sem ler o conteúdo)"""
+        membros = []
+        for info in zip_ref.infolist():
+            if info.is_dir():
+                continue
+
+            nome = os.path.basename(info.filename)
+            # Ignora arquivos de metadata do macOS (AppleDouble)
+            if nome.startswith('._') or not nome.endswith('.xml'):
+                continue
+
+            membros.append(info)
+        return membros
+
+    @staticmethod
+    def _blocos_zip(zip_ref, membros, tamanho_bloco):
+        """Gera blocos de (nome, bytes) dos XMLs do ZIP, lidos sob demanda"""
+        bloco = []
+        for info in membros:
+            with zip_ref.open(info) as membro:
+                bloco.append((os.path.basename(info.filename), membro.read()))
+
+            if len(bloco) >= tamanho_bloco:
+                yield bloco
+                bloco = []
+
+        if bloco:
+            yield bloco
+
+    def _gravar_bloco(self, documentos):
+        """
+        Executado numa thread escritora: grava um bloco de documentos já
+        classificados numa única transação (um commit por bloco).
+
+        Cada NFe fica num savepoint (o atomic de NFeProcessor.processar), então
+        uma nota com erro não desfaz as outras; resumos e eventos do bloco vão
+        num INSERT ... ON CONFLICT por tipo (gravar_lote).
+        """
+        resultados = self._resultados_vazios()
+        resumos = []
+        eventos = []
+        try:
+            with transaction.atomic():
+                for nome, conteudo, tipo, dados in documentos:
+                    try:
+                        caminho_relativo = self._salvar_conteudo_media(conteudo, nome)
+                        if tipo == 'nfeProc':
+                            self._enviar_para_nfe(self.empresa, self.nsu, caminho_relativo, resultados, dados=dados)
+                        elif tipo == 'procEventoNFe':
+                            eventos.append((caminho_relativo, EventoNFeProcessor(
+                                self.empresa, self.nsu, caminho_relativo, registrar_nsu=False
+                            )))
+                        elif tipo in ('resNFe', 'resEvento'):
+                            resumos.append((caminho_relativo, ResumoNFeProcessor(
+                                self.empresa, self.nsu, caminho_relativo, registrar_nsu=False
+                            )))
+                        else:
+                            raise ValueError(f'Tipo de XML não suportado: {tipo}')
+                    except Exception as e:
+                        resultados['erros'].append({
+                            'arquivo': nome,
+                            'erro': str(e)
+                        })
+
+                self._gravar_lote(ResumoNFeProcessor, 'Resumo', 'resumos_processados', resumos, resultados)
+                self._gravar_lote(EventoNFeProcessor, 'Evento', 'eventos_processados', eventos, resultados)
+        finally:
+            # As conexões do Django são por thread: fecha as desta thread ao fim do bloco
+            connections.close_all()
 
-        with open(caminho_completo, 'w', encoding='utf-8') as f:
-            f.write(xml_content)
+        return resultados
 
-        return f'xml/{nome_arquivo}'
+    def _gravar_lote(self, classe_processor, tipo_documento, contador, processadores, resultados):
+        """
+        Grava os documentos de um tipo de uma vez; se o lote falhar, regrava um a
+        um para que só o documento com problema fique de fora.
+        """
+        if not processadores:
+            return
 
-    def _enviar_para_nfe(self, empresa, nsu, caminho_relativo, resultados):
         try:
-            processor = NFeProcessor(empresa, nsu, caminho_relativo)
+            with transaction.atomic():
+                classe_processor.gravar_lote([processor for _, processor in processadores])
+            resultados[contador] += len(processadores)
+            return
+        except Exception:
+            pass
+
+        for caminho_relativo, processor in processadores:
+            try:
+                processor.processar()
+                resultados[contador] += 1
+            except Exception as e:
+                self._tratar_erro_seguro(e, tipo_documento, caminho_relativo, resultados)
+
+    def _enviar_para_nfe(self, empresa, nsu, caminho_relativo, resultados, dados=None):
+        try:
+            processor = NFeProcessor(empresa, nsu, caminho_relativo, streaming=True, dados=dados, registrar_nsu=False)
             nota = processor.processar()
 
             if nota:
@@ -158,7 +406,7 @@ class NFeLoteProcessor:
 
     def _enviar_para_evento(self, empresa, nsu, caminho_relativo, resultados):
         try:
-            processor = EventoNFeProcessor(empresa, nsu, caminho_relativo)
+            processor = EventoNFeProcessor(empresa, nsu, caminho_relativo, registrar_nsu=False)
             evento = processor.processar()
 
             if evento:
@@ -174,7 +422,7 @@ class NFeLoteProcessor:
 
     def _enviar_para_resumo(self, empresa, nsu, caminho_relativo, resultados):
         try:
-            processor = ResumoNFeProcessor(empresa, nsu, caminho_relativo)
+            processor = ResumoNFeProcessor(empresa, nsu, caminho_relativo, registrar_nsu=False)
             resumo = processor.processar()
 
             if resumo:
@@ -0,0 +1,543 @@
+"""
+Extração única (parse-once) do infNFe para uma estrutura tipada.
+
+O NFeProcessor grava a mesma nota em até dois bancos (DEFAULT e banco próprio
+da empresa). Em vez de repetir as buscas XPath para cada destino, o XML é
+percorrido uma única vez aqui e os writers consomem apenas estas estruturas.
+
+Os nomes dos campos são os mesmos dos models (nfe.models / *Flat), então a
+gravação é só `Model(**como_dict(dados.ide))`.
+
+Funciona com elementos do xml.etree.ElementTree e do lxml. Para arquivos
+grandes há também a leitura em streaming (extrair_dados_nfe_arquivo), que não
+monta a árvore inteira em memória.
+"""
+
+from dataclasses import dataclass, field, fields
+from decimal import Decimal, InvalidOperation
+from typing import List, Optional
+
+from lxml import etree
+
+from app.utils import arquivo_xml
+
+NS = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
+
+
+# ========== ESTRUTURAS ==========
+
+@dataclass(slots=True)
+class IdeDados:
+    cUF: Optional[str]
+    natOp: Optional[str]
+    mod: Optional[str]
+    serie: Optional[str]
+    nNF: Optional[str]
+    tpNF: int
+    idDest: int
+    cMunFG: Optional[str]
+    tpImp: int
+    tpEmis: int
+    cDV: Optional[str]
+    finNFe: int
+    indFinal: int
+    indPres: int
+    indIntermed: int
+    procEmi: int
+    verProc: Optional[str]
+
+
+@dataclass(slots=True)
+class EmitenteDados:
+    CNPJ: Optional[str]
+    xNome: Optional[str]
+    xFant: Optional[str]
+    IE: Optional[str]
+    CRT: int
+    xLgr: Optional[str]
+    nro: Optional[str]
+    xBairro: Optional[str]
+    cMun: Optional[str]
+    xMun: Optional[str]
+    UF: Optional[str]
+    CEP: Optional[str]
+    cPais: Optional[str]
+    xPais: Optional[str]
+    fone: Optional[str]
+
+
+@dataclass(slots=True)
+class DestinatarioDados:
+    CNPJ: Optional[str]
+    xNome: Optional[str]
+    IE: Optional[str]
+    indIEDest: int
+    xLgr: Optional[str]
+    nro: Optional[str]
+    xCpl: Optional[str]
+    xBairro: Optional[str]
+    cMun: Optional[str]
+    xMun: Optional[str]
+    UF: Optional[str]
+    CEP: Optional[str]
+    cPais: Optional[str]
+    xPais: Optional[str]
+
+
+@dataclass(slots=True)
+class ImpostoDados:
+    vTotTrib: Decimal
+    orig: Optional[str]
+    CST: Optional[str]
+
+
+@dataclass(slots=True)
+class ProdutoDados:
+    nItem: int
+    cProd: Optional[str]
+    cEAN: Optional[str]
+    xProd: Optional[str]
+    NCM: Optional[str]
+    CFOP: Optional[str]
+    uCom: Optional[str]
+    qCom: Decimal
+    vUnCom: Decimal
+    vProd: Decimal
+    uTrib: Optional[str]
+    qTrib: Decimal
+    vUnTrib: Decimal
+    indTot: int
+
+
+@dataclass(slots=True)
+class ItemDados:
+    """Um <det>: produto + imposto (o imposto pode não existir)"""
+    produto: ProdutoDados
+    imposto: Optional[ImpostoDados]
+
+
+@dataclass(slots=True)
+class TotalDados:
+    vBC: Decimal
+    vICMS: Decimal
+    vICMSDeson: Decimal
+    vFCP: Decimal
+    vBCST: Decimal
+    vST: Decimal
+    vFCPST: Decimal
+    vFCPSTRet: Decimal
+    vProd: Decimal
+    vFrete: Decimal
+    vSeg: Decimal
+    vDesc: Decimal
+    vII: Decimal
+    vIPI: Decimal
+    vIPIDevol: Decimal
+    vPIS: Decimal
+    vCOFINS: Decimal
+    vOutro: Decimal
+    vNF: Decimal
+    vTotTrib: Decimal
+
+
+@dataclass(slots=True)
+class TransporteDados:
+    modFrete: int
+    qVol: Optional[int]
+
+
+@dataclass(slots=True)
+class PagamentoDados:
+    tPag: Optional[str]
+    vPag: Decimal
+
+
+@dataclass(slots=True)
+class CobrancaDados:
+    nFat: Optional[str] = None
+    vOrig: Optional[Decimal] = None
+    vDesc: Optional[Decimal] = None
+    vLiq: Optional[Decimal] = None
+
+
+@dataclass(slots=True)
+class NFeDados:
+    chave: str
+    versao: str
+    dhEmi: Optional[str] = None
+    dhSaiEnt: Optional[str] = None
+    ide: Optional[IdeDados] = None
+    emitente: Optional[EmitenteDados] = None
+    destinatario: Optional[DestinatarioDados] = None
+    itens: List[ItemDados] = field(default_factory=list)
+    total: Optional[TotalDados] = None
+    transporte: Optional[TransporteDados] = None
+    # A cobrança sempre é gravada (vazia quando não há <cobr>)
+    cobranca: CobrancaDados = field(default_factory=CobrancaDados)
+    pagamentos: List[PagamentoDados] = field(default_factory=list)
+
+
+def como_dict(dados):
+    """Converte uma estrutura (rasa) em kwargs para o model correspondente"""
+    return {f.name: getattr(dados, f.name) for f in fields(dados)}
+
+
+# ========== CONVERSÕES SEGURAS ==========
+
+def safe_decimal(text):
+    try:
+        return Decimal(text)
+    except (TypeError, InvalidOperation):
+        return Decimal('0')
+
+
+def safe_int(text, default=0):
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        return default
+
+
+def safe_findtext(element, path, default=None, ns=NS):
+    """Busca texto seguro em elemento XML"""
+    if element is None:
+        return default
+    found = element.find(path, namespaces=ns)
+    return found.text if found is not None else default
+
+
+# ========== EXTRAÇÃO ==========
+
+def encontrar_inf_nfe(root, ns=NS):
+    """Encontra o elemento infNFe no XML (com ou sem namespace)"""
+    if _nome_local(root.tag) == 'infNFe':
+        return root
+
+    for path in ('.//nfe:infNFe', 'nfe:infNFe', './/infNFe', 'infNFe'):
+        inf_nfe = root.find(path, namespaces=ns)
+        if inf_nfe is not None:
+            return inf_nfe
+
+    raise ValueError("Elemento infNFe não encontrado no XML")
+
+
+def extrair_dados_nfe(root, ns=NS):
+    """Percorre o infNFe uma única vez e devolve um NFeDados"""
+    inf_nfe = encontrar_inf_nfe(root, ns)
+    ide_el = inf_nfe.find('nfe:ide', namespaces=ns)
+    cobr_el = inf_nfe.find('nfe:cobr', namespaces=ns)
+
+    return NFeDados(
+        chave=inf_nfe.attrib.get('Id', '').replace('NFe', ''),
+        versao=inf_nfe.attrib.get('versao', ''),
+        dhEmi=safe_findtext(ide_el, 'nfe:dhEmi', ns=ns),
+        dhSaiEnt=safe_findtext(ide_el, 'nfe:dhSaiEnt', ns=ns),
+        ide=extrair_ide(ide_el, ns),
+        emitente=extrair_emitente(inf_nfe.find('nfe:emit', namespaces=ns), ns),
+        destinatario=extrair_destinatario(inf_nfe.find('nfe:dest', namespaces=ns), ns),
+        itens=[
+            item for item in (extrair_item(det, ns) for det in inf_nfe.findall('nfe:det', namespaces=ns))
+            if item is not None
+        ],
+        total=extrair_total(inf_nfe.find('nfe:total', namespaces=ns), ns),
+        transporte=extrair_transporte(inf_nfe.find('nfe:transp', namespaces=ns), ns),
+        cobranca=extrair_cobranca(cobr_el, ns),
+        pagamentos=extrair_pagamentos(cobr_el, ns),
+    )
+
+
+# ========== STREAMING (lxml.iterparse) ==========
+
+# Filhos diretos do infNFe consumidos pela leitura em streaming
+FILHOS_INF_NFE = ('ide', 'emit', 'dest', 'det', 'total', 'transp', 'cobr')
+
+
+def identificar_tipo_documento(caminho):
+    """Retorna o elemento raiz (sem namespace) lendo apenas o primeiro evento do arquivo"""
+    with arquivo_xml.abrir(caminho) as arquivo:
+        try:
+            for _, elemento in etree.iterparse(arquivo, events=('start',)):
+                return _nome_local(elemento.tag)
+        except etree.XMLSyntaxError as e:
+            raise ValueError(f'Erro ao analisar XML: {str(e)}')
+
+    raise ValueError('Erro ao analisar XML: documento vazio')
+
+
+def extrair_dados_nfe_arquivo(caminho, ns=NS):
+    """
+    Versão streaming de extrair_dados_nfe.
+
+    Lê os bytes direto do disco (descompactando o .xml.gz do acervo em streaming)
+    com lxml.etree.iterparse. Cada filho do infNFe
+    (ide, emit, det...) é convertido assim que termina e em seguida descartado,
+    então a árvore não cresce com a quantidade de itens da nota.
+    """
+    raiz = identificar_tipo_documento(caminho)
+    if raiz not in ('nfeProc', 'NFe'):
+        raise ValueError(f'Tipo de XML não suportado: {raiz}')
+
+    uri = ns['nfe']
+    # Só os elementos de interesse geram eventos; o resto fica dentro do libxml2
+    tags = [f'{{{uri}}}infNFe'] + [f'{{{uri}}}{tag}' for tag in FILHOS_INF_NFE]
+
+    inf_nfe = None
+    dados = {}
+    itens = []
+
+    with arquivo_xml.abrir(caminho) as arquivo:
+        try:
+            for evento, elemento in etree.iterparse(arquivo, events=('start', 'end'), tag=tags):
+                if evento == 'start':
+                    if inf_nfe is None and _nome_local(elemento.tag) == 'infNFe':
+                        # Os atributos (Id, versao) já estão disponíveis no start
+                        inf_nfe = elemento
+                    continue
+
+                pai = elemento.getparent()
+                if inf_nfe is None or pai is not inf_nfe:
+                    continue
+
+                _consumir_filho_inf_nfe(elemento, dados, itens, ns)
+
+                # Libera o elemento consumido e os irmãos anteriores
+                elemento.clear()
+                while elemento.getprevious() is not None:
+                    del pai[0]
+        except etree.XMLSyntaxError as e:
+            raise ValueError(f"Erro ao processar o XML: {str(e)}")
+
+    if inf_nfe is None:
+        raise ValueError("Elemento infNFe não encontrado no XML")
+
+    return NFeDados(
+        chave=inf_nfe.attrib.get('Id', '').replace('NFe', ''),
+        versao=inf_nfe.attrib.get('versao', ''),
+        itens=itens,
+        **dados
+    )
+
+
+def _consumir_filho_inf_nfe(elemento, dados, itens, ns):
+    """Converte um filho direto do infNFe para a estrutura correspondente"""
+    nome = _nome_local(elemento.tag)
+
+    if nome == 'det':
+        item = extrair_item(elemento, ns)
+        if item is not None:
+            itens.append(item)
+    elif nome == 'ide':
+        dados['ide'] = extrair_ide(elemento, ns)
+        dados['dhEmi'] = safe_findtext(elemento, 'nfe:dhEmi', ns=ns)
+        dados['dhSaiEnt'] = safe_findtext(elemento, 'nfe:dhSaiEnt', ns=ns)
+    elif nome == 'emit':
+        dados['emitente'] = extrair_emitente(elemento, ns)
+    elif nome == 'dest':
+        dados['destinatario'] = extrair_destinatario(elemento, ns)
+    elif nome == 'total':
+        dados['total'] = extrair_total(elemento, ns)
+    elif nome == 'transp':
+        dados['transporte'] = extrair_transporte(elemento, ns)
+    elif nome == 'cobr':
+        dados['cobranca'] = extrair_cobranca(elemento, ns)
+        dados['pagamentos'] = extrair_pagamentos(elemento, ns)
+
+
+def extrair_ide(ide_el, ns=NS):
+    if ide_el is None:
+        return None
+
+    texto = _textos_filhos(ide_el).get
+
+    return IdeDados(
+        cUF=texto('cUF'),
+        natOp=texto('natOp'),
+        mod=texto('mod'),
+        serie=texto('serie'),
+        nNF=texto('nNF'),
+        tpNF=safe_int(texto('tpNF')),
+        idDest=safe_int(texto('idDest')),
+        cMunFG=texto('cMunFG'),
+        tpImp=safe_int(texto('tpImp')),
+        tpEmis=safe_int(texto('tpEmis')),
+        cDV=texto('cDV'),
+        finNFe=safe_int(texto('finNFe')),
+        indFinal=safe_int(texto('indFinal')),
+        indPres=safe_int(texto('indPres')),
+        indIntermed=safe_int(texto('indIntermed')),
+        procEmi=safe_int(texto('procEmi')),
+        verProc=texto('verProc'),
+    )
+
+
+def extrair_emitente(emitente_el, ns=NS):
+    if emitente_el is None:
+        return None
+
+    texto = _textos_filhos(emitente_el).get
+    endereco = _textos_filhos(emitente_el.find('nfe:enderEmit', namespaces=ns)).get
+
+    return EmitenteDados(
+        CNPJ=texto('CNPJ'),
+        xNome=texto('xNome'),
+        xFant=texto('xFant'),
+        IE=texto('IE'),
+        CRT=safe_int(texto('CRT')),
+        xLgr=endereco('xLgr'),
+        nro=endereco('nro'),
+        xBairro=endereco('xBairro'),
+        cMun=endereco('cMun'),
+        xMun=endereco('xMun'),
+        UF=endereco('UF'),
+        CEP=endereco('CEP'),
+        cPais=endereco('cPais'),
+        xPais=endereco('xPais'),
+        fone=endereco('fone'),
+    )
+
+
+def extrair_destinatario(destinatario_el, ns=NS):
+    if destinatario_el is None:
+        return None
+
+    texto = _textos_filhos(destinatario_el).get
+    endereco = _textos_filhos(destinatario_el.find('nfe:enderDest', namespaces=ns)).get
+
+    return DestinatarioDados(
+        CNPJ=texto('CNPJ'),
+        xNome=texto('xNome'),
+        IE=texto('IE'),
+        indIEDest=safe_int(texto('indIEDest')),
+        xLgr=endereco('xLgr'),
+        nro=endereco('nro'),
+        xCpl=endereco('xCpl'),
+        xBairro=endereco('xBairro'),
+        cMun=endereco('cMun'),
+        xMun=endereco('xMun'),
+        UF=endereco('UF'),
+        CEP=endereco('CEP'),
+        cPais=endereco('cPais'),
+        xPais=endereco('xPais'),
+    )
+
+
+def extrair_item(det_el, ns=NS):
+    """Extrai um <det>; retorna None quando não há <prod>"""
+    prod_el = det_el.find('nfe:prod', namespaces=ns)
+    if prod_el is None:
+        return None
+
+    texto = _textos_filhos(prod_el).get
+
+    produto = ProdutoDados(
+        nItem=safe_int(det_el.attrib.get('nItem')),
+        cProd=texto('cProd'),
+        cEAN=texto('cEAN'),
+        xProd=texto('xProd'),
+        NCM=texto('NCM'),
+        CFOP=texto('CFOP'),
+        uCom=texto('uCom'),
+        qCom=safe_decimal(texto('qCom')),
+        vUnCom=safe_decimal(texto('vUnCom')),
+        vProd=safe_decimal(texto('vProd')),
+        uTrib=texto('uTrib'),
+        qTrib=safe_decimal(texto('qTrib')),
+        vUnTrib=safe_decimal(texto('vUnTrib')),
+        indTot=safe_int(texto('indTot')),
+    )
+
+    return ItemDados(produto=produto, imposto=extrair_imposto(det_el, ns))
+
+
+def extrair_imposto(det_el, ns=NS):
+    """Extrai o imposto (ICMS) de um item; retorna None se não houver"""
+    imposto_el = det_el.find('nfe:imposto', namespaces=ns)
+    if imposto_el is None:
+        return None
+
+    icms_el = imposto_el.find('nfe:ICMS', namespaces=ns)
+    if icms_el is None:
+        return None
+
+    # Pega o primeiro elemento filho (ICMS00, ICMS40, etc.)
+    icms_key = next((child for child in icms_el), None)
+    if icms_key is None:
+        return None
+
+    return ImpostoDados(
+        vTotTrib=safe_decimal(safe_findtext(imposto_el, 'nfe:vTotTrib', '0', ns=ns)),
+        orig=safe_findtext(icms_key, 'nfe:orig', ns=ns),
+        CST=safe_findtext(icms_key, 'nfe:CST', ns=ns),
+    )
+
+
+def extrair_total(total_el, ns=NS):
+    icms_tot_el = total_el.find('nfe:ICMSTot', namespaces=ns) if total_el is not None else None
+    if icms_tot_el is None:
+        return None
+
+    textos = _textos_filhos(icms_tot_el)
+    return TotalDados(**{
+        f.name: safe_decimal(textos.get(f.name, '0'))
+        for f in fields(TotalDados)
+    })
+
+
+def extrair_transporte(transp_el, ns=NS):
+    if transp_el is None:
+        return None
+
+    vol_el = transp_el.find('nfe:vol', namespaces=ns)
+
+    return TransporteDados(
+        modFrete=safe_int(safe_findtext(transp_el, 'nfe:modFrete', '0', ns=ns)),
+        # <vol/> vazio não tem volume
+        qVol=safe_int(safe_findtext(vol_el, 'nfe:qVol', '0', ns=ns)) if _tem_filhos(vol_el) else None,
+    )
+
+
+def extrair_cobranca(cobr_el, ns=NS):
+    if cobr_el is None:
+        return CobrancaDados()
+
+    fat_el = cobr_el.find('nfe:fat', namespaces=ns)
+    if not _tem_filhos(fat_el):
+        return CobrancaDados()
+
+    return CobrancaDados(
+        nFat=safe_findtext(fat_el, 'nfe:nFat', ns=ns),
+        vOrig=safe_decimal(safe_findtext(fat_el, 'nfe:vOrig', '0', ns=ns)),
+        vDesc=safe_decimal(safe_findtext(fat_el, 'nfe:vDesc', '0', ns=ns)),
+        vLiq=safe_decimal(safe_findtext(fat_el, 'nfe:vLiq', '0', ns=ns)),
+    )
+
+
+def extrair_pagamentos(cobr_el, ns=NS):
+    if cobr_el is None:
+        return []
+
+    return [
+        PagamentoDados(
+            tPag=safe_findtext(pag_el, 'nfe:tPag', ns=ns),
+            vPag=safe_decimal(safe_findtext(pag_el, 'nfe:vPag', '0', ns=ns)),
+        )
+        for pag_el in cobr_el.findall('nfe:pag', namespaces=ns)
+    ]
+
+
+def _textos_filhos(element):
+    """Mapeia nome (sem namespace) -> texto dos filhos diretos numa única passada"""
+    textos = {}
+    if element is None:
+        return textos
+    for filho in element:
+        textos.setdefault(_nome_local(filho.tag), filho.text)
+    return textos
+
+
+def _tem_filhos(element):
+    return element is not None and len(element) > 0
+
+
+def _nome_local(tag):
+    return tag.split('}')[-1] if isinstance(tag, str) else ''
@@ -1,3 +1,4 @@
+from django.db.models import Prefetch
 from rest_framework import serializers
 from . import models
 from empresa.serializer import EmpresaModelSerializer
@@ -16,25 +17,29 @@ class NfeSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class NfeModelSerializer(serializers.ModelSerializer):
+class NfeListSerializer(serializers.ModelSerializer):
+    """
+    Representação enxuta para listagens: cabeçalho (ide, emitente, destinatário)
+    e totais, sem itens, transporte ou pagamentos. Use com otimizar_queryset.
+    """
     empresa = EmpresaModelSerializer()
     ide = serializers.SerializerMethodField()
     emitente = serializers.SerializerMethodField()
     destinatario = serializers.SerializerMethodField()
-    produtos = serializers.SerializerMethodField()
     total = serializers.SerializerMethodField()
-    transporte = serializers.SerializerMethodField()
-    cobranca = serializers.SerializerMethodField()
-    pagamentos = serializers.SerializerMethodField()
 
     class Meta:
         model = models.NotaFiscal
         fields = [
             'id', 'chave', 'versao', 'dhEmi', 'dhSaiEnt', 'fileXml', 'filePdf',
-            'empresa', 'ide', 'emitente', 'destinatario', 'produtos', 'total',
-            'transporte', 'cobranca', 'pagamentos'
+            'empresa', 'ide', 'emitente', 'destinatario', 'total'
         ]
 
+    @staticmethod
+    def otimizar_queryset(queryset):
+        """Um único JOIN para a empresa e os one-to-ones do cabeçalho"""
+        return queryset.select_related('empresa', 'ide', 'emitente', 'destinatario', 'total')
+
     def get_ide(self, obj):
         if hasattr(obj, 'ide') and obj.ide:
             return IdeModelSerializer(obj.ide).data
@@ -50,29 +55,56 @@ class NfeModelSerializer(serializers.ModelSerializer):
             return DestinatarioModelSerializer(obj.destinatario).data
         return None
 
+    def get_total(self, obj):
+        if hasattr(obj, 'total') and obj.total:
+            return TotalModelSerializer(obj.total).data
+        return None
+
+
+class NfeModelSerializer(NfeListSerializer):
+    """Árvore completa da nota (detalhe): inclui produtos/impostos, transporte, cobrança e pagamentos"""
+    produtos = serializers.SerializerMethodField()
+    transporte = serializers.SerializerMethodField()
+    cobranca = serializers.SerializerMethodField()
+    pagamentos = serializers.SerializerMethodField()
+
+    class Meta:
+        model = models.NotaFiscal
+        fields = [
+            'id', 'chave', 'versao', 'dhEmi', 'dhSaiEnt', 'fileXml', 'filePdf',
+            'empresa', 'ide', 'emitente', 'destinatario', 'produtos', 'total',
+            'transporte', 'cobranca', 'pagamentos'
+        ]
+
+    @staticmethod
+    def otimizar_queryset(queryset):
+        """One-to-ones via JOIN; produtos→imposto e cobrança→pagamentos em prefetch"""
+        return queryset.select_related(
+            'empresa', 'ide', 'emitente', 'destinatario', 'total', 'transporte', 'cobranca'
+        ).prefetch_related(
+            Prefetch('produtos', queryset=models.Produto.objects.select_related('imposto')),
+            'cobranca__pagamentos',
+        )
+
     def get_produtos(self, obj):
         if hasattr(obj, 'produtos') and obj.produtos:
             return ProdutoModelSerializer(obj.produtos.all(), many=True).data
         return None
 
-    def get_total(self, obj):
-        if hasattr(obj, 'total') and obj.total:
-            return TotalModelSerializer().data
-        return None
-
     def get_transporte(self, obj):
         if hasattr(obj, 'transporte') and obj.transporte:
-            return TransporteModelSerializer().data
+            return TransporteModelSerializer(obj.transporte).data
         return None
 
     def get_cobranca(self, obj):
         if hasattr(obj, 'cobranca') and obj.cobranca:
-            return CobrancaModelSerializer().data
+            return CobrancaModelSerializer(obj.cobranca).data
         return None
 
     def get_pagamentos(self, obj):
-        if hasattr(obj, 'pagamentos') and obj.pagamentos:
-            return PagamentoModelSerializer(obj.pagamentos.all(), many=True).data
+        # Pagamentos são relacionados via cobranca
+        if hasattr(obj, 'cobranca') and obj.cobranca:
+            return PagamentoModelSerializer(obj.cobranca.pagamentos.all(), many=True).data
         return None
 
 
@@ -1,19 +1,32 @@
+import base64
+import gzip
 import logging
 import os
+import time
+import uuid
 from re import sub
 from lxml import etree
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from celery import shared_task
+from celery import shared_task, chain, chord, group
+from celery.exceptions import Ignore
 from django.conf import settings
 from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
 
-from pynfe.processamento.comunicacao import ComunicacaoSefaz
 from pynfe.utils.flags import NAMESPACE_NFE
-from pynfe.utils.descompactar import DescompactaGzip
 
-from empresa.models import Empresa, HistoricoNSU
+from app.utils import arquivo_xml, danfe
+from app.utils.sefaz import obter_comunicacao_sefaz
+from empresa.models import Empresa, CursorNSU, HistoricoNSU
+from db_allnube_empresa.models import NotaFiscalFlat
+from db_allnube_empresa.utils.database_utils import DatabaseManager
+from nfe.filters import NotaFiscalFilter
+from nfe.models import NotaFiscal
 from nfe.processor.nfe_processor import NFeProcessor
+from nfe.processor.nfe_exportacao import escrever_zip, renderizar_danfes
+from nfe.processor.nfe_lote_zip import NFeLoteProcessor
 from nfe_resumo.processor.resumo_processor import ResumoNFeProcessor
 from nfe_evento.processor.evento_processor import EventoNFeProcessor
 
@@ -24,83 +37,203 @@ logger = logging.getLogger(__name__)
 def automatizar_nfe_task(self):
     """
     Task Celery para consultar documentos NFe via SEFAZ
+
+    Dispara um chord: cada empresa é consultada na sua própria subtask e a
+    consolidação (mesmo resumo `results` de antes) é feita no callback.
+    Empresas da mesma UF são distribuídas em no máximo NFE_AUTOMACAO_MAX_POR_UF
+    filas (chains), limitando as consultas simultâneas a cada SEFAZ.
     """
     task_id = self.request.id
     logger.info(f"[TASK {task_id}] Iniciando automação NFe...")
 
-    ns = {'ns': NAMESPACE_NFE}
-    xml_dir = os.path.join(settings.MEDIA_ROOT, 'xml')
-    os.makedirs(xml_dir, exist_ok=True)
-
     # FILTRAR APENAS EMPRESAS COM CERTIFICADO (file preenchido)
     empresas_com_certificado = Empresa.objects.filter(file__isnull=False).exclude(file='')
 
-    if not empresas_com_certificado.exists():
+    empresas = list(empresas_com_certificado.order_by('uf', 'id').values_list('id', 'uf'))
+    if not empresas:
         logger.info("[TASK] Nenhuma empresa com certificado encontrada.")
         return {"status": "success", "message": "Nenhuma empresa com certificado"}
 
-    logger.info(f"[TASK] Processando {empresas_com_certificado.count()} empresa(s) com certificado.")
+    logger.info(f"[TASK] Processando {len(empresas)} empresa(s) com certificado.")
+
+    filas = _distribuir_filas_por_uf(empresas, settings.NFE_AUTOMACAO_MAX_POR_UF)
+
+    # Cada fila é uma chain de tasks por empresa; a lista de resultados passa de uma para a outra
+    cabecalho = group(
+        chain(
+            automatizar_nfe_empresa_fila_task.s([], fila[0]),
+            *(automatizar_nfe_empresa_fila_task.s(empresa_id) for empresa_id in fila[1:])
+        )
+        for fila in filas
+    )
+    consolidacao = chord(cabecalho)(
+        consolidar_automatizacao_nfe_task.s(task_id, len(empresas))
+    )
+
+    logger.info(f"[TASK {task_id}] {len(filas)} fila(s) disparada(s); consolidação em {consolidacao.id}")
+
+    return {
+        "status": "dispatched",
+        "total_empresas": len(empresas),
+        "filas": len(filas),
+        "consolidacao_task_id": consolidacao.id
+    }
+
+
+def _distribuir_filas_por_uf(empresas, max_por_uf):
+    """
+    Divide [(empresa_id, uf), ...] em filas sequenciais com no máximo
+    `max_por_uf` filas por UF (round-robin dentro da UF).
+    """
+    filas_por_uf = {}
+    for empresa_id, uf in empresas:
+        filas = filas_por_uf.setdefault(uf, [])
+        posicao = sum(len(fila) for fila in filas)
+        if len(filas) < max_por_uf:
+            filas.append([empresa_id])
+        else:
+            filas[posicao % max_por_uf].append(empresa_id)
+
+    return [fila for filas in filas_por_uf.values() for fila in filas]
+
+
+@shared_task(bind=True, name='nfe.tasks.automatizar_nfe_empresa_fila')
+def automatizar_nfe_empresa_fila_task(self, acumulado, empresa_id):
+    """
+    Subtask do chord: consulta a SEFAZ para uma empresa.
+
+    `acumulado` é a lista de resultados das empresas anteriores da mesma fila
+    (a chain passa o retorno de uma task como primeiro argumento da próxima).
+    Nunca levanta exceção para não interromper a fila.
+    """
+    try:
+        resultado = _consultar_distribuicao_empresa(Empresa.objects.get(pk=empresa_id))
+    except Exception as e:
+        logger.error(f"[TASK] Falha ao processar empresa {empresa_id}: {str(e)}", exc_info=True)
+        resultado = {
+            "status": "erro",
+            "documentos_processados": 0,
+            "nsu_atualizados": 0,
+            "detalhe": {
+                "empresa": empresa_id,
+                "status": "erro",
+                "documentos": 0,
+                "erros": [str(e)]
+            }
+        }
+
+    return acumulado + [resultado]
 
+
+@shared_task(bind=True, name='nfe.tasks.consolidar_automatizacao_nfe')
+def consolidar_automatizacao_nfe_task(self, resultados_filas, task_id_origem, total_empresas):
+    """
+    Callback do chord: monta o mesmo resumo que a automação gerava de forma sequencial
+    """
     results = {
-        "total_empresas": empresas_com_certificado.count(),
+        "total_empresas": total_empresas,
         "empresas_processadas": 0,
         "empresas_com_erro": 0,
         "documentos_processados": 0,
         "nsu_atualizados": 0,
+        "paginas_drenadas": 0,
         "detalhes": []
     }
 
-    hora_atual = datetime.now().hour
+    for resultado in (resultado for fila in resultados_filas for resultado in fila):
+        if resultado["status"] == "sucesso":
+            results["empresas_processadas"] += 1
+        elif resultado["status"] == "erro":
+            results["empresas_com_erro"] += 1
+
+        results["documentos_processados"] += resultado["documentos_processados"]
+        results["nsu_atualizados"] += resultado["nsu_atualizados"]
+        results["paginas_drenadas"] += resultado["detalhe"].get("paginas", 0)
+        results["detalhes"].append(resultado["detalhe"])
+
+    logger.info(f"[TASK] Automação concluída: {results}")
+
+    # Salva resultado no cache para consulta
+    cache.set(f'automatizacao_nfe_result_{task_id_origem}', results, timeout=3600)
+
+    return results
+
 
-    for empresa in empresas_com_certificado:
-        empresa_result = {
+def _consultar_distribuicao_empresa(empresa):
+    """
+    Consulta a distribuição de DF-e de uma empresa e processa os documentos.
+
+    Retorna {"status", "documentos_processados", "nsu_atualizados", "detalhe"},
+    onde "detalhe" é o item de `results["detalhes"]` da empresa.
+    """
+    ns = {'ns': NAMESPACE_NFE}
+
+    resultado = {
+        "status": "processando",
+        "documentos_processados": 0,
+        "nsu_atualizados": 0,
+        "detalhe": {
             "empresa": empresa.razao_social,
             "cnpj": empresa.documento,
             "status": "processando",
             "documentos": 0,
             "erros": []
         }
+    }
+    empresa_result = resultado["detalhe"]
 
-        hora_inicio = empresa.nfe_hora_inicio
-        hora_fim = empresa.nfe_hora_fim
+    def finalizar(status_empresa):
+        resultado["status"] = status_empresa
+        if empresa_result["status"] == "processando":
+            empresa_result["status"] = status_empresa
+        return resultado
 
-        # Verifica se hora atual está dentro da janela configurada pela empresa
-        if hora_inicio <= hora_fim:
-            dentro_janela = hora_inicio <= hora_atual <= hora_fim
-        else:
-            # Janela passa da meia-noite (ex: 22h até 06h)
-            dentro_janela = hora_atual >= hora_inicio or hora_atual <= hora_fim
-
-        if not dentro_janela:
-            logger.info(f"[TASK] {empresa.razao_social} fora da janela configurada ({hora_inicio}h-{hora_fim}h). Pulando.")
-            empresa_result["status"] = "fora_janela"
-            empresa_result["mensagem"] = f"Fora da janela {hora_inicio}h-{hora_fim}h"
-            results["detalhes"].append(empresa_result)
-            continue
-
-        logger.info(f"[TASK] Processando empresa: {empresa.razao_social}")
-
-        cert_path = empresa.file.path
-        if not os.path.isfile(cert_path):
-            logger.error(f"[TASK] Certificado não encontrado: {cert_path}")
-            empresa_result["status"] = "erro"
-            empresa_result["erros"].append(f"Certificado não encontrado: {cert_path}")
-            results["empresas_com_erro"] += 1
-            results["detalhes"].append(empresa_result)
-            continue
+    hora_atual = datetime.now().hour
+    hora_inicio = empresa.nfe_hora_inicio
+    hora_fim = empresa.nfe_hora_fim
+
+    # Verifica se hora atual está dentro da janela configurada pela empresa
+    if hora_inicio <= hora_fim:
+        dentro_janela = hora_inicio <= hora_atual <= hora_fim
+    else:
+        # Janela passa da meia-noite (ex: 22h até 06h)
+        dentro_janela = hora_atual >= hora_inicio or hora_atual <= hora_fim
+
+    if not dentro_janela:
+        logger.info(f"[TASK] {empresa.razao_social} fora da janela configurada ({hora_inicio}h-{hora_fim}h). Pulando.")
+        empresa_result["mensagem"] = f"Fora da janela {hora_inicio}h-{hora_fim}h"
+        return finalizar("fora_janela")
+
+    agora = timezone.now()
+    if empresa.nfe_proxima_consulta and agora < empresa.nfe_proxima_consulta:
+        proxima = timezone.localtime(empresa.nfe_proxima_consulta).strftime('%H:%M')
+        logger.info(f"[TASK] {empresa.razao_social} aguardando liberação da SEFAZ até {proxima}. Pulando.")
+        empresa_result["mensagem"] = f"Aguardando liberação da SEFAZ até {proxima}"
+        return finalizar("aguardando")
+
+    logger.info(f"[TASK] Processando empresa: {empresa.razao_social}")
+
+    cert_path = empresa.file.path
+    if not os.path.isfile(cert_path):
+        logger.error(f"[TASK] Certificado não encontrado: {cert_path}")
+        empresa_result["erros"].append(f"Certificado não encontrado: {cert_path}")
+        return finalizar("erro")
+
+    empresa_result["paginas"] = 0
 
+    try:
+        # Pega último NSU do cursor da empresa ou usa 0 se não houver
         try:
-            # Pega último NSU do banco ou usa 0 se não houver
-            try:
-                ultimo_nsu = empresa.historico_empresa.order_by('-created_at').first()
-                nsu_para_consulta = int(ultimo_nsu.nsu) if ultimo_nsu else 0
-            except Exception as e:
-                logger.warning(f"[TASK] Erro ao buscar NSU anterior: {e}")
-                nsu_para_consulta = 0
+            nsu_para_consulta = CursorNSU.obter_nsu(empresa.id)
+        except Exception as e:
+            logger.warning(f"[TASK] Erro ao buscar NSU anterior: {e}")
+            nsu_para_consulta = 0
 
-            logger.info(f"[TASK] Consultando SEFAZ para NSU: {nsu_para_consulta}")
+        con = obter_comunicacao_sefaz(empresa, homologacao=False)
 
-            con = ComunicacaoSefaz(empresa.uf, cert_path, empresa.senha, homologacao=False)
+        # Drena o backlog: pede páginas enquanto ultNSU < maxNSU (limitado por execução)
+        while empresa_result["paginas"] < settings.NFE_AUTOMACAO_MAX_PAGINAS:
+            logger.info(f"[TASK] Consultando SEFAZ para NSU: {nsu_para_consulta}")
 
             response = con.consulta_distribuicao(
                 cnpj=sub(r'\D', '', empresa.documento),
@@ -111,118 +244,164 @@ def automatizar_nfe_task(self):
 
             if not response or not response.text.startswith('<'):
                 logger.error(f"[TASK] Resposta inválida para {empresa.razao_social}")
-                empresa_result["status"] = "erro"
                 empresa_result["erros"].append("Resposta inválida da SEFAZ")
-                results["empresas_com_erro"] += 1
-                results["detalhes"].append(empresa_result)
-                continue
+                return finalizar("erro")
 
-            xml = response.text
-            resposta = etree.fromstring(xml.encode('utf-8'))
+            resposta = etree.fromstring(response.text.encode('utf-8'))
 
             cStat = resposta.xpath('//ns:retDistDFeInt/ns:cStat', namespaces=ns)[0].text
             xMotivo = resposta.xpath('//ns:retDistDFeInt/ns:xMotivo', namespaces=ns)[0].text
             logger.info(f"[TASK] {empresa.razao_social} - cStat: {cStat} | xMotivo: {xMotivo}")
 
             if cStat in ('137', '656'):
-                logger.info(f"[TASK] Nada a processar para {empresa.razao_social}")
-                empresa_result["status"] = "sucesso"
-                empresa_result["mensagem"] = f"Nada a processar (cStat {cStat})"
-                results["empresas_processadas"] += 1
-                results["detalhes"].append(empresa_result)
-
-                # Atualiza NSU mesmo sem documentos
-                if cStat == "138":
-                    max_nsu_nodes = resposta.xpath('//ns:retDistDFeInt/ns:maxNSU', namespaces=ns)
-                    if max_nsu_nodes:
-                        novo_nsu = int(max_nsu_nodes[0].text)
-                        HistoricoNSU.objects.create(empresa=empresa, nsu=novo_nsu)
-                        results["nsu_atualizados"] += 1
-                        logger.info(f"[TASK] NSU atualizado para {empresa.razao_social}: {novo_nsu}")
-
-                continue
+                # 137: nada novo / 656: consumo indevido -> a SEFAZ exige aguardar antes da próxima consulta
+                CursorNSU.avancar(empresa.id, nsu_para_consulta, cstat=cStat, auditar=False)
+                _agendar_proxima_consulta(empresa)
+                if empresa_result["paginas"] == 0:
+                    logger.info(f"[TASK] Nada a processar para {empresa.razao_social}")
+                    empresa_result["mensagem"] = f"Nada a processar (cStat {cStat})"
+                break
+
+            if cStat != "138":
+                empresa_result["erros"].append(f"cStat {cStat}: {xMotivo}")
+                return finalizar("erro")
+
+            empresa_result["paginas"] += 1
 
             documentos = resposta.xpath('//ns:retDistDFeInt/ns:loteDistDFeInt/ns:docZip', namespaces=ns)
             logger.info(f"[TASK] Encontrados {len(documentos)} documento(s) para processar.")
-            empresa_result["documentos"] = len(documentos)
-
-            for doc in documentos:
-                tipo_schema = doc.attrib.get('schema')
-                numero_nsu = doc.attrib.get('NSU')
-                conteudo_zipado = doc.text
-
-                # Descompacta o conteúdo do arquivo ZIP
-                xml_descompactado = DescompactaGzip.descompacta(conteudo_zipado)
-                conteudo = etree.tostring(xml_descompactado, encoding='utf-8').decode('utf-8')
-
-                # Define o nome do arquivo dependendo do tipo de schema
-                if tipo_schema == 'procNFe_v4.00.xsd':
-                    filename = f'nfe_nsu-{numero_nsu}.xml'
-                    tipo_documento = "nfe_nsu"
-                elif tipo_schema == 'resNFe_v1.01.xsd':
-                    filename = f'resumo_nsu-{numero_nsu}.xml'
-                    tipo_documento = "resumo_nsu"
-                else:
-                    filename = f'outro_nsu-{numero_nsu}.xml'
-                    tipo_documento = "outro_nsu"
-
-                # Caminho absoluto para salvar o arquivo
-                filepath = os.path.join(xml_dir, filename)
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    f.write(conteudo)
-
-                # Caminho relativo para enviar à API
-                relative_path = os.path.join('xml', filename)
-                logger.info(f"[TASK] Documento {numero_nsu} salvo em {relative_path}")
-
-                try:
-                    if tipo_documento == "nfe_nsu":
-                        processor = NFeProcessor(empresa, numero_nsu, relative_path)
-                        processor.processar(debug=False)
-                        results["documentos_processados"] += 1
-                        logger.info(f"[TASK] Documento {numero_nsu} processado")
-
-                    elif tipo_documento == "resumo_nsu":
-                        processor = ResumoNFeProcessor(empresa, numero_nsu, relative_path)
-                        processor.processar()
-                        results["documentos_processados"] += 1
-                        logger.info(f"[TASK] Resumo {numero_nsu} processado")
-                    else:
-                        processor = EventoNFeProcessor(empresa, numero_nsu, relative_path)
-                        processor.processar()
-                        results["documentos_processados"] += 1
-                        logger.info(f"[TASK] Evento {numero_nsu} processado")
-
-                except Exception as e:
-                    logger.error(f"[TASK] Falha ao processar documento {numero_nsu}: {str(e)}")
-                    empresa_result["erros"].append(f"Documento {numero_nsu}: {str(e)}")
-
-            # Atualiza NSU no banco somente se resposta for válida
-            if cStat == "138":
-                max_nsu_nodes = resposta.xpath('//ns:retDistDFeInt/ns:maxNSU', namespaces=ns)
-                if max_nsu_nodes:
-                    novo_nsu = int(max_nsu_nodes[0].text)
-                    HistoricoNSU.objects.create(empresa=empresa, nsu=novo_nsu)
-                    results["nsu_atualizados"] += 1
-                    logger.info(f"[TASK] NSU atualizado para {empresa.razao_social}: {novo_nsu}")
-
-            empresa_result["status"] = "sucesso"
-            results["empresas_processadas"] += 1
+            empresa_result["documentos"] += len(documentos)
+
+            _processar_documentos_distribuicao(empresa, documentos, resultado)
+
+            ult_nsu = int(resposta.xpath('//ns:retDistDFeInt/ns:ultNSU', namespaces=ns)[0].text)
+            max_nsu = int(resposta.xpath('//ns:retDistDFeInt/ns:maxNSU', namespaces=ns)[0].text)
+
+            # Cursor avança até o último NSU entregue nesta página (não até o maxNSU)
+            CursorNSU.avancar(empresa.id, ult_nsu, max_nsu=max_nsu, cstat=cStat)
+            resultado["nsu_atualizados"] += 1
+            logger.info(f"[TASK] NSU atualizado para {empresa.razao_social}: {ult_nsu} (maxNSU {max_nsu})")
+
+            if ult_nsu >= max_nsu:
+                # Backlog zerado: a SEFAZ pede 1 hora até a próxima consulta
+                _agendar_proxima_consulta(empresa)
+                break
+
+            nsu_para_consulta = ult_nsu
+
+        logger.info(
+            f"[TASK] {empresa.razao_social}: {empresa_result['paginas']} página(s), "
+            f"{empresa_result['documentos']} documento(s) drenado(s)"
+        )
+        return finalizar("sucesso")
+
+    except Exception as e:
+        logger.error(f"[TASK] Falha ao processar {empresa.razao_social}: {str(e)}", exc_info=True)
+        empresa_result["erros"].append(str(e))
+        return finalizar("erro")
+
+
+def _agendar_proxima_consulta(empresa):
+    """Persiste o horário a partir do qual a empresa pode consultar a distribuição de novo"""
+    empresa.nfe_proxima_consulta = timezone.now() + timedelta(minutes=settings.NFE_AUTOMACAO_ESPERA_SEFAZ_MINUTOS)
+    Empresa.objects.filter(pk=empresa.pk).update(nfe_proxima_consulta=empresa.nfe_proxima_consulta)
+
+
+def _processar_documentos_distribuicao(empresa, documentos, resultado):
+    """
+    Salva e processa os docZip de uma página do loteDistDFeInt.
+
+    Cada docZip é descompactado e parseado uma única vez e o elemento vai direto
+    para os processors; a gravação do gzip no acervo corre em paralelo e só é
+    aguardada no fim da página (antes de o cursor de NSU avançar).
+    """
+    empresa_result = resultado["detalhe"]
+    # Resumos e eventos da página são gravados juntos (INSERT ... ON CONFLICT por tipo)
+    resumos = []
+    eventos = []
+    gravacoes = []
+    notas_danfe = []
+
+    for doc in documentos:
+        tipo_schema = doc.attrib.get('schema')
+        numero_nsu = doc.attrib.get('NSU')
+        conteudo_zipado = doc.text
+
+        # Define o tipo do documento pelo schema
+        if tipo_schema == 'procNFe_v4.00.xsd':
+            tipo_documento = "nfe_nsu"
+        elif tipo_schema == 'resNFe_v1.01.xsd':
+            tipo_documento = "resumo_nsu"
+        else:
+            tipo_documento = "outro_nsu"
+
+        try:
+            # docZip corrompido ou truncado é erro só deste documento: a página
+            # segue e o cursor de NSU avança
+            conteudo_gzip = base64.b64decode(conteudo_zipado)
+            # Único parse do documento: o elemento é entregue pronto aos processors
+            raiz = etree.fromstring(gzip.decompress(conteudo_gzip))
+
+            # O docZip já é gzip: vai para o acervo como chegou, em segundo plano
+            relative_path, gravacao = arquivo_xml.salvar_gzip_em_segundo_plano(empresa.id, conteudo_gzip)
+            gravacoes.append(gravacao)
+
+            if tipo_documento == "nfe_nsu":
+                processor = NFeProcessor(empresa, numero_nsu, relative_path, registrar_nsu=False, raiz=raiz)
+                nota = processor.processar(debug=False)
+                resultado["documentos_processados"] += 1
+                logger.info(f"[TASK] Documento {numero_nsu} processado")
+                if nota is not None and empresa.nfe_pre_renderizar_danfe:
+                    notas_danfe.append(nota)
+
+            elif tipo_documento == "resumo_nsu":
+                resumos.append((numero_nsu, ResumoNFeProcessor(empresa, numero_nsu, relative_path, registrar_nsu=False, raiz=raiz)))
+            else:
+                eventos.append((numero_nsu, EventoNFeProcessor(empresa, numero_nsu, relative_path, registrar_nsu=False, raiz=raiz)))
 
         except Exception as e:
-            logger.error(f"[TASK] Falha ao processar {empresa.razao_social}: {str(e)}", exc_info=True)
-            empresa_result["status"] = "erro"
-            empresa_result["erros"].append(str(e))
-            results["empresas_com_erro"] += 1
+            logger.error(f"[TASK] Falha ao processar documento {numero_nsu}: {str(e)}")
+            empresa_result["erros"].append(f"Documento {numero_nsu}: {str(e)}")
 
-        results["detalhes"].append(empresa_result)
+    _gravar_lote_distribuicao(ResumoNFeProcessor, "Resumo", resumos, resultado)
+    _gravar_lote_distribuicao(EventoNFeProcessor, "Evento", eventos, resultado)
 
-    logger.info(f"[TASK] Automação concluída: {results}")
+    # Falha ao gravar no acervo propaga: o cursor não avança e a página é reprocessada
+    for gravacao in gravacoes:
+        gravacao.result()
+    logger.info(f"[TASK] {len(gravacoes)} documento(s) gravado(s) no acervo")
 
-    # Salva resultado no cache para consulta
-    cache.set(f'automatizacao_nfe_result_{task_id}', results, timeout=3600)
+    # Só com o XML já no acervo: a task do DANFE lê de lá
+    for nota in notas_danfe:
+        agendar_danfe(nota)
 
-    return results
+
+def _gravar_lote_distribuicao(classe_processor, descricao, processadores, resultado):
+    """
+    Grava os documentos de um tipo de uma vez; se o lote falhar, regrava um a
+    um para que só o documento com problema fique de fora.
+    """
+    if not processadores:
+        return
+
+    empresa_result = resultado["detalhe"]
+    try:
+        with transaction.atomic():
+            classe_processor.gravar_lote([processor for _, processor in processadores])
+        resultado["documentos_processados"] += len(processadores)
+        logger.info(f"[TASK] {len(processadores)} {descricao}(s) processado(s)")
+        return
+    except Exception as e:
+        logger.warning(f"[TASK] Falha ao gravar {descricao}s em lote, gravando um a um: {str(e)}")
+
+    for numero_nsu, processor in processadores:
+        try:
+            processor.processar()
+            resultado["documentos_processados"] += 1
+            logger.info(f"[TASK] {descricao} {numero_nsu} processado")
+        except Exception as e:
+            logger.error(f"[TASK] Falha ao processar documento {numero_nsu}: {str(e)}")
+            empresa_result["erros"].append(f"Documento {numero_nsu}: {str(e)}")
 
 
 @shared_task(name='nfe.tasks.automatizar_nfe_empresa_especifica')
@@ -231,14 +410,323 @@ def automatizar_nfe_empresa_task(empresa_id):
     Task para processar uma empresa específica (útil para debugging)
     """
     try:
-        Empresa.objects.get(id=empresa_id, file__isnull=False)
+        empresa = Empresa.objects.get(id=empresa_id, file__isnull=False)
     except Empresa.DoesNotExist:
         return {"error": f"Empresa {empresa_id} não encontrada ou sem certificado"}
 
-    # Reutiliza a lógica principal para uma empresa
-    from nfe.management.commands.automatizando import Command
-    Command()
+    return _consultar_distribuicao_empresa(empresa)
+
+
+def chave_cancelamento_lote(task_id):
+    return f'lote_nfe_cancelar_{task_id}'
+
+
+class LoteCancelado(Exception):
+    """Cancelamento do lote pedido pelo usuário"""
+
+    def __init__(self, resultados=None):
+        super().__init__('Processamento cancelado pelo usuário')
+        self.resultados = resultados
+
+
+@shared_task(bind=True, name='nfe.tasks.processar_lote_nfe')
+def processar_lote_nfe_task(self, empresa_id, nsu, caminho_zip):
+    """
+    Task assíncrona para processar um lote ZIP de XMLs (NFe, eventos e resumos)
+
+    caminho_zip é relativo ao MEDIA_ROOT e o arquivo é removido ao final.
+
+    O cancelamento é cooperativo (o worker roda com --pool=threads, onde
+    revoke(terminate=True) não interrompe nada): a view grava a flag
+    chave_cancelamento_lote e a task a confere no início e a cada bloco
+    gravado, terminando no estado CANCELADO com o que já foi gravado.
+    """
+    task_id = self.request.id
+    caminho_completo = os.path.join(settings.MEDIA_ROOT, caminho_zip)
+
+    def verificar_cancelamento(resultados=None):
+        if cache.get(chave_cancelamento_lote(task_id)):
+            raise LoteCancelado(resultados)
+
+    def progresso(concluidos, total, resultados):
+        verificar_cancelamento(resultados)
+        self.update_state(
+            state='PROGRESS',
+            meta={
+                'current': concluidos,
+                'total': total,
+                'status': f'Processando arquivos ({concluidos}/{total})...',
+                'nfe_processadas': resultados['nfe_processadas'],
+                'eventos_processados': resultados['eventos_processados'],
+                'resumos_processados': resultados['resumos_processados'],
+                'erros': len(resultados['erros']),
+            }
+        )
+
+    try:
+        self.update_state(
+            state='PROGRESS',
+            meta={'current': 0, 'total': 0, 'status': 'Iniciando processamento...'}
+        )
+
+        verificar_cancelamento()
+        empresa = Empresa.objects.get(pk=empresa_id)
+
+        # Roda numa thread do worker (--pool=threads): a classificação usa o pool de
+        # processos compartilhado do processo, criado via forkserver (nunca fork daqui)
+        with open(caminho_completo, 'rb') as arquivo_zip:
+            resultados = NFeLoteProcessor(empresa, nsu, arquivo_zip).processar_zip_paralelo(progresso=progresso)
+
+        # Salva resultado no cache
+        cache.set(f'lote_nfe_result_{task_id}', resultados, timeout=3600)
+
+        logger.info(f"[TASK {task_id}] Lote processado: {resultados['nfe_processadas']} NFe, "
+                    f"{resultados['eventos_processados']} eventos, {resultados['resumos_processados']} resumos, "
+                    f"{len(resultados['erros'])} erros")
+        return resultados
+
+    except LoteCancelado as e:
+        resultados = e.resultados or NFeLoteProcessor._resultados_vazios()
+        logger.info(f"[TASK {task_id}] Lote cancelado pelo usuário após {resultados['nfe_processadas']} NFe, "
+                    f"{resultados['eventos_processados']} eventos, {resultados['resumos_processados']} resumos")
+        self.update_state(
+            state='CANCELADO',
+            meta={
+                'status': str(e),
+                'nfe_processadas': resultados['nfe_processadas'],
+                'eventos_processados': resultados['eventos_processados'],
+                'resumos_processados': resultados['resumos_processados'],
+                'erros': len(resultados['erros']),
+            }
+        )
+        # Ignore: o Celery não sobrescreve o estado CANCELADO com SUCCESS/FAILURE
+        raise Ignore()
+
+    except Exception as e:
+        logger.error(f"[TASK {task_id}] Erro no processamento do lote: {str(e)}", exc_info=True)
+        raise
+
+    finally:
+        if os.path.exists(caminho_completo):
+            os.remove(caminho_completo)
+
+
+@shared_task(name='nfe.tasks.expurgar_historico_nsu')
+def expurgar_historico_nsu_task():
+    """Remove da auditoria de NSU as linhas mais antigas que NFE_HISTORICO_NSU_RETENCAO_DIAS"""
+    dias = settings.NFE_HISTORICO_NSU_RETENCAO_DIAS
+    if not dias:
+        return {"removidos": 0}
+
+    limite = timezone.now() - timedelta(days=dias)
+    removidos, _ = HistoricoNSU.objects.filter(created_at__lt=limite).delete()
+    logger.info(f"[TASK] Auditoria de NSU: {removidos} registro(s) anteriores a {limite:%d/%m/%Y} removido(s)")
+    return {"removidos": removidos}
+
+
+def agendar_danfe(nota_fiscal, relativo=None):
+    """
+    Enfileira a renderização do DANFE se o PDF desta versão do XML ainda não
+    existe. Retorna True se uma task foi enfileirada.
+    """
+    if relativo is None:
+        relativo = danfe.caminho_pdf(nota_fiscal.empresa_id, nota_fiscal.chave, nota_fiscal.fileXml.name)
+    if danfe.existe(relativo):
+        return False
+
+    # cache.add é atômico: enquanto a renderização roda, novas chamadas não enfileiram outra
+    if not cache.add(danfe.chave_pendente(relativo), True, timeout=settings.DANFE_RENDERIZACAO_TIMEOUT):
+        return False
+    gerar_danfe_task.delay(nota_fiscal.id)
+    return True
+
+
+def registrar_danfe(nota_fiscal, relativo):
+    """Grava o caminho do PDF na NotaFiscal e, se a empresa tem banco próprio, na NotaFiscalFlat"""
+    NotaFiscal.objects.filter(pk=nota_fiscal.pk).update(filePdf=relativo)
+    nota_fiscal.filePdf.name = relativo
+
+    if not DatabaseManager.empresa_tem_banco_proprio(nota_fiscal.empresa_id):
+        return
+    try:
+        if DatabaseManager.usar_banco_empresa(nota_fiscal.empresa_id):
+            NotaFiscalFlat.objects.filter(empresa_id=nota_fiscal.empresa_id, chave=nota_fiscal.chave).update(filePdf=relativo)
+    finally:
+        DatabaseManager.limpar_conexao_empresa()
+
+
+@shared_task(name='nfe.tasks.gerar_danfe')
+def gerar_danfe_task(nota_fiscal_id):
+    """Renderiza o DANFE da nota uma única vez por versão do XML e registra o caminho em filePdf"""
+    nota_fiscal = NotaFiscal.objects.get(pk=nota_fiscal_id)
+    relativo = danfe.caminho_pdf(nota_fiscal.empresa_id, nota_fiscal.chave, nota_fiscal.fileXml.name)
+
+    try:
+        danfe.renderizar(nota_fiscal.fileXml.name, relativo)
+    except Exception as e:
+        logger.error(f"[TASK] Falha ao gerar o DANFE da nota {nota_fiscal.chave}: {str(e)}", exc_info=True)
+        # A view devolve o erro na próxima consulta e a chamada seguinte tenta de novo
+        cache.set(danfe.chave_erro(relativo), str(e), timeout=settings.DANFE_RENDERIZACAO_TIMEOUT)
+        raise
+    finally:
+        cache.delete(danfe.chave_pendente(relativo))
+
+    registrar_danfe(nota_fiscal, relativo)
+    logger.info(f"[TASK] DANFE da nota {nota_fiscal.chave} gerado em {relativo}")
+    return relativo
+
+
+def caminho_exportacao(job_id):
+    """Caminho absoluto do ZIP de uma exportação"""
+    return os.path.join(settings.MEDIA_ROOT, 'exportacoes', f'{job_id}.zip')
+
+
+def atualizar_exportacao(job_id, **campos):
+    """Estado da exportação no cache (lido pelo endpoint de status)"""
+    chave = f'exportacao_nfe_{job_id}'
+    estado = cache.get(chave) or {}
+    estado.update(campos)
+    cache.set(chave, estado, timeout=settings.NFE_EXPORTACAO_RETENCAO_HORAS * 3600)
+    return estado
+
+
+def notas_exportacao(empresa_id, filtros):
+    """Notas ativas da empresa com XML, filtradas pelo NotaFiscalFilter"""
+    queryset = NotaFiscal.objects.filter(empresa_id=empresa_id, deleted_at__isnull=True).exclude(fileXml='')
+    return NotaFiscalFilter(data=filtros, queryset=queryset).qs
 
-    # Aqui você pode adaptar para processar apenas uma empresa
-    # Por simplicidade, vamos chamar a task principal
-    return automatizar_nfe_task.delay()
+
+def _caminho_danfe(empresa_id, chave, caminho_xml):
+    try:
+        return danfe.caminho_pdf(empresa_id, chave, caminho_xml)
+    except FileNotFoundError:
+        # XML solto ausente: a nota entra nos erros do ZIP
+        return None
+
+
+@shared_task(name='nfe.tasks.exportar_nfes')
+def exportar_nfes_task(job_id, empresa_id, filtros, incluir_danfe=True):
+    """
+    Exporta em ZIP os XMLs (e DANFEs) das notas filtradas.
+
+    Os DANFEs que ainda não existem são gerados antes, em blocos de
+    NFE_EXPORTACAO_DANFES_POR_TASK notas espalhados pelos workers (chord);
+    o ZIP é montado no callback quando todos terminam.
+    """
+    try:
+        notas = list(
+            notas_exportacao(empresa_id, filtros).order_by('dhEmi', 'id').values_list('id', 'chave', 'fileXml')
+        )
+        nota_ids = [nota_id for nota_id, _, _ in notas]
+
+        faltando = []
+        if incluir_danfe:
+            for nota_id, chave, caminho_xml in notas:
+                relativo = _caminho_danfe(empresa_id, chave, caminho_xml)
+                if relativo and not danfe.existe(relativo):
+                    faltando.append(nota_id)
+
+        if not faltando:
+            atualizar_exportacao(job_id, status='compactando', total=len(nota_ids), danfes_a_gerar=0)
+            return _montar_zip_exportacao(job_id, nota_ids, incluir_danfe, [])
+
+        # Id do callback definido antes do chord: o status consegue detectar falha nos blocos
+        task_montagem = str(uuid.uuid4())
+        cache.set(f'exportacao_nfe_{job_id}_danfes', 0, timeout=settings.NFE_EXPORTACAO_RETENCAO_HORAS * 3600)
+        atualizar_exportacao(
+            job_id, status='renderizando', total=len(nota_ids), danfes_a_gerar=len(faltando), task_montagem=task_montagem
+        )
+
+        tamanho = settings.NFE_EXPORTACAO_DANFES_POR_TASK
+        blocos = [faltando[inicio:inicio + tamanho] for inicio in range(0, len(faltando), tamanho)]
+        chord(
+            group([renderizar_danfes_exportacao_task.s(bloco, job_id) for bloco in blocos])
+        )(montar_zip_exportacao_task.s(job_id, nota_ids, incluir_danfe).set(task_id=task_montagem))
+
+        logger.info(f"[TASK] Exportação {job_id}: {len(nota_ids)} nota(s), {len(faltando)} DANFE(s) em {len(blocos)} bloco(s)")
+        return {'job_id': job_id, 'total': len(nota_ids), 'danfes_a_gerar': len(faltando)}
+
+    except Exception as e:
+        logger.error(f"[TASK] Erro na exportação {job_id}: {str(e)}", exc_info=True)
+        atualizar_exportacao(job_id, status='erro', erro=str(e))
+        raise
+
+
+@shared_task(name='nfe.tasks.renderizar_danfes_exportacao')
+def renderizar_danfes_exportacao_task(nota_ids, job_id):
+    """Gera os DANFEs de um bloco da exportação; falhas por nota vão para o resultado"""
+    notas = {nota.chave: nota for nota in NotaFiscal.objects.filter(id__in=nota_ids).only('id', 'empresa_id', 'chave', 'fileXml')}
+    gerados = renderizar_danfes([(nota.empresa_id, nota.chave, nota.fileXml.name) for nota in notas.values()])
+
+    erros = []
+    for chave, relativo, erro in gerados:
+        if erro:
+            erros.append({'chave': chave, 'erro': f'DANFE: {erro}'})
+        else:
+            registrar_danfe(notas[chave], relativo)
+
+    try:
+        cache.incr(f'exportacao_nfe_{job_id}_danfes', len(gerados))
+    except ValueError:
+        pass  # contador expirou: só o progresso deixa de ser informado
+
+    return {'gerados': len(gerados) - len(erros), 'erros': erros}
+
+
+@shared_task(name='nfe.tasks.montar_zip_exportacao')
+def montar_zip_exportacao_task(resultados_danfe, job_id, nota_ids, incluir_danfe):
+    """Callback do chord: monta o ZIP depois que todos os blocos de DANFE terminaram"""
+    erros_danfe = [erro for resultado in resultados_danfe for erro in resultado['erros']]
+    try:
+        return _montar_zip_exportacao(job_id, nota_ids, incluir_danfe, erros_danfe)
+    except Exception as e:
+        logger.error(f"[TASK] Erro ao montar o ZIP da exportação {job_id}: {str(e)}", exc_info=True)
+        atualizar_exportacao(job_id, status='erro', erro=str(e))
+        raise
+
+
+def _montar_zip_exportacao(job_id, nota_ids, incluir_danfe, erros_danfe):
+    atualizar_exportacao(job_id, status='compactando', concluidos=0)
+
+    def documentos():
+        # Notas lidas em blocos, na ordem da exportação
+        for inicio in range(0, len(nota_ids), 500):
+            bloco = nota_ids[inicio:inicio + 500]
+            notas = NotaFiscal.objects.only('id', 'empresa_id', 'chave', 'fileXml').in_bulk(bloco)
+            for nota_id in bloco:
+                nota = notas.get(nota_id)
+                if nota is None:
+                    continue
+                caminho_pdf = _caminho_danfe(nota.empresa_id, nota.chave, nota.fileXml.name) if incluir_danfe else None
+                yield nota.chave, nota.fileXml.name, caminho_pdf
+
+    def progresso(concluidos, resultado):
+        if concluidos % 500 == 0:
+            atualizar_exportacao(job_id, concluidos=concluidos)
+
+    resultado = escrever_zip(caminho_exportacao(job_id), documentos(), progresso=progresso)
+    resultado['erros'] = erros_danfe + resultado['erros']
+
+    atualizar_exportacao(job_id, status='concluido', concluidos=len(nota_ids), resultado=resultado)
+    logger.info(f"[TASK] Exportação {job_id} concluída: {resultado['xmls']} XML(s), "
+                f"{resultado['danfes']} DANFE(s), {len(resultado['erros'])} erro(s)")
+    return resultado
+
+
+@shared_task(name='nfe.tasks.expurgar_exportacoes_nfe')
+def expurgar_exportacoes_nfe_task():
+    """Apaga os ZIPs de exportação mais antigos que NFE_EXPORTACAO_RETENCAO_HORAS"""
+    diretorio = os.path.dirname(caminho_exportacao('_'))
+    if not os.path.isdir(diretorio):
+        return {"removidos": 0}
+
+    limite = time.time() - settings.NFE_EXPORTACAO_RETENCAO_HORAS * 3600
+    removidos = 0
+    for nome in os.listdir(diretorio):
+        caminho = os.path.join(diretorio, nome)
+        if os.path.isfile(caminho) and os.path.getmtime(caminho) < limite:
+            os.remove(caminho)
+            removidos += 1
+
+    logger.info(f"[TASK] Exportações de NFe: {removidos} arquivo(s) removido(s)")
+    return {"removidos": removidos}
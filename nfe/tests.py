@@ -1,3 +1,583 @@
-from django.test import TestCase
+import base64
+import gzip
+import os
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+import zipfile
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from lxml import etree
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from app.utils import arquivo_xml, danfe
+from app.utils.utils import CursorOpcionalPagination
+
+from empresa.models import CursorNSU, Empresa
+from nfe import models
+from nfe.processor.nfe_exportacao import escrever_zip
+from nfe.processor import nfe_lote_zip
+from nfe.processor.nfe_lote_zip import NFeLoteProcessor
+from nfe.processor.nfe_parser import (
+    CobrancaDados, PagamentoDados, extrair_dados_nfe, extrair_dados_nfe_arquivo, identificar_tipo_documento
+)
+from nfe.serializer import NfeListSerializer, NfeModelSerializer
+from nfe.tasks import (
+    _consultar_distribuicao_empresa, agendar_danfe, chave_cancelamento_lote, processar_lote_nfe_task
+)
+from nfe.views import NFeBaseView, ProcessarLoteNFeCancelarAPIView
+
+CHAVE_FIXTURE = '35250511222333000181550010000001231000001234'
+
+# procNFe com os casos que os extratores tratam de forma diferente: item sem
+# ICMS, ICMS40 sem vTotTrib, <vol/> vazio, pagamentos dentro de <cobr> e o
+# protNFe (ignorado) depois da NFe
+NFE_PROC = f"""<?xml version="1.0" encoding="UTF-8"?>
+<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">
+<NFe><infNFe Id="NFe{CHAVE_FIXTURE}" versao="4.00">
+<ide><cUF>35</cUF><natOp>VENDA</natOp><mod>55</mod><serie>1</serie><nNF>123</nNF>
+<dhEmi>2025-05-16T08:27:04-03:00</dhEmi><dhSaiEnt>2025-05-16T09:00:00-03:00</dhSaiEnt>
+<tpNF>1</tpNF><idDest>2</idDest><cMunFG>3550308</cMunFG><tpImp>1</tpImp><tpEmis>1</tpEmis><cDV>4</cDV>
+<tpAmb>1</tpAmb><finNFe>1</finNFe><indFinal>1</indFinal><indPres>9</indPres><indIntermed>0</indIntermed>
+<procEmi>0</procEmi><verProc>1.0</verProc></ide>
+<emit><CNPJ>11222333000181</CNPJ><xNome>EMITENTE FIXTURE LTDA</xNome><xFant>FIXTURE</xFant>
+<enderEmit><xLgr>RUA A</xLgr><nro>1</nro><xBairro>CENTRO</xBairro><cMun>3550308</cMun><xMun>SAO PAULO</xMun>
+<UF>SP</UF><CEP>01001000</CEP><cPais>1058</cPais><xPais>BRASIL</xPais><fone>1133334444</fone></enderEmit>
+<IE>111111111111</IE><CRT>3</CRT></emit>
+<dest><CNPJ>44555666000199</CNPJ><xNome>DESTINATARIO FIXTURE LTDA</xNome>
+<enderDest><xLgr>RUA B</xLgr><nro>2</nro><xCpl>SALA 3</xCpl><xBairro>CENTRO</xBairro><cMun>3304557</cMun>
+<xMun>RIO DE JANEIRO</xMun><UF>RJ</UF><CEP>20010000</CEP><cPais>1058</cPais><xPais>BRASIL</xPais></enderDest>
+<indIEDest>9</indIEDest></dest>
+<det nItem="1"><prod><cProd>P1</cProd><cEAN>SEM GTIN</cEAN><xProd>PRODUTO UM</xProd><NCM>84713012</NCM>
+<CFOP>6102</CFOP><uCom>UN</uCom><qCom>2.0000</qCom><vUnCom>10.5000</vUnCom><vProd>21.00</vProd>
+<uTrib>UN</uTrib><qTrib>2.0000</qTrib><vUnTrib>10.5000</vUnTrib><indTot>1</indTot></prod>
+<imposto><vTotTrib>3.15</vTotTrib><ICMS><ICMS00><orig>0</orig><CST>00</CST></ICMS00></ICMS></imposto></det>
+<det nItem="2"><prod><cProd>P2</cProd><xProd>PRODUTO DOIS</xProd><CFOP>6102</CFOP><qCom>1</qCom>
+<vUnCom>5.00</vUnCom><vProd>5.00</vProd><indTot>1</indTot></prod>
+<imposto><ICMS><ICMS40><orig>2</orig><CST>41</CST></ICMS40></ICMS></imposto></det>
+<det nItem="3"><prod><cProd>P3</cProd><xProd>SERVICO</xProd><vProd>4.00</vProd><indTot>0</indTot></prod>
+<imposto><ISSQN><vBC>4.00</vBC></ISSQN></imposto></det>
+<total><ICMSTot><vProd>30.00</vProd><vFrete>1.50</vFrete><vNF>31.50</vNF><vTotTrib>3.15</vTotTrib></ICMSTot></total>
+<transp><modFrete>1</modFrete><vol/></transp>
+<cobr><fat><nFat>123</nFat><vOrig>31.50</vOrig><vDesc>0.00</vDesc><vLiq>31.50</vLiq></fat>
+<pag><tPag>01</tPag><vPag>20.00</vPag></pag><pag><tPag>15</tPag><vPag>11.50</vPag></pag></cobr>
+</infNFe></NFe>
+<protNFe versao="4.00"><infProt><chNFe>{CHAVE_FIXTURE}</chNFe><nProt>135250000000001</nProt></infProt></protNFe>
+</nfeProc>""".encode('utf-8')
+
+
+class NfeSerializerQueryCountTests(TestCase):
+    """O número de queries por página não pode crescer com a quantidade de notas/itens"""
+
+    @classmethod
+    def setUpTestData(cls):
+        usuario = User.objects.create_user(username='nfe', password='nfe')
+        cls.empresa = Empresa.objects.create(
+            usuario=usuario, razao_social='Empresa NFe', documento='12345678000199',
+            uf='SP', senha='123', status='1'
+        )
+        for numero in range(5):
+            cls._criar_nota(numero)
+
+    @classmethod
+    def _criar_nota(cls, numero):
+        nota = models.NotaFiscal.objects.create(
+            empresa=cls.empresa, chave=f'{numero:044d}', versao='4.00', tpAmb=1
+        )
+        models.Ide.objects.create(nota_fiscal=nota, nNF=str(numero))
+        models.Emitente.objects.create(nota_fiscal=nota, CNPJ='11111111000111', CRT=1)
+        models.Destinatario.objects.create(nota_fiscal=nota, CNPJ='22222222000122')
+        models.Total.objects.create(nota_fiscal=nota, vNF=Decimal('10.00'))
+        models.Transporte.objects.create(nota_fiscal=nota, modFrete=9)
+        cobranca = models.Cobranca.objects.create(nota_fiscal=nota, nFat=str(numero))
+        for indice in range(3):
+            produto = models.Produto.objects.create(nota_fiscal=nota, nItem=indice + 1, indTot=1)
+            models.Imposto.objects.create(produto=produto, vTotTrib=Decimal('1.00'))
+            models.Pagamento.objects.create(cobranca=cobranca, tPag=1, vPag=Decimal('1.00'))
+
+    def test_listagem_usa_uma_query(self):
+        queryset = NfeListSerializer.otimizar_queryset(models.NotaFiscal.objects.order_by('id'))
+
+        with self.assertNumQueries(1):
+            data = NfeListSerializer(queryset, many=True).data
+
+        self.assertEqual(len(data), 5)
+        self.assertNotIn('produtos', data[0])
+        self.assertEqual(data[0]['total']['vNF'], '10.00')
+        self.assertEqual(data[0]['emitente']['CNPJ'], '11111111000111')
+
+    def test_detalhe_tem_custo_fixo(self):
+        queryset = NfeModelSerializer.otimizar_queryset(models.NotaFiscal.objects.order_by('id'))
+
+        # notas + one-to-ones (JOIN), produtos + imposto, pagamentos
+        with self.assertNumQueries(3):
+            data = NfeModelSerializer(queryset, many=True).data
+
+        self.assertEqual(len(data[0]['produtos']), 3)
+        self.assertIsNotNone(data[0]['produtos'][0]['imposto'])
+        self.assertEqual(len(data[0]['pagamentos']), 3)
+        self.assertEqual(data[0]['transporte']['modFrete'], 9)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Planos de execução dependem do PostgreSQL')
+class NfeIndexPlanTests(TestCase):
+    """
+    As consultas principais das listagens não podem cair em Seq Scan.
+
+    Com enable_seqscan = off o PostgreSQL só escolhe Seq Scan quando nenhum
+    índice atende a consulta; tabelas pequenas deixam de mascarar a falta do índice.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        usuario = User.objects.create_user(username='plano', password='plano')
+        cls.empresa = Empresa.objects.create(
+            usuario=usuario, razao_social='Empresa Plano', documento='98765432000199',
+            uf='SP', senha='123', status='1'
+        )
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertSemSeqScan(self, queryset, tabela):
+        plano = queryset.explain()
+        self.assertNotIn(f'Seq Scan on {tabela}', plano, plano)
+        return plano
+
+    def test_listagem_de_notas_usa_indice_parcial(self):
+        # Mesma consulta da listagem (matriz + filiais) montada pela view
+        queryset = NFeBaseView()._get_queryset_banco_default(self.empresa)
+        plano = self.assertSemSeqScan(queryset, 'nfe_notafiscal')
+        self.assertIn('nf_empresa_dhemi_id_ativa_idx', plano, plano)
+
+    def test_busca_por_chave_usa_trigram(self):
+        queryset = models.NotaFiscal.objects.filter(chave__icontains='3520')
+        self.assertSemSeqScan(queryset, 'nfe_notafiscal')
+
+    def test_busca_de_emitente_usa_trigram(self):
+        self.assertSemSeqScan(models.Emitente.objects.filter(xNome__icontains='comercio'), 'nfe_emitente')
+        self.assertSemSeqScan(models.Emitente.objects.filter(CNPJ__icontains='0001'), 'nfe_emitente')
+
+    def test_busca_de_produto_usa_trigram(self):
+        for campo in ('xProd', 'cProd', 'cEAN'):
+            queryset = models.Produto.objects.filter(**{f'{campo}__icontains': '789'})
+            self.assertSemSeqScan(queryset, 'nfe_produto')
+
+
+class CursorOpcionalPaginationTests(TestCase):
+    """Percorrer as páginas pelo cursor devolve cada nota uma única vez, na ordem da listagem"""
+
+    @classmethod
+    def setUpTestData(cls):
+        usuario = User.objects.create_user(username='cursor', password='cursor')
+        empresa = Empresa.objects.create(
+            usuario=usuario, razao_social='Empresa Cursor', documento='11222333000144',
+            uf='SP', senha='123', status='1'
+        )
+        agora = timezone.now()
+        for numero in range(12):
+            # Datas repetidas e notas sem dhEmi para exercitar o desempate por id
+            dh_emi = None if numero % 5 == 0 else agora - timedelta(days=numero // 3)
+            models.NotaFiscal.objects.create(
+                empresa=empresa, chave=f'{numero:044d}', versao='4.00', tpAmb=1, dhEmi=dh_emi
+            )
+
+    def _paginar(self, url):
+        paginator = CursorOpcionalPagination()
+        request = Request(APIRequestFactory().get(url))
+        view = SimpleNamespace(campos_cursor=('dhEmi', 'id'))
+        pagina = paginator.paginate_queryset(models.NotaFiscal.objects.all(), request, view)
+        return [nota.id for nota in pagina], paginator.get_next_link(), paginator.get_previous_link()
+
+    def test_percorre_todas_as_paginas(self):
+        # Ordem da listagem no PostgreSQL: notas sem dhEmi primeiro
+        esperado = list(
+            models.NotaFiscal.objects.order_by(F('dhEmi').desc(nulls_first=True), '-id').values_list('id', flat=True)
+        )
+
+        ids, proxima, anterior = self._paginar('/nfe/?paginacao=cursor&pageSize=5')
+        self.assertIsNone(anterior)
+        paginas = [ids]
+        while proxima:
+            ids, proxima, anterior = self._paginar(proxima)
+            paginas.append(ids)
+
+        self.assertEqual([nota_id for pagina in paginas for nota_id in pagina], esperado)
+        self.assertEqual([len(pagina) for pagina in paginas], [5, 5, 2])
+
+        # Voltando pelo previous chega-se à página anterior
+        ids, _, _ = self._paginar(anterior)
+        self.assertEqual(ids, paginas[1])
+
+
+class ArquivoXmlTests(SimpleTestCase):
+    """Acervo de XMLs: gzip por empresa, endereçado por conteúdo, lido descompactado"""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        configuracao = override_settings(MEDIA_ROOT=media.name)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+    def test_mesmo_conteudo_mesmo_arquivo_por_empresa(self):
+        xml = b'<nfeProc><NFe/></nfeProc>'
+
+        caminho = arquivo_xml.salvar_xml(1, xml)
+        self.assertEqual(arquivo_xml.salvar_xml(1, xml), caminho)
+        self.assertNotEqual(arquivo_xml.salvar_xml(2, xml), caminho)
+        self.assertTrue(caminho.endswith('.xml.gz'))
+        self.assertEqual(arquivo_xml.ler(caminho), xml)
+
+    def test_doc_zip_gravado_sem_recompactar(self):
+        doc_zip = gzip.compress(b'<resNFe/>')
+
+        caminho = arquivo_xml.salvar_gzip(1, doc_zip)
+        with open(arquivo_xml.caminho_absoluto(caminho), 'rb') as arquivo:
+            self.assertEqual(arquivo.read(), doc_zip)
+        self.assertEqual(b''.join(arquivo_xml.iterar(caminho, tamanho_bloco=3)), b'<resNFe/>')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DanfeAgendamentoTests(SimpleTestCase):
+    """DANFE: um PDF por versão do XML e uma única renderização enfileirada por vez"""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        configuracao = override_settings(MEDIA_ROOT=media.name)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+    def _nota(self, xml):
+        return SimpleNamespace(
+            id=1, empresa_id=1, chave=f'{1:044d}', fileXml=SimpleNamespace(name=arquivo_xml.salvar_xml(1, xml))
+        )
+
+    @mock.patch('nfe.tasks.gerar_danfe_task.delay')
+    def test_enfileira_uma_vez_e_serve_do_storage(self, delay):
+        nota = self._nota(b'<nfeProc versao="4.00"/>')
+
+        self.assertTrue(agendar_danfe(nota))
+        self.assertFalse(agendar_danfe(nota))
+        delay.assert_called_once_with(nota.id)
+
+        relativo = danfe.caminho_pdf(nota.empresa_id, nota.chave, nota.fileXml.name)
+        os.makedirs(os.path.dirname(arquivo_xml.caminho_absoluto(relativo)))
+        with open(arquivo_xml.caminho_absoluto(relativo), 'wb') as pdf:
+            pdf.write(b'%PDF-1.4')
+        self.assertTrue(danfe.existe(relativo))
+        self.assertFalse(agendar_danfe(nota))
+
+    def test_xml_diferente_gera_outro_pdf(self):
+        primeira = self._nota(b'<nfeProc versao="4.00"/>')
+        segunda = self._nota(b'<nfeProc versao="4.00"><protNFe/></nfeProc>')
+
+        self.assertNotEqual(
+            danfe.caminho_pdf(1, primeira.chave, primeira.fileXml.name),
+            danfe.caminho_pdf(1, segunda.chave, segunda.fileXml.name),
+        )
+
+
+class ExportacaoZipTests(SimpleTestCase):
+    """ZIP da exportação: XMLs descompactados do acervo, PDFs copiados, ausentes viram erro"""
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        configuracao = override_settings(MEDIA_ROOT=self.media.name)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+    def test_zip_com_xml_danfe_e_ausentes(self):
+        xml = b'<nfeProc versao="4.00"/>'
+        caminho_xml = arquivo_xml.salvar_xml(1, xml)
+        caminho_pdf = 'danfe/1/nota.pdf'
+        os.makedirs(os.path.dirname(arquivo_xml.caminho_absoluto(caminho_pdf)))
+        with open(arquivo_xml.caminho_absoluto(caminho_pdf), 'wb') as pdf:
+            pdf.write(b'%PDF-1.4')
+
+        destino = os.path.join(self.media.name, 'exportacoes', 'teste.zip')
+        resultado = escrever_zip(destino, [
+            ('A' * 44, caminho_xml, caminho_pdf),
+            ('B' * 44, 'xml/inexistente.xml', None),
+        ])
+
+        self.assertEqual((resultado['xmls'], resultado['danfes']), (1, 1))
+        self.assertEqual(resultado['erros'], [{'chave': 'B' * 44, 'erro': 'XML não encontrado'}])
+        with zipfile.ZipFile(destino) as zip_ref:
+            self.assertEqual(zip_ref.read(f"xml/{'A' * 44}.xml"), xml)
+            self.assertEqual(zip_ref.getinfo(f"danfe/{'A' * 44}.pdf").compress_type, zipfile.ZIP_STORED)
+        self.assertFalse(os.path.exists(f'{destino}.tmp'))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class LoteCancelamentoTests(SimpleTestCase):
+    """Cancelamento cooperativo: o worker (pool de threads) não mata a task, ela para sozinha"""
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        configuracao = override_settings(MEDIA_ROOT=self.media.name)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        self.addCleanup(cache.clear)
+
+        self.caminho_zip = os.path.join('lotes', 'lote.zip')
+        os.makedirs(os.path.join(self.media.name, 'lotes'))
+        with zipfile.ZipFile(os.path.join(self.media.name, self.caminho_zip), 'w') as arquivo:
+            arquivo.writestr('nota.xml', '<nfeProc versao="4.00"/>')
+
+    @mock.patch('nfe.tasks.Empresa.objects.get')
+    @mock.patch('nfe.tasks.NFeLoteProcessor.processar_zip_paralelo')
+    def test_task_para_no_bloco_seguinte_ao_pedido(self, processar_zip_paralelo, _):
+        def processar(progresso):
+            resultados = NFeLoteProcessor._resultados_vazios()
+            resultados['nfe_processadas'] = 3
+            progresso(3, 10, resultados)
+            cache.set(chave_cancelamento_lote('lote-1'), True)
+            progresso(5, 10, resultados)
+            raise AssertionError('o lote deveria ter parado')
+
+        processar_zip_paralelo.side_effect = processar
+
+        with mock.patch.object(processar_lote_nfe_task, 'update_state') as update_state:
+            resultado = processar_lote_nfe_task.apply(args=(1, 0, self.caminho_zip), task_id='lote-1')
+
+        self.assertEqual(resultado.state, 'IGNORED')
+        update_state.assert_called_with(state='CANCELADO', meta={
+            'status': 'Processamento cancelado pelo usuário',
+            'nfe_processadas': 3, 'eventos_processados': 0, 'resumos_processados': 0, 'erros': 0,
+        })
+        self.assertFalse(os.path.exists(os.path.join(self.media.name, self.caminho_zip)))
+
+    @mock.patch('nfe.views.current_app')
+    @mock.patch('nfe.views.AsyncResult')
+    def test_view_pede_cancelamento_sem_terminate(self, async_result, current_app):
+        async_result.return_value.state = 'PROGRESS'
+        cache.set('lote_nfe_task_lote-2', {'user_id': 1, 'caminho_zip': self.caminho_zip})
+
+        request = APIRequestFactory().post('/api/v1/nfes/processar-lote/cancelar/lote-2/')
+        force_authenticate(request, user=SimpleNamespace(id=1, is_superuser=False, is_authenticated=True))
+        resposta = ProcessarLoteNFeCancelarAPIView.as_view(permission_classes=())(request, task_id='lote-2')
+
+        self.assertEqual(resposta.status_code, 202)
+        self.assertTrue(cache.get(chave_cancelamento_lote('lote-2')))
+        current_app.control.revoke.assert_called_once_with('lote-2')
+        # Em execução: quem remove o ZIP é a própria task ao parar
+        self.assertTrue(os.path.exists(os.path.join(self.media.name, self.caminho_zip)))
+
+
+class NfeParserTests(SimpleTestCase):
+    """Leitura em árvore (ElementTree/lxml) e em streaming (iterparse) devolvem os mesmos dados"""
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        configuracao = override_settings(MEDIA_ROOT=self.media.name)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+    def _arquivo(self, nome, conteudo):
+        os.makedirs(os.path.join(self.media.name, 'xml'), exist_ok=True)
+        with open(os.path.join(self.media.name, 'xml', nome), 'wb') as arquivo:
+            arquivo.write(conteudo)
+        return os.path.join('xml', nome)
+
+    def test_extrai_a_nota_da_fixture(self):
+        dados = extrair_dados_nfe(ET.fromstring(NFE_PROC))
+
+        self.assertEqual((dados.chave, dados.versao), (CHAVE_FIXTURE, '4.00'))
+        self.assertEqual(dados.dhEmi, '2025-05-16T08:27:04-03:00')
+        self.assertEqual((dados.ide.nNF, dados.ide.idDest), ('123', 2))
+        self.assertEqual((dados.emitente.CNPJ, dados.emitente.fone), ('11222333000181', '1133334444'))
+        self.assertEqual((dados.destinatario.UF, dados.destinatario.xCpl), ('RJ', 'SALA 3'))
+
+        self.assertEqual([item.produto.nItem for item in dados.itens], [1, 2, 3])
+        self.assertEqual(dados.itens[0].imposto.vTotTrib, Decimal('3.15'))
+        self.assertEqual((dados.itens[1].imposto.CST, dados.itens[1].imposto.vTotTrib), ('41', Decimal('0')))
+        self.assertIsNone(dados.itens[2].imposto)
+
+        self.assertEqual((dados.total.vNF, dados.total.vICMS), (Decimal('31.50'), Decimal('0')))
+        self.assertEqual((dados.transporte.modFrete, dados.transporte.qVol), (1, None))
+        self.assertEqual(dados.cobranca, CobrancaDados(
+            nFat='123', vOrig=Decimal('31.50'), vDesc=Decimal('0.00'), vLiq=Decimal('31.50')
+        ))
+        self.assertEqual(dados.pagamentos, [
+            PagamentoDados(tPag='01', vPag=Decimal('20.00')), PagamentoDados(tPag='15', vPag=Decimal('11.50')),
+        ])
+
+    def test_arvore_e_streaming_iguais(self):
+        esperado = extrair_dados_nfe(ET.fromstring(NFE_PROC))
+
+        self.assertEqual(extrair_dados_nfe(etree.fromstring(NFE_PROC)), esperado)
+        self.assertEqual(extrair_dados_nfe_arquivo(self._arquivo('nota.xml', NFE_PROC)), esperado)
+        # Acervo compactado: descompactado em streaming durante a leitura
+        self.assertEqual(extrair_dados_nfe_arquivo(arquivo_xml.salvar_xml(1, NFE_PROC)), esperado)
+
+    def test_nfe_sem_protocolo_e_sem_cobranca(self):
+        # NFe avulsa (sem nfeProc) e sem <dest>/<cobr>: cobrança vazia nos dois caminhos
+        raiz = etree.fromstring(NFE_PROC)
+        nfe = raiz[0]
+        inf_nfe = nfe[0]
+        for tag in ('dest', 'cobr'):
+            inf_nfe.remove(inf_nfe.find(f'{{http://www.portalfiscal.inf.br/nfe}}{tag}'))
+        conteudo = etree.tostring(nfe)
+
+        esperado = extrair_dados_nfe(etree.fromstring(conteudo))
+        self.assertIsNone(esperado.destinatario)
+        self.assertEqual((esperado.cobranca, esperado.pagamentos), (CobrancaDados(), []))
+        self.assertEqual(extrair_dados_nfe_arquivo(self._arquivo('nfe.xml', conteudo)), esperado)
+
+    def test_identifica_tipo_pela_raiz(self):
+        res_evento = (
+            b'<resEvento xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.01">'
+            b'<chNFe>' + CHAVE_FIXTURE.encode() + b'</chNFe></resEvento>'
+        )
+
+        self.assertEqual(identificar_tipo_documento(self._arquivo('nota.xml', NFE_PROC)), 'nfeProc')
+        self.assertEqual(identificar_tipo_documento(arquivo_xml.salvar_xml(1, res_evento)), 'resEvento')
+
+        caminho_evento = self._arquivo('evento.xml', res_evento)
+        with self.assertRaisesMessage(ValueError, 'Tipo de XML não suportado: resEvento'):
+            extrair_dados_nfe_arquivo(caminho_evento)
+        with self.assertRaises(ValueError):
+            identificar_tipo_documento(self._arquivo('invalido.xml', b'nao e xml'))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DistribuicaoDocZipTests(TestCase):
+    """Um docZip corrompido na página vira erro do documento; o cursor de NSU avança mesmo assim"""
+
+    @classmethod
+    def setUpTestData(cls):
+        usuario = User.objects.create_user(username='distribuicao', password='distribuicao')
+        cls.empresa = Empresa.objects.create(
+            usuario=usuario, razao_social='Empresa Distribuicao', documento='55666777000188',
+            uf='SP', senha='123', status='1', nfe_hora_inicio=0, nfe_hora_fim=23,
+            file='certificados/distribuicao.pfx'
+        )
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        configuracao = override_settings(MEDIA_ROOT=self.media.name)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+        os.makedirs(os.path.join(self.media.name, 'certificados'))
+        with open(os.path.join(self.media.name, 'certificados', 'distribuicao.pfx'), 'wb') as certificado:
+            certificado.write(b'pfx')
+
+    @staticmethod
+    def _pagina(*documentos):
+        doc_zips = ''.join(
+            f'<docZip NSU="{nsu:015d}" schema="procEventoNFe_v1.00.xsd">{base64.b64encode(conteudo).decode()}</docZip>'
+            for nsu, conteudo in documentos
+        )
+        return SimpleNamespace(text=(
+            '<retDistDFeInt xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.01">'
+            '<tpAmb>1</tpAmb><cStat>138</cStat><xMotivo>Documento localizado</xMotivo>'
+            f'<ultNSU>{len(documentos):015d}</ultNSU><maxNSU>{len(documentos):015d}</maxNSU>'
+            f'<loteDistDFeInt>{doc_zips}</loteDistDFeInt></retDistDFeInt>'
+        ))
+
+    @mock.patch('nfe.tasks.EventoNFeProcessor')
+    @mock.patch('nfe.tasks.obter_comunicacao_sefaz')
+    def test_doczip_corrompido_nao_trava_o_cursor(self, obter_comunicacao_sefaz, evento_processor):
+        evento = gzip.compress(b'<procEventoNFe xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.00"/>')
+        obter_comunicacao_sefaz.return_value.consulta_distribuicao.return_value = self._pagina(
+            (1, evento),
+            (2, b'nao e gzip'),
+            (3, evento[:len(evento) // 2]),  # truncado
+        )
+
+        resultado = _consultar_distribuicao_empresa(self.empresa)
+
+        self.assertEqual(resultado['status'], 'sucesso')
+        self.assertEqual(CursorNSU.obter_nsu(self.empresa.id), 3)
+        erros = resultado['detalhe']['erros']
+        self.assertEqual(len(erros), 2, erros)
+        self.assertTrue(erros[0].startswith(f'Documento {2:015d}'))
+        self.assertTrue(erros[1].startswith(f'Documento {3:015d}'))
+        # Só o documento válido chega ao processor (e ao acervo)
+        self.assertEqual(evento_processor.call_count, 1)
+        evento_processor.gravar_lote.assert_called_once()
+
+
+class LoteZipParaleloTests(TransactionTestCase):
+    """Lote paralelo: pool de processos compartilhado (sem fork do worker) e um commit por bloco"""
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        configuracao = override_settings(MEDIA_ROOT=self.media.name)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        self.addCleanup(nfe_lote_zip._descartar_parsers, 2)
+
+        usuario = User.objects.create_user(username='lote', password='lote')
+        self.empresa = Empresa.objects.create(
+            usuario=usuario, razao_social='Empresa Lote', documento='66777888000199',
+            uf='SP', senha='123', status='1'
+        )
+
+    def _criar_zip(self):
+        caminho = os.path.join(self.media.name, 'lote.zip')
+        with zipfile.ZipFile(caminho, 'w') as arquivo:
+            arquivo.writestr('nota.xml', NFE_PROC)
+            arquivo.writestr('invalido.xml', b'nao e xml')
+            arquivo.writestr('outro.xml', b'<retConsSitNFe xmlns="http://www.portalfiscal.inf.br/nfe"/>')
+        return caminho
+
+    def test_classifica_no_pool_e_grava_o_bloco(self):
+        with open(self._criar_zip(), 'rb') as arquivo_zip:
+            resultados = NFeLoteProcessor(self.empresa, 0, arquivo_zip).processar_zip_paralelo(
+                processos=2, escritores=1, tamanho_bloco=10
+            )
+
+        self.assertEqual(resultados['nfe_processadas'], 1)
+        self.assertEqual(sorted(erro['arquivo'] for erro in resultados['erros']), ['invalido.xml', 'outro.xml'])
+        self.assertTrue(models.NotaFiscal.objects.filter(empresa=self.empresa, chave=CHAVE_FIXTURE).exists())
+
+        # Os lotes seguintes reaproveitam os mesmos filhos
+        parsers = nfe_lote_zip._obter_parsers(2)
+        with open(self._criar_zip(), 'rb') as arquivo_zip:
+            NFeLoteProcessor(self.empresa, 0, arquivo_zip).processar_zip_paralelo(processos=2, escritores=1)
+        self.assertIs(nfe_lote_zip._obter_parsers(2), parsers)
+        self.assertNotEqual(parsers._mp_context.get_start_method(), 'fork')
+
+    @override_settings(NFE_LOTE_PROCESSOS=2, NFE_LOTE_ESCRITORES=1)
+    def test_task_numa_thread_do_worker(self):
+        # Como no worker --pool=threads: a task roda fora da thread principal
+        # e o pool de classificação não pode nascer de um fork deste processo
+        caminho_zip = os.path.relpath(self._criar_zip(), self.media.name)
+        execucao = {}
+
+        def executar():
+            with mock.patch.object(processar_lote_nfe_task, 'update_state'):
+                execucao['resultado'] = processar_lote_nfe_task.apply(
+                    args=(self.empresa.id, 0, caminho_zip), task_id='lote-thread'
+                )
+
+        thread = threading.Thread(target=executar)
+        thread.start()
+        thread.join(timeout=60)
+
+        self.assertFalse(thread.is_alive())
+        resultado = execucao['resultado']
+        self.assertEqual(resultado.state, 'SUCCESS', resultado.result)
+        self.assertEqual(resultado.result['nfe_processadas'], 1)
+        self.assertNotEqual(nfe_lote_zip._obter_parsers(2)._mp_context.get_start_method(), 'fork')
+        self.assertFalse(os.path.exists(os.path.join(self.media.name, caminho_zip)))
@@ -8,8 +8,17 @@ urlpatterns = [
 
     # Importar notas ficais através de um arquivo .zip
     path('nfes/processar-lote/', views.ProcessarLoteNFeAPIView.as_view(), name='nfe-processar-lote'),
+    # Acompanhar / cancelar o processamento do lote (task Celery)
+    path('nfes/processar-lote/status/<str:task_id>/', views.ProcessarLoteNFeStatusAPIView.as_view(), name='nfe-processar-lote-status'),
+    path('nfes/processar-lote/cancelar/<str:task_id>/', views.ProcessarLoteNFeCancelarAPIView.as_view(), name='nfe-processar-lote-cancelar'),
     # Gerar danfe
     path('nfes/gerar-danfe/<int:pk>/', views.GerarDanfeAPIView.as_view(), name='nfe-gerar-danfe'),
+    # Baixar XML (descompactado do acervo)
+    path('nfes/baixar-xml/<int:pk>/', views.BaixarXmlNfeAPIView.as_view(), name='nfe-baixar-xml'),
+    # Exportar XMLs e DANFEs em ZIP (task Celery) e acompanhar / baixar
+    path('nfes/exportar/', views.ExportarNfeAPIView.as_view(), name='nfe-exportar'),
+    path('nfes/exportar/status/<str:job_id>/', views.ExportarNfeStatusAPIView.as_view(), name='nfe-exportar-status'),
+    path('nfes/exportar/baixar/<str:job_id>/', views.ExportarNfeBaixarAPIView.as_view(), name='nfe-exportar-baixar'),
 
     # Todas minhas notas matriz
     path('nfes/matriz/', views.NfeListMatrizAPIView.as_view(), name='nfe-matriz-list'),
@@ -1,15 +1,17 @@
 from drf_spectacular.utils import extend_schema_view, extend_schema, OpenApiExample, OpenApiResponse
 import os
-from pathlib import Path
+import uuid
+import zipfile
 
 from datetime import datetime
-from brazilfiscalreport.danfe import Danfe
 
 from django.db.models import Q
 
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db import connection
 from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
+from django.urls import reverse
 
 from rest_framework import generics, status, response
 from rest_framework.permissions import IsAuthenticated
@@ -17,22 +19,21 @@ from rest_framework.exceptions import PermissionDenied, NotFound, ValidationErro
 from rest_framework.views import APIView
 
 from . import models
-from app.utils import utils
+from app.utils import arquivo_xml, danfe, utils
 
 from empresa.models import (
-    Empresa, HistoricoNSU, Funcionario
+    Empresa, CursorNSU, Funcionario
 )
 from .filters import (
     NotaFiscalFilter, ProdutoFilter, FornecedorFilter
 )
 
 from nfe.serializer import (
-    NfeSerializer, NfeModelSerializer, ProdutoModelSerializer,
+    NfeSerializer, NfeModelSerializer, NfeListSerializer, ProdutoModelSerializer,
     EmitenteModelSerializer, NfeFaturamentoOutputSerializer,
     NfeFaturamentoMesOutputSerializer, NfeProdutosOutputSerializer
 )
 from nfe.processor.nfe_processor import NFeProcessor
-from nfe.processor.nfe_lote_zip import NFeLoteProcessor
 
 from app.permissions import PodeAcessarRotasFuncionario
 
@@ -43,6 +44,7 @@ from db_allnube_empresa.models import (
     NotaFiscalFlat, ProdutoFlat
 )
 from db_allnube_empresa.utils.database_utils import DatabaseManager
+from db_allnube_empresa.utils.leitura_federada import ConsultaFederada, FiltroFederadoMixin
 from db_allnube_empresa.filters import (
     NotaFiscalFilterFlat, ProdutoFilterFlat
 )
@@ -50,14 +52,21 @@ from db_allnube_empresa.serializer import (
     NfeFlatSerializer, NfeFlatModelSerializer, ProdutoFlatModelSerializer
 )
 
+from celery import current_app
 from celery.result import AsyncResult
 from django.core.cache import cache
-from nfe.tasks import automatizar_nfe_task
+from nfe.tasks import (
+    agendar_danfe, atualizar_exportacao, automatizar_nfe_task, caminho_exportacao, chave_cancelamento_lote,
+    exportar_nfes_task, processar_lote_nfe_task, registrar_danfe
+)
 from rest_framework.response import Response
 
-class NFeBaseView:
+class NFeBaseView(FiltroFederadoMixin):
     """Classe base com configurações comuns"""
 
+    # Listagens usam a representação enxuta; o detalhe carrega a árvore completa
+    detalhar_nota = False
+
     def get_permissions(self):
         return [IsAuthenticated(), PodeAcessarRotasFuncionario()]
 
@@ -106,12 +115,18 @@ class NFeBaseView:
         Retorna o queryset do banco DEFAULT (modelos normais)
         """
         try:
-            # Funcionário ativo + empresa / filial ativa → retorna notas
-            return models.NotaFiscal.objects.filter(
-                Q(empresa_id=empresa.id) |  # Notas da matriz
-                Q(empresa__matriz_filial_id=empresa.id),  # Notas das filiais
+            # Funcionário ativo + empresa / filial ativa → retorna notas.
+            # Matriz e filiais por subquery de ids (e não OR sobre o join com empresa):
+            # assim cada empresa é lida pelo índice parcial nf_empresa_dhemi_id_ativa_idx
+            empresas_ids = Empresa.objects.filter(
+                Q(pk=empresa.id) | Q(matriz_filial_id=empresa.id)
+            ).values('id')
+            queryset = models.NotaFiscal.objects.filter(
+                empresa_id__in=empresas_ids,
                 deleted_at__isnull=True
-            ).order_by('-dhEmi')
+            ).order_by('-dhEmi', '-id')
+            serializer_default = NfeModelSerializer if self.detalhar_nota else NfeListSerializer
+            return serializer_default.otimizar_queryset(queryset)
         except Exception as e:
             print(f"Erro ao buscar queryset banco default: {e}")
             return models.NotaFiscal.objects.none()
@@ -119,15 +134,32 @@ class NFeBaseView:
     def _get_queryset_banco_empresa(self, empresa):
         """
         Retorna o queryset do banco da EMPRESA (modelos flat)
+        Filiais com banco próprio são lidas em paralelo (ConsultaFederada);
+        no detalhe, só o banco que tem a nota
         """
         try:
             # Configura e usa o banco da empresa
             if DatabaseManager.usar_banco_empresa(empresa.id):
-                # Agora as queries vão para o banco da empresa
-                return NotaFiscalFlat.objects.filter(
-                    empresa_id=empresa.id,
-                    deleted_at__isnull=True
-                ).order_by('-dhEmi')
+                filiais_ids = list(Empresa.objects.filter(
+                    matriz_filial_id=empresa.id,
+                    status='1'
+                ).values_list('id', flat=True))
+
+                # Agora as queries vão para o(s) banco(s) da matriz e das filiais
+                consulta = ConsultaFederada.da_matriz(
+                    NotaFiscalFlat, empresa.id, filiais_ids,
+                    lambda queryset, empresas_ids: queryset.filter(
+                        empresa_id__in=empresas_ids,
+                        deleted_at__isnull=True
+                    ),
+                    ordenacao=('-dhEmi', '-id'),
+                )
+
+                # Detalhe/edição: get_object precisa do queryset do banco que tem a nota
+                if self.detalhar_nota and consulta.multiplos_bancos:
+                    lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+                    return consulta.banco_de(**{self.lookup_field: self.kwargs.get(lookup_url_kwarg)})
+                return consulta.simplificar()
             else:
                 # Se não conseguiu conectar no banco da empresa, retorna vazio
                 return NotaFiscalFlat.objects.none()
@@ -255,7 +287,7 @@ class NFeBaseView:
             )
         ],
         responses={
-            200: NfeModelSerializer(many=True),
+            200: NfeListSerializer(many=True),
             401: OpenApiTypes.OBJECT,
             403: OpenApiTypes.OBJECT
         },
@@ -595,7 +627,8 @@ class NFeBaseView:
 )
 class NfeListCreateAPIView(NFeBaseView, generics.ListCreateAPIView):
     filter_backends = [DjangoFilterBackend]
-    pagination_class = utils.CustomPageSizePagination
+    pagination_class = utils.CursorOpcionalPagination
+    campos_cursor = ('dhEmi', 'id')
     # filterset_class = NotaFiscalFilter
 
     def _usando_banco_empresa(self):
@@ -632,11 +665,11 @@ class NfeListCreateAPIView(NFeBaseView, generics.ListCreateAPIView):
                 if self._usando_banco_empresa():
                     return NfeFlatModelSerializer
                 else:
-                    return NfeModelSerializer
+                    return NfeListSerializer
         except Exception as e:
             print(f"Erro ao determinar serializer: {e}")
             # Fallback para serializer padrão
-            return NfeModelSerializer if self.request.method == 'GET' else NfeSerializer
+            return NfeListSerializer if self.request.method == 'GET' else NfeSerializer
 
     def post(self, request, *args, **kwargs):
         try:
@@ -687,10 +720,14 @@ class NfeListCreateAPIView(NFeBaseView, generics.ListCreateAPIView):
         description="""
         Processa um lote de arquivos XML de NFe, Eventos e Resumos contidos em um arquivo ZIP.
 
+        O processamento é assíncrono: o ZIP é armazenado e uma task Celery é enfileirada.
+        Acompanhe o andamento em `nfes/processar-lote/status/<task_id>/` e cancele em
+        `nfes/processar-lote/cancelar/<task_id>/`.
+
         ## Funcionalidades
         - Processa automaticamente diferentes tipos de XML (NFe, Eventos, Resumos)
         - Atualiza o NSU (Número Sequencial Único) da empresa
-        - Retorna estatísticas detalhadas do processamento
+        - Progresso (arquivos concluídos / total e contadores por tipo) via endpoint de status
 
         ## Tipos de XML Suportados
         - **nfeProc**: Notas Fiscais Eletrônicas
@@ -700,10 +737,9 @@ class NfeListCreateAPIView(NFeBaseView, generics.ListCreateAPIView):
         ## Fluxo de Processamento
         1. Validação dos dados de entrada
         2. Verificação de permissões da empresa
-        3. Extração do arquivo ZIP
-        4. Processamento de cada XML individualmente
-        5. Roteamento para o processador específico
-        6. Retorno dos resultados consolidados
+        3. Armazenamento do arquivo ZIP e enfileiramento da task
+        4. (task) Processamento de cada XML e roteamento para o processador específico
+        5. (task) Resultados consolidados disponíveis no endpoint de status
         """,
         request={
             'multipart/form-data': {
@@ -724,7 +760,7 @@ class NfeListCreateAPIView(NFeBaseView, generics.ListCreateAPIView):
             }
         },
         responses={
-            201: OpenApiTypes.OBJECT,
+            202: OpenApiTypes.OBJECT,
             400: OpenApiTypes.OBJECT,
             403: OpenApiTypes.OBJECT,
             404: OpenApiTypes.OBJECT,
@@ -734,16 +770,12 @@ class NfeListCreateAPIView(NFeBaseView, generics.ListCreateAPIView):
             OpenApiExample(
                 'Sucesso',
                 value={
-                    'mensagem': 'Processamento concluído com sucesso',
-                    'resultados': {
-                        'nfe_processadas': 5,
-                        'eventos_processados': 2,
-                        'resumos_processados': 3,
-                        'erros': []
-                    }
+                    'task_id': '0f9c3a52-6a41-4a4e-9a4f-7f1c2a7d9b10',
+                    'status': 'processing',
+                    'mensagem': 'Processamento do lote iniciado em background'
                 },
                 response_only=True,
-                status_codes=['201']
+                status_codes=['202']
             ),
             OpenApiExample(
                 'Empresa obrigatória',
@@ -757,6 +789,12 @@ class NfeListCreateAPIView(NFeBaseView, generics.ListCreateAPIView):
                 response_only=True,
                 status_codes=['400']
             ),
+            OpenApiExample(
+                'Arquivo inválido',
+                value={'error': 'arquivo_zip não é um arquivo ZIP válido'},
+                response_only=True,
+                status_codes=['400']
+            ),
             OpenApiExample(
                 'Empresa não encontrada',
                 value={'error': 'Empresa com ID 999 não encontrada'},
@@ -799,6 +837,12 @@ class ProcessarLoteNFeAPIView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
+            if not zipfile.is_zipfile(arquivo_zip):
+                return response.Response(
+                    {'error': 'arquivo_zip não é um arquivo ZIP válido'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
             # Busca e validação da empresa
             empresa = Empresa.objects.get(pk=empresa_id)
 
@@ -815,16 +859,25 @@ class ProcessarLoteNFeAPIView(APIView):
                 )
 
             # Pegar o último NSU
-            historyNsu = HistoricoNSU.objects.filter(empresa=empresa).order_by('-id').first()
-            nsu_inicial = historyNsu.nsu if historyNsu else 0
+            nsu_inicial = CursorNSU.obter_nsu(empresa.id)
+
+            # Armazena o ZIP para a task (o upload deixa de existir ao fim da requisição)
+            caminho_zip = self._salvar_zip(arquivo_zip)
+
+            task = processar_lote_nfe_task.delay(empresa.id, nsu_inicial, caminho_zip)
 
-            # Processar o arquivo ZIP
-            resultados = NFeLoteProcessor(empresa, nsu_inicial, arquivo_zip).processar_zip()
+            # Dono da task: usado pelos endpoints de status/cancelamento
+            cache.set(f'lote_nfe_task_{task.id}', {
+                'user_id': request.user.id,
+                'empresa_id': empresa.id,
+                'caminho_zip': caminho_zip
+            }, timeout=86400)
 
             return response.Response({
-                'mensagem': 'Processamento concluído com sucesso',
-                'resultados': resultados
-            }, status=status.HTTP_201_CREATED)
+                'task_id': task.id,
+                'status': 'processing',
+                'mensagem': 'Processamento do lote iniciado em background'
+            }, status=status.HTTP_202_ACCEPTED)
 
         except Empresa.DoesNotExist:
             return response.Response(
@@ -842,6 +895,205 @@ class ProcessarLoteNFeAPIView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @staticmethod
+    def _salvar_zip(arquivo_zip):
+        """Salva o ZIP enviado em MEDIA_ROOT/lotes e retorna o caminho relativo"""
+        lotes_dir = os.path.join(settings.MEDIA_ROOT, 'lotes')
+        os.makedirs(lotes_dir, exist_ok=True)
+
+        caminho_relativo = os.path.join('lotes', f'{uuid.uuid4().hex}.zip')
+        with open(os.path.join(settings.MEDIA_ROOT, caminho_relativo), 'wb') as f:
+            for chunk in arquivo_zip.chunks():
+                f.write(chunk)
+
+        return caminho_relativo
+
+
+def _usuario_acessa_empresa(empresa, usuario):
+    """Dono da empresa, funcionário ativo dela ou superusuário/staff"""
+    try:
+        # Verifica se o usuário é dono direto da empresa
+        if empresa.usuario == usuario:
+            return True
+
+        # Verifica se o usuário é funcionário da empresa
+        funcionario_exists = Funcionario.objects.filter(
+            user=usuario,
+            empresa=empresa,
+            status='1'  # Ativo
+        ).exists()
+
+        if funcionario_exists:
+            return True
+
+        # Verifica se o usuário é superusuário/staff (acesso total)
+        if usuario.is_superuser or usuario.is_staff:
+            return True
+
+        return False
+
+    except (AttributeError, Empresa.DoesNotExist, Funcionario.DoesNotExist):
+        return False
+
+
+def _obter_task_lote(request, task_id):
+    """Retorna os dados da task de lote se ela pertencer ao usuário, senão None"""
+    dados_task = cache.get(f'lote_nfe_task_{task_id}')
+    if not dados_task:
+        return None
+
+    if not request.user.is_superuser and dados_task['user_id'] != request.user.id:
+        return None
+
+    return dados_task
+
+
+@extend_schema_view(
+    get=extend_schema(
+        tags=["[Allnube] NF"],
+        operation_id="02_processar_lote_nfe_status",
+        summary='02 Status do processamento de lote de NFe',
+        description="""
+        Consulta o andamento de um lote enviado em `nfes/processar-lote/`.
+
+        Enquanto a task está em execução (`PROGRESS`), `progress` traz os arquivos
+        concluídos / total e os contadores por tipo. Ao terminar, `result` traz o
+        mesmo resumo do processamento (`nfe_processadas`, `eventos_processados`,
+        `resumos_processados`, `erros`).
+        """,
+        responses={
+            200: OpenApiTypes.OBJECT,
+            404: OpenApiTypes.OBJECT
+        },
+        examples=[
+            OpenApiExample(
+                'Em andamento',
+                value={
+                    'task_id': '0f9c3a52-6a41-4a4e-9a4f-7f1c2a7d9b10',
+                    'status': 'PROGRESS',
+                    'ready': False,
+                    'successful': None,
+                    'failed': None,
+                    'progress': {
+                        'current': 400,
+                        'total': 1000,
+                        'status': 'Processando arquivos (400/1000)...',
+                        'nfe_processadas': 350,
+                        'eventos_processados': 20,
+                        'resumos_processados': 28,
+                        'erros': 2
+                    }
+                },
+                response_only=True,
+                status_codes=['200']
+            ),
+        ]
+    )
+)
+class ProcessarLoteNFeStatusAPIView(APIView):
+    """
+    Consulta status de uma task de processamento de lote
+    """
+    permission_classes = (IsAuthenticated, PodeAcessarRotasFuncionario)
+
+    def get(self, request, task_id):
+        if not _obter_task_lote(request, task_id):
+            return response.Response({'error': 'Task não encontrada'}, status=status.HTTP_404_NOT_FOUND)
+
+        task = AsyncResult(task_id)
+
+        result = {
+            "task_id": task_id,
+            "status": task.status,
+            "ready": task.ready(),
+            "successful": task.successful() if task.ready() else None,
+            "failed": task.failed() if task.ready() else None,
+        }
+
+        if task.ready():
+            if task.successful():
+                result["result"] = task.result
+            else:
+                result["error"] = str(task.info)
+        elif task.state == 'PROGRESS':
+            result["progress"] = task.info
+        elif task.state == 'CANCELADO':
+            result["cancelled"] = task.info
+        else:
+            # Resultado pode estar no cache mesmo com o backend sem o estado final
+            cached_result = cache.get(f'lote_nfe_result_{task_id}')
+            if cached_result:
+                result["partial_result"] = cached_result
+
+        return response.Response(result)
+
+
+@extend_schema_view(
+    post=extend_schema(
+        tags=["[Allnube] NF"],
+        operation_id="02_processar_lote_nfe_cancelar",
+        summary='02 Cancelar processamento de lote de NFe',
+        description="""
+        Solicita o cancelamento de um lote ainda pendente ou em execução. Um lote
+        pendente não chega a ser processado; um lote em execução para ao terminar
+        de gravar o bloco atual e passa ao estado `CANCELADO` (acompanhe em
+        `nfes/processar-lote/status/`). Os XMLs já gravados até lá permanecem no
+        sistema.
+        """,
+        request=None,
+        responses={
+            202: OpenApiTypes.OBJECT,
+            400: OpenApiTypes.OBJECT,
+            404: OpenApiTypes.OBJECT
+        }
+    )
+)
+class ProcessarLoteNFeCancelarAPIView(APIView):
+    """
+    Cancela uma task de processamento de lote em andamento
+    """
+    permission_classes = (IsAuthenticated, PodeAcessarRotasFuncionario)
+
+    def post(self, request, task_id):
+        dados_task = _obter_task_lote(request, task_id)
+        if not dados_task:
+            return response.Response({'error': 'Task não encontrada'}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            task = AsyncResult(task_id)
+
+            # Verifica se a task ainda está pendente ou em progresso
+            if task.state in ['PENDING', 'STARTED', 'RETRY', 'PROGRESS']:
+                # O worker roda com --pool=threads: revoke(terminate=True) não interrompe a
+                # execução. A task confere esta flag a cada bloco gravado e para sozinha.
+                cache.set(chave_cancelamento_lote(task_id), True, timeout=3600)
+
+                # Ainda na fila: o worker descarta a task revogada sem executá-la,
+                # então o finally que remove o ZIP não roda
+                current_app.control.revoke(task_id)
+                if task.state == 'PENDING':
+                    caminho_zip = os.path.join(settings.MEDIA_ROOT, dados_task['caminho_zip'])
+                    if os.path.exists(caminho_zip):
+                        os.remove(caminho_zip)
+
+                return response.Response({
+                    "message": f"Cancelamento da task {task_id} solicitado",
+                    "task_id": task_id,
+                    "state": task.state
+                }, status=status.HTTP_202_ACCEPTED)
+            else:
+                return response.Response({
+                    "message": f"Task {task_id} não pode ser cancelada (estado: {task.state})",
+                    "task_id": task_id,
+                    "state": task.state
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+        except Exception as e:
+            return response.Response(
+                {"error": f"Erro ao cancelar task: {str(e)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
 
 @extend_schema_view(
     get=extend_schema(
@@ -852,43 +1104,50 @@ class ProcessarLoteNFeAPIView(APIView):
         Gera o Documento Auxiliar da Nota Fiscal Eletrônica (DANFE) em formato PDF a partir do XML da NFe.
 
         ## Funcionalidades
-        - Gera PDF da DANFE a partir do XML da nota fiscal
-        - Verifica se o PDF já foi gerado anteriormente (evita reprocessamento)
+        - O PDF é renderizado em background (Celery) uma única vez por versão do XML
+        - Chamadas seguintes servem o PDF direto do storage
         - Valida se a nota fiscal pertence à empresa do usuário logado
-        - Salva o PDF gerado no sistema de arquivos
         - Atualiza o registro da nota fiscal com o caminho do PDF
 
         ## Fluxo de Processamento
         1. Busca a nota fiscal pelo ID
         2. Valida se a nota pertence à empresa do usuário logado
         3. Verifica se o XML existe
-        4. Checa se o PDF já foi gerado anteriormente
-        5. Gera o PDF usando a biblioteca Danfe
-        6. Salva o caminho do PDF no registro da nota
-        7. Retorna a URL para download do PDF
+        4. Se o PDF desta versão do XML já existe, retorna 200 com a URL
+        5. Senão, enfileira a renderização e retorna 202
+        6. O cliente repete a chamada até receber 200 (ou 500 se a renderização falhar)
+
+        ## Pré-renderização
+        Empresas com `nfe_pre_renderizar_danfe` têm o DANFE gerado assim que a
+        NFe chega pela distribuição DF-e.
 
         ## Requisitos
         - O XML da nota fiscal deve estar salvo no sistema
         - A nota fiscal deve pertencer à empresa do usuário logado
-        - A biblioteca Danfe deve estar instalada e configurada
         """,
         responses={
             200: OpenApiResponse(
                 response=OpenApiTypes.OBJECT,
-                description='DANFE gerado com sucesso ou já existente',
+                description='DANFE pronto no storage',
                 examples=[
                     OpenApiExample(
-                        'DANFE gerado com sucesso',
+                        'DANFE já existente',
                         value={
-                            'message': 'DANFE gerado com sucesso!',
-                            'pdf_path': 'https://exemplo.com/media/danfe/NFe123456789.pdf'
+                            'message': 'DANFE já gerado anteriormente.',
+                            'pdf_path': 'https://exemplo.com/media/danfe/1/35250112345678000190550010000000011000000019-3f2a9c1b7d4e6a80.pdf'
                         }
-                    ),
+                    )
+                ]
+            ),
+            202: OpenApiResponse(
+                response=OpenApiTypes.OBJECT,
+                description='DANFE em geração; consultar novamente',
+                examples=[
                     OpenApiExample(
-                        'DANFE já existente',
+                        'DANFE em geração',
                         value={
-                            'message': 'DANFE já gerado anteriormente.',
-                            'pdf_path': 'https://exemplo.com/media/danfe/NFe123456789.pdf'
+                            'message': 'DANFE em geração. Consulte novamente em alguns segundos.',
+                            'status': 'processing'
                         }
                     )
                 ]
@@ -976,40 +1235,37 @@ class GerarDanfeAPIView(generics.RetrieveAPIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        try:
-            # Corrige possíveis barras invertidas salvas incorretamente no caminho
-            xml_file_name = nota_fiscal.fileXml.name.replace('\\', '/')
-            xml_file_path = os.path.join(settings.MEDIA_ROOT, xml_file_name)
+        if not os.path.exists(arquivo_xml.caminho_absoluto(nota_fiscal.fileXml.name)):
+            return response.Response(
+                {'error': f'Arquivo XML não encontrado no caminho: {nota_fiscal.fileXml.name}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-            # Verifica se já existe PDF gerado e válido
-            if nota_fiscal.filePdf and nota_fiscal.filePdf.path and os.path.exists(nota_fiscal.filePdf.path):
+        try:
+            # PDF desta versão do XML já no storage: serve direto, sem renderizar
+            pdf_relativo = danfe.caminho_pdf(nota_fiscal.empresa_id, nota_fiscal.chave, nota_fiscal.fileXml.name)
+            if danfe.existe(pdf_relativo):
+                if nota_fiscal.filePdf.name != pdf_relativo:
+                    registrar_danfe(nota_fiscal, pdf_relativo)
                 return response.Response({
                     'message': 'DANFE já gerado anteriormente.',
                     'pdf_path': request.build_absolute_uri(nota_fiscal.filePdf.url)
                 }, status=status.HTTP_200_OK)
 
-            # Gera o PDF
-            pdf_path = self._gerar_danfe_pdf(xml_file_path, pasta_saida='media/danfe')
-
-            # Resolve os caminhos para salvar no FileField
-            pdf_path_absolute = Path(os.path.abspath(pdf_path))
-            media_root_path = Path(settings.MEDIA_ROOT).resolve()
-            relative_path = pdf_path_absolute.relative_to(media_root_path)
-
-            # Salva o novo caminho do PDF no objeto
-            nota_fiscal.filePdf.name = str(relative_path)
-            nota_fiscal.save()
+            # Falha da última renderização: informa uma vez; a próxima chamada tenta de novo
+            erro = cache.get(danfe.chave_erro(pdf_relativo))
+            if erro:
+                cache.delete(danfe.chave_erro(pdf_relativo))
+                return response.Response(
+                    {'error': f'Erro durante a geração do DANFE: {erro}'},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
 
+            agendar_danfe(nota_fiscal, pdf_relativo)
             return response.Response({
-                'message': 'DANFE gerado com sucesso!',
-                'pdf_path': request.build_absolute_uri(nota_fiscal.filePdf.url)
-            }, status=status.HTTP_200_OK)
-
-        except FileNotFoundError as fnf:
-            return response.Response(
-                {'error': f'Arquivo XML não encontrado no caminho: {xml_file_path}'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+                'message': 'DANFE em geração. Consulte novamente em alguns segundos.',
+                'status': 'processing'
+            }, status=status.HTTP_202_ACCEPTED)
 
         except Exception as e:
             return response.Response(
@@ -1033,59 +1289,239 @@ class GerarDanfeAPIView(generics.RetrieveAPIView):
         Returns:
             bool: True se a nota pertence à empresa do usuário, False caso contrário
         """
+        return _usuario_acessa_empresa(nota_fiscal.empresa, usuario)
+
+
+@extend_schema_view(
+    get=extend_schema(
+        tags=["[Allnube] NF"],
+        operation_id='03_baixar_xml',
+        summary='03 Baixar XML',
+        description="""
+        Baixa o XML da NFe. Os XMLs ficam compactados no acervo e são
+        descompactados em streaming durante o download.
+        """,
+        responses={
+            200: OpenApiResponse(response=OpenApiTypes.BINARY, description='XML da nota fiscal'),
+            400: OpenApiResponse(response=OpenApiTypes.OBJECT, description='Nota sem XML'),
+            403: OpenApiResponse(response=OpenApiTypes.OBJECT, description='Acesso não autorizado'),
+        }
+    )
+)
+class BaixarXmlNfeAPIView(GerarDanfeAPIView):
+    """Mesmas validações de acesso do DANFE"""
+
+    def get(self, request, *args, **kwargs):
+        nota_fiscal = self.get_object()
+
+        verificaEmpresa = utils.verificaRestricaoAdministrativa(nota_fiscal.empresa, 3)
+        if not verificaEmpresa:
+            raise PermissionDenied(
+                detail="A empresa vinculada à sua conta está desativada, contate um administrador."
+            )
+
+        if not self._validar_empresa_usuario(nota_fiscal, request.user):
+            return response.Response(
+                {'error': 'Você não tem permissão para acessar esta nota fiscal.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        if not nota_fiscal.fileXml or not os.path.exists(arquivo_xml.caminho_absoluto(nota_fiscal.fileXml.name)):
+            return response.Response(
+                {'error': 'Arquivo XML não encontrado.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        resposta = StreamingHttpResponse(
+            arquivo_xml.iterar(nota_fiscal.fileXml.name), content_type='application/xml'
+        )
+        resposta['Content-Disposition'] = f'attachment; filename="{nota_fiscal.chave}.xml"'
+        return resposta
+
+
+def _obter_exportacao(request, job_id):
+    """Estado da exportação se ela pertencer ao usuário, senão None"""
+    estado = cache.get(f'exportacao_nfe_{job_id}')
+    if not estado:
+        return None
+
+    if not request.user.is_superuser and estado['user_id'] != request.user.id:
+        return None
+
+    return estado
+
+
+@extend_schema_view(
+    post=extend_schema(
+        tags=["[Allnube] NF"],
+        operation_id='03_exportar_nfes',
+        summary='03 Exportar XMLs e DANFEs (ZIP)',
+        description="""
+        Inicia a exportação em ZIP dos XMLs (e, por padrão, dos DANFEs) das notas
+        de uma empresa. Aceita os mesmos filtros da listagem de notas
+        (`dhEmi_after`, `dhEmi_before`, `emitente_CNPJ`, `emitente_xNome`, `chave`, `q`...).
+
+        Os DANFEs que ainda não existem são gerados em paralelo pelos workers e o
+        ZIP é montado em seguida. Acompanhe em `nfes/exportar/status/<job_id>/` e
+        baixe em `nfes/exportar/baixar/<job_id>/` quando o status for `concluido`.
+        """,
+        request={
+            'application/json': {
+                'type': 'object',
+                'properties': {
+                    'empresa_id': {'type': 'integer'},
+                    'incluir_danfe': {'type': 'boolean', 'default': True},
+                    'dhEmi_after': {'type': 'string', 'format': 'date'},
+                    'dhEmi_before': {'type': 'string', 'format': 'date'},
+                    'emitente_CNPJ': {'type': 'string'},
+                },
+                'required': ['empresa_id'],
+            }
+        },
+        responses={
+            202: OpenApiResponse(
+                response=OpenApiTypes.OBJECT,
+                description='Exportação iniciada',
+                examples=[
+                    OpenApiExample(
+                        'Exportação iniciada',
+                        value={
+                            'job_id': '5f0c7c1e9a8b4d2f8e6a1b3c4d5e6f70',
+                            'status': 'processing',
+                            'mensagem': 'Exportação iniciada em background'
+                        }
+                    )
+                ]
+            ),
+            400: OpenApiTypes.OBJECT,
+            403: OpenApiTypes.OBJECT,
+            404: OpenApiTypes.OBJECT,
+        }
+    )
+)
+class ExportarNfeAPIView(APIView):
+    permission_classes = (IsAuthenticated, PodeAcessarRotasFuncionario)
+    CAMPOS_CONTROLE = ('empresa_id', 'incluir_danfe')
+
+    def post(self, request, *args, **kwargs):
+        empresa_id = request.data.get('empresa_id')
+        if not empresa_id:
+            return response.Response({'error': 'empresa_id é obrigatório'}, status=status.HTTP_400_BAD_REQUEST)
+
         try:
-            # Verifica se o usuário é dono direto da empresa da nota fiscal
-            if nota_fiscal.empresa.usuario == usuario:
-                return True
+            empresa = Empresa.objects.get(pk=empresa_id)
+        except (Empresa.DoesNotExist, ValueError):
+            return response.Response(
+                {'error': f'Empresa com ID {empresa_id} não encontrada'},
+                status=status.HTTP_404_NOT_FOUND
+            )
 
-            # Verifica se o usuário é funcionário da empresa da nota fiscal
-            funcionario_exists = Funcionario.objects.filter(
-                user=usuario,
-                empresa=nota_fiscal.empresa,
-                status='1'  # Ativo
-            ).exists()
+        if not _usuario_acessa_empresa(empresa, request.user):
+            return response.Response(
+                {'error': 'Você não tem permissão para exportar as notas desta empresa.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
 
-            if funcionario_exists:
-                return True
+        if not utils.verificaRestricaoAdministrativa(empresa.id, 3):
+            raise PermissionDenied(
+                detail="A empresa vinculada à sua conta está desativada, contate um administrador."
+            )
 
-            # Verifica se o usuário é superusuário/staff (acesso total)
-            if usuario.is_superuser or usuario.is_staff:
-                return True
+        # Filtros da listagem (NotaFiscalFilter), repassados à task como texto
+        filtros = {
+            campo: str(request.data.get(campo))
+            for campo in request.data.keys() if campo not in self.CAMPOS_CONTROLE
+        }
+        filterset = NotaFiscalFilter(data=filtros, queryset=models.NotaFiscal.objects.none())
+        if not filterset.is_valid():
+            return response.Response({'error': filterset.errors}, status=status.HTTP_400_BAD_REQUEST)
 
-            return False
+        incluir_danfe = str(request.data.get('incluir_danfe', 'true')).lower() in ('true', '1', 't')
 
-        except (AttributeError, Empresa.DoesNotExist, Funcionario.DoesNotExist):
-            return False
+        job_id = uuid.uuid4().hex
+        # Dono do job: usado pelos endpoints de status/download
+        atualizar_exportacao(job_id, user_id=request.user.id, empresa_id=empresa.id, status='pendente')
+        exportar_nfes_task.delay(job_id, empresa.id, filtros, incluir_danfe)
 
-    @staticmethod
-    def _gerar_danfe_pdf(xml_file_path, pasta_saida='media/danfe'):
-        """
-        Gera e salva o PDF da DANFE a partir do XML.
+        return response.Response({
+            'job_id': job_id,
+            'status': 'processing',
+            'mensagem': 'Exportação iniciada em background'
+        }, status=status.HTTP_202_ACCEPTED)
 
-        Args:
-            xml_file_path (str): Caminho completo para o arquivo XML
-            pasta_saida (str): Pasta onde o PDF será salvo (relativo a MEDIA_ROOT)
 
-        Returns:
-            str: Caminho completo do PDF gerado
+@extend_schema_view(
+    get=extend_schema(
+        tags=["[Allnube] NF"],
+        operation_id='03_exportar_nfes_status',
+        summary='03 Status da exportação de XMLs e DANFEs',
+        description="""
+        Consulta o andamento de uma exportação iniciada em `nfes/exportar/`.
 
-        Raises:
-            FileNotFoundError: Se o arquivo XML não for encontrado
-            Exception: Em caso de erro na geração do PDF
-        """
-        if not os.path.exists(pasta_saida):
-            os.makedirs(pasta_saida)
+        `status`: `pendente`, `renderizando` (gerando os DANFEs que faltam;
+        `danfes_gerados` / `danfes_a_gerar`), `compactando` (`concluidos` / `total`),
+        `concluido` (com `download_url` e `resultado`) ou `erro`.
+        """,
+        responses={200: OpenApiTypes.OBJECT, 404: OpenApiTypes.OBJECT}
+    )
+)
+class ExportarNfeStatusAPIView(APIView):
+    permission_classes = (IsAuthenticated, PodeAcessarRotasFuncionario)
 
-        with open(xml_file_path, "r", encoding="utf8") as file:
-            xml_content = file.read()
+    def get(self, request, job_id):
+        estado = _obter_exportacao(request, job_id)
+        if not estado:
+            return response.Response({'error': 'Exportação não encontrada'}, status=status.HTTP_404_NOT_FOUND)
 
-        nome_base = os.path.splitext(os.path.basename(xml_file_path))[0]
-        caminho_pdf = os.path.join(pasta_saida, f'{nome_base}.pdf')
+        result = {chave: valor for chave, valor in estado.items() if chave not in ('user_id', 'task_montagem')}
+        result['job_id'] = job_id
 
-        danfe = Danfe(xml=xml_content)
-        danfe.output(caminho_pdf)
+        if estado['status'] == 'renderizando':
+            result['danfes_gerados'] = cache.get(f'exportacao_nfe_{job_id}_danfes', 0)
+            # Falha de um bloco de DANFE derruba o callback do chord antes dele atualizar o estado
+            montagem = AsyncResult(estado['task_montagem'])
+            if montagem.failed():
+                result['status'] = 'erro'
+                result['erro'] = str(montagem.info)
 
-        return caminho_pdf
+        if estado['status'] == 'concluido':
+            result['download_url'] = request.build_absolute_uri(reverse('nfe-exportar-baixar', args=[job_id]))
+
+        return response.Response(result)
+
+
+@extend_schema_view(
+    get=extend_schema(
+        tags=["[Allnube] NF"],
+        operation_id='03_exportar_nfes_baixar',
+        summary='03 Baixar exportação de XMLs e DANFEs',
+        description="Baixa o ZIP de uma exportação concluída (enviado em streaming a partir do disco).",
+        responses={
+            200: OpenApiResponse(response=OpenApiTypes.BINARY, description='ZIP com xml/ e danfe/'),
+            404: OpenApiTypes.OBJECT,
+            409: OpenApiTypes.OBJECT,
+        }
+    )
+)
+class ExportarNfeBaixarAPIView(APIView):
+    permission_classes = (IsAuthenticated, PodeAcessarRotasFuncionario)
+
+    def get(self, request, job_id):
+        estado = _obter_exportacao(request, job_id)
+        if not estado:
+            return response.Response({'error': 'Exportação não encontrada'}, status=status.HTTP_404_NOT_FOUND)
+
+        if estado['status'] != 'concluido':
+            return response.Response(
+                {'error': 'Exportação ainda não concluída', 'status': estado['status']},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        caminho = caminho_exportacao(job_id)
+        if not os.path.exists(caminho):
+            return response.Response({'error': 'Arquivo da exportação expirado'}, status=status.HTTP_404_NOT_FOUND)
+
+        return FileResponse(open(caminho, 'rb'), as_attachment=True, filename=f'nfes_{estado["empresa_id"]}_{job_id[:8]}.zip')
 
 
 @extend_schema_view(
@@ -1178,7 +1614,7 @@ class GerarDanfeAPIView(generics.RetrieveAPIView):
             )
         ],
         responses={
-            200: NfeModelSerializer(many=True),
+            200: NfeListSerializer(many=True),
             401: OpenApiTypes.OBJECT,
             403: OpenApiTypes.OBJECT,
             404: OpenApiTypes.OBJECT
@@ -1212,7 +1648,8 @@ class GerarDanfeAPIView(generics.RetrieveAPIView):
 class NfeListMatrizAPIView(generics.ListAPIView):
     permission_classes = (IsAuthenticated, PodeAcessarRotasFuncionario)
     filter_backends = [DjangoFilterBackend]
-    pagination_class = utils.CustomPageSizePagination
+    pagination_class = utils.CursorOpcionalPagination
+    campos_cursor = ('dhEmi', 'id')
 
     # filterset_class = NotaFiscalFilter
     # serializer_class = NfeModelSerializer
@@ -1241,10 +1678,10 @@ class NfeListMatrizAPIView(generics.ListAPIView):
             if DatabaseManager.empresa_tem_banco_proprio(empresa):
                 return NfeFlatModelSerializer
             else:
-                return NfeModelSerializer
+                return NfeListSerializer
         except Exception as e:
             print(f"Erro ao determinar serializer: {e}")
-            return NfeModelSerializer  # Fallback para serializer padrão
+            return NfeListSerializer  # Fallback para serializer padrão
 
     def get_queryset(self):
         # Evita erro na geração da documentação Swagger
@@ -1278,10 +1715,10 @@ class NfeListMatrizAPIView(generics.ListAPIView):
                     nfe = NotaFiscalFlat.objects.none()
             else:
                 # Empresa não tem banco próprio → usa modelos NORMAIS
-                nfe = models.NotaFiscal.objects.filter(
+                nfe = NfeListSerializer.otimizar_queryset(models.NotaFiscal.objects.filter(
                     empresa=matriz_id,
                     deleted_at__isnull=True,
-                )
+                ))
 
             return nfe
 
@@ -1390,7 +1827,7 @@ class NfeListMatrizAPIView(generics.ListAPIView):
             )
         ],
         responses={
-            200: NfeModelSerializer(many=True),
+            200: NfeListSerializer(many=True),
             400: OpenApiTypes.OBJECT,
             401: OpenApiTypes.OBJECT,
             403: OpenApiTypes.OBJECT,
@@ -1441,7 +1878,8 @@ class NfeListMatrizAPIView(generics.ListAPIView):
 class NfeListFilialAPIView(generics.ListAPIView):
     permission_classes = (IsAuthenticated, PodeAcessarRotasFuncionario)
     filter_backends = [DjangoFilterBackend]
-    pagination_class = utils.CustomPageSizePagination
+    pagination_class = utils.CursorOpcionalPagination
+    campos_cursor = ('dhEmi', 'id')
 
     # filterset_class = NotaFiscalFilter
     # serializer_class = NfeModelSerializer
@@ -1470,10 +1908,10 @@ class NfeListFilialAPIView(generics.ListAPIView):
             if DatabaseManager.empresa_tem_banco_proprio(empresa):
                 return NfeFlatModelSerializer
             else:
-                return NfeModelSerializer
+                return NfeListSerializer
         except Exception as e:
             print(f"Erro ao determinar serializer: {e}")
-            return NfeModelSerializer  # Fallback para serializer padrão
+            return NfeListSerializer  # Fallback para serializer padrão
 
     def get_queryset(self):
         # Evita erro na geração da documentação Swagger
@@ -1521,10 +1959,10 @@ class NfeListFilialAPIView(generics.ListAPIView):
                     print(f"Erro ao conectar banco empresa: {e}")
                     nfe = NotaFiscalFlat.objects.none()
             else:
-                nfe = models.NotaFiscal.objects.filter(
+                nfe = NfeListSerializer.otimizar_queryset(models.NotaFiscal.objects.filter(
                     empresa=getFilial,
                     deleted_at__isnull=True
-                )
+                ))
 
             return nfe
 
@@ -1672,6 +2110,7 @@ class NfeListFilialAPIView(generics.ListAPIView):
 )
 class NfeRetrieveUpdateDestroyAPIView(NFeBaseView, generics.RetrieveUpdateDestroyAPIView):
     # serializer_class = NfeModelSerializer
+    detalhar_nota = True
 
     def get_serializer_class(self):
         try:
@@ -1854,10 +2293,11 @@ class NfeRetrieveUpdateDestroyAPIView(NFeBaseView, generics.RetrieveUpdateDestro
         ]
     )
 )
-class NfeTodosProdutosListAPIView(generics.ListAPIView):
+class NfeTodosProdutosListAPIView(FiltroFederadoMixin, generics.ListAPIView):
     permission_classes = (IsAuthenticated, PodeAcessarRotasFuncionario)
     filter_backends = [DjangoFilterBackend]
-    pagination_class = utils.CustomPageSizePagination
+    pagination_class = utils.CursorOpcionalPagination
+    campos_cursor = ('id',)
 
     # filterset_class = ProdutoFilter
     # serializer_class = ProdutoModelSerializer
@@ -1918,22 +2358,20 @@ class NfeTodosProdutosListAPIView(generics.ListAPIView):
 
                 try:
                     if DatabaseManager.usar_banco_empresa(matriz_id):
-                        # Busca notas da matriz e de todas as filiais
-                        notas_fiscais = NotaFiscalFlat.objects.filter(
-                            Q(empresa_id=matriz_id) |  # Notas da matriz
-                            Q(empresa_id__in=filiais_ids),  # Notas das filiais
-                            deleted_at__isnull=True
-                        )
-
-                        print(f'notas fiscais: {notas_fiscais}')
-
-                        # Pega apenas os IDs das notas fiscais
-                        nota_fiscal_ids = notas_fiscais.values_list('id', flat=True)
-
-                        # Retorna produtos dessas notas fiscais
-                        return ProdutoFlat.objects.filter(
-                            nota_fiscal_id__in=nota_fiscal_ids
-                        )
+                        def produtos_do_banco(produtos, empresas_ids):
+                            # Notas da matriz e das filiais que vivem neste banco
+                            nota_fiscal_ids = NotaFiscalFlat.objects.using(produtos.db).filter(
+                                empresa_id__in=empresas_ids,
+                                deleted_at__isnull=True
+                            ).values_list('id', flat=True)
+
+                            # Produtos dessas notas fiscais
+                            return produtos.filter(nota_fiscal_id__in=nota_fiscal_ids)
+
+                        # Filiais com banco próprio são consultadas em paralelo
+                        return ConsultaFederada.da_matriz(
+                            ProdutoFlat, matriz_id, filiais_ids, produtos_do_banco
+                        ).simplificar()
                     else:
                         # Se não conseguiu conectar no banco da empresa, retorna vazio
                         return ProdutoFlat.objects.none()
@@ -2074,7 +2512,8 @@ class NfeTodosProdutosListAPIView(generics.ListAPIView):
 class NfeProdutosMatrizListAPIView(generics.ListAPIView):
     permission_classes = (IsAuthenticated, PodeAcessarRotasFuncionario)
     filter_backends = [DjangoFilterBackend]
-    pagination_class = utils.CustomPageSizePagination
+    pagination_class = utils.CursorOpcionalPagination
+    campos_cursor = ('id',)
 
     def get_filterset_class(self):
         """Retorna o filterset correto baseado no banco sendo usado"""
@@ -2303,7 +2742,8 @@ class NfeProdutosFilialListAPIView(generics.ListAPIView):
     serializer_class = ProdutoModelSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = ProdutoFilter
-    pagination_class = utils.CustomPageSizePagination
+    pagination_class = utils.CursorOpcionalPagination
+    campos_cursor = ('id',)
 
     def get_queryset(self):
         # Evita erro na geração da documentação Swagger
@@ -2696,7 +3136,8 @@ class NfeTodosFornecedorListAPIView(generics.ListAPIView):
     serializer_class = EmitenteModelSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = FornecedorFilter
-    pagination_class = utils.CustomPageSizePagination
+    pagination_class = utils.CursorOpcionalPagination
+    campos_cursor = ('id',)
 
     def get_queryset(self):
         # Evita erro na geração da documentação Swagger
@@ -2858,7 +3299,8 @@ class NfeFornecedorMatrizListAPIView(generics.ListAPIView):
     serializer_class = EmitenteModelSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = FornecedorFilter
-    pagination_class = utils.CustomPageSizePagination
+    pagination_class = utils.CursorOpcionalPagination
+    campos_cursor = ('id',)
 
     def get_queryset(self):
         # Evita erro na geração da documentação Swagger
@@ -3044,7 +3486,8 @@ class NfeFornecedorFilialListAPIView(generics.ListAPIView):
     serializer_class = EmitenteModelSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = FornecedorFilter
-    pagination_class = utils.CustomPageSizePagination
+    pagination_class = utils.CursorOpcionalPagination
+    campos_cursor = ('id',)
 
     def get_queryset(self):
         # Evita erro na geração da documentação Swagger
@@ -3503,6 +3946,8 @@ class NFeAutomatizacaoStatusView(APIView):
                 "status": task.status,
                 "ready": task.ready(),
                 "result": task.result if task.ready() else None,
+                # Resumo consolidado pelo callback do chord (disponível quando todas as empresas terminam)
+                "consolidado": cache.get(f'automatizacao_nfe_result_{last_task_id}'),
             })
 
         return Response({"message": "Nenhuma task encontrada"})
@@ -1,35 +1,29 @@
-import os
-from django.conf import settings
 from django.db import transaction
 from django.utils.dateparse import parse_datetime
 import xml.etree.ElementTree as ET
-from empresa.models import HistoricoNSU
+from app.utils import arquivo_xml
+from empresa.models import CursorNSU
 from nfe_evento.models import EventoNFe, SignatureEvento, RetornoEvento
 
 
 class EventoNFeProcessor:
-    def __init__(self, empresa, nsu, file_xml):
+    def __init__(self, empresa, nsu, file_xml, registrar_nsu=True, raiz=None):
         self.empresa = empresa
         self.nsu = nsu
+        # registrar_nsu=False: quem chamou avança o CursorNSU (uma vez por página/lote)
+        self.registrar_nsu = registrar_nsu
         self.file_xml = file_xml
         self.ns = {
             'nfe': 'http://www.portalfiscal.inf.br/nfe',
             'ds': 'http://www.w3.org/2000/09/xmldsig#'
         }
-        self.xml = self._abrir_arquivo(file_xml)
-        self.root = self._parse_xml()
+        # raiz: elemento já parseado por quem chamou (ex.: distDFe), o arquivo não é relido
+        self.xml = None if raiz is not None else self._abrir_arquivo(file_xml)
+        self.root = raiz if raiz is not None else self._parse_xml()
 
     def _abrir_arquivo(self, caminho_relativo):
-        if caminho_relativo.startswith('media/'):
-            caminho_relativo = caminho_relativo[6:]
-
-        caminho_completo = os.path.join(settings.MEDIA_ROOT, caminho_relativo)
-
-        if not os.path.exists(caminho_completo):
-            raise FileNotFoundError(f"Arquivo não encontrado: {caminho_completo}")
-
-        with open(caminho_completo, 'r', encoding='utf-8') as file:
-            return file.read()
+        # Acervo (.xml.gz) ou arquivo solto em MEDIA_ROOT
+        return arquivo_xml.ler(caminho_relativo).decode('utf-8')
 
     def _parse_xml(self):
         try:
@@ -37,26 +31,87 @@ class EventoNFeProcessor:
         except ET.ParseError as e:
             raise ValueError(f"Erro ao processar o XML: {str(e)}")
 
+    # Campos atualizados quando o evento já existe (chave do conflito: unique_together do model)
+    CAMPOS_EVENTO = [
+        'data_hora_evento', 'data_hora_registro', 'descricao_evento', 'numero_protocolo', 'status',
+        'motivo', 'versao_aplicativo', 'orgao', 'ambiente', 'cnpj_destinatario', 'file_xml', 'updated_at',
+    ]
+    CAMPOS_SIGNATURE = [
+        'signature_value', 'canonicalization_method', 'signature_method', 'digest_method',
+        'digest_value', 'x509_certificate',
+    ]
+    CAMPOS_RETORNO = [
+        'tp_amb', 'ver_aplic', 'c_orgao', 'c_stat', 'x_motivo', 'ch_nfe', 'tp_evento', 'x_evento',
+        'n_seq_evento', 'cnpj_dest', 'dh_reg_evento', 'n_prot',
+    ]
+
     def processar(self):
         with transaction.atomic():
-            self._criar_historico_nsu()
-            evento = self._criar_evento()
-            self._criar_signature(evento)
-            self._criar_retorno(evento)
-            return evento
+            if self.registrar_nsu:
+                self._avancar_cursor_nsu()
+            return self.gravar_lote([self])[0]
+
+    @classmethod
+    def gravar_lote(cls, processadores):
+        """
+        Grava eventos, assinaturas e retornos de vários documentos com três
+        INSERT ... ON CONFLICT. Devolve os EventoNFe na ordem dos processadores.
+        """
+        documentos = [
+            (processador._montar_evento(), processador._dados_signature(), processador._dados_retorno())
+            for processador in processadores
+        ]
+
+        # O mesmo ON CONFLICT não pode tocar a mesma linha duas vezes: vale o último da página
+        unicos = {}
+        for evento, signature, retorno in documentos:
+            unicos[cls._chave(evento)] = (evento, signature, retorno)
 
-    def _criar_historico_nsu(self):
-        HistoricoNSU.objects.create(empresa=self.empresa, nsu=self.nsu)
+        with transaction.atomic():
+            EventoNFe.objects.bulk_create(
+                [evento for evento, _, _ in unicos.values()],
+                update_conflicts=True,
+                unique_fields=['chave_nfe', 'sequencia_evento', 'tipo_evento'],
+                update_fields=cls.CAMPOS_EVENTO,
+            )
 
-    def _criar_evento(self):
+            signatures = [
+                SignatureEvento(evento=evento, **signature)
+                for evento, signature, _ in unicos.values() if signature
+            ]
+            if signatures:
+                SignatureEvento.objects.bulk_create(
+                    signatures, update_conflicts=True, unique_fields=['evento'], update_fields=cls.CAMPOS_SIGNATURE
+                )
+
+            retornos = [
+                RetornoEvento(evento=evento, **retorno)
+                for evento, _, retorno in unicos.values() if retorno
+            ]
+            if retornos:
+                RetornoEvento.objects.bulk_create(
+                    retornos, update_conflicts=True, unique_fields=['evento'], update_fields=cls.CAMPOS_RETORNO
+                )
+
+        return [unicos[cls._chave(evento)][0] for evento, _, _ in documentos]
+
+    @staticmethod
+    def _chave(evento):
+        return (evento.chave_nfe, evento.sequencia_evento, evento.tipo_evento)
+
+    def _avancar_cursor_nsu(self):
+        CursorNSU.avancar(self.empresa.id, self.nsu)
+
+    def _montar_evento(self):
+        """EventoNFe (não salvo) com os dados do documento"""
         tag_name = self.root.tag.lower()
 
         if 'resevento' in tag_name:
-            return self._criar_evento_resumido()
+            return self._montar_evento_resumido()
         else:
-            return self._criar_evento_padrao()
+            return self._montar_evento_padrao()
 
-    def _criar_evento_resumido(self):
+    def _montar_evento_resumido(self):
         def get_text(tag):
             el = self.root.find(f'nfe:{tag}', self.ns)
             return el.text if el is not None else ''
@@ -65,7 +120,7 @@ class EventoNFeProcessor:
             dt_str = get_text(tag)
             return parse_datetime(dt_str) if dt_str else None
 
-        return EventoNFe.objects.create(
+        return EventoNFe(
             empresa=self.empresa,
             chave_nfe=get_text('chNFe'),
             tipo_evento=get_text('tpEvento'),
@@ -83,7 +138,7 @@ class EventoNFeProcessor:
             file_xml=self.file_xml
         )
 
-    def _criar_evento_padrao(self):
+    def _montar_evento_padrao(self):
         inf_evento = self.root.find('.//nfe:infEvento', self.ns)
         det_evento = self.root.find('.//nfe:detEvento', self.ns)
 
@@ -98,7 +153,7 @@ class EventoNFeProcessor:
         def parse_dt(dt_str):
             return parse_datetime(dt_str) if dt_str else None
 
-        return EventoNFe.objects.create(
+        return EventoNFe(
             empresa=self.empresa,
             chave_nfe=safe_findtext(inf_evento, 'nfe:chNFe'),
             tipo_evento=safe_findtext(inf_evento, 'nfe:tpEvento'),
@@ -116,7 +171,8 @@ class EventoNFeProcessor:
             file_xml=self.file_xml
         )
 
-    def _criar_signature(self, evento):
+    def _dados_signature(self):
+        """Campos da SignatureEvento, ou None se o documento não for assinado"""
         signature = self.root.find('.//ds:Signature', self.ns)
         if signature:
             signed_info = signature.find('ds:SignedInfo', self.ns)
@@ -125,8 +181,7 @@ class EventoNFeProcessor:
             reference = signed_info.find('ds:Reference', self.ns) if signed_info else None
             digest_method_el = reference.find('ds:DigestMethod', self.ns) if reference else None
 
-            SignatureEvento.objects.create(
-                evento=evento,
+            return dict(
                 signature_value=signature.findtext('ds:SignatureValue', namespaces=self.ns),
                 canonicalization_method=canonicalization_el.get('Algorithm') if canonicalization_el else '',
                 signature_method=signature_el.get('Algorithm') if signature_el else '',
@@ -134,12 +189,13 @@ class EventoNFeProcessor:
                 digest_value=reference.findtext('ds:DigestValue', namespaces=self.ns) if reference else '',
                 x509_certificate=signature.findtext('.//ds:X509Certificate', namespaces=self.ns)
             )
+        return None
 
-    def _criar_retorno(self, evento):
+    def _dados_retorno(self):
+        """Campos do RetornoEvento, ou None se o documento não trouxer retEvento"""
         ret_evento = self.root.find('.//nfe:retEvento/nfe:infEvento', self.ns)
         if ret_evento:
-            RetornoEvento.objects.create(
-                evento=evento,
+            return dict(
                 tp_amb=int(ret_evento.findtext('nfe:tpAmb', namespaces=self.ns) or 1),
                 ver_aplic=ret_evento.findtext('nfe:verAplic', namespaces=self.ns),
                 c_orgao=ret_evento.findtext('nfe:cOrgao', namespaces=self.ns),
@@ -153,3 +209,4 @@ class EventoNFeProcessor:
                 dh_reg_evento=parse_datetime(ret_evento.findtext('nfe:dhRegEvento', namespaces=self.ns)),
                 n_prot=ret_evento.findtext('nfe:nProt', namespaces=self.ns)
             )
+        return None
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.1 on 2026-10-16 23:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('empresa', '0015_empresa_nfe_pre_renderizar_danfe'),
+        ('nfe_resumo', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='resumonfe',
+            constraint=models.UniqueConstraint(fields=('chave_nfe', 'tipo_documento', 'tipo_evento', 'sequencia_evento'), name='resumo_nfe_documento_evento_uniq', nulls_distinct=False),
+        ),
+        migrations.AlterUniqueTogether(
+            name='resumonfe',
+            unique_together=set(),
+        ),
+    ]
@@ -47,7 +47,16 @@ class ResumoNFe(models.Model):
     class Meta:
         verbose_name = 'Resumo NFe'
         verbose_name_plural = 'Resumos NFe'
-        unique_together = ['chave_nfe', 'tipo_documento']
+        constraints = [
+            # Um resNFe por chave e um resEvento por (chave, tipo, sequência) do evento.
+            # Os campos de evento são NULL no resNFe: NULLS NOT DISTINCT (PostgreSQL 15+)
+            # para que o mesmo índice sirva de chave do ON CONFLICT aos dois tipos
+            models.UniqueConstraint(
+                fields=['chave_nfe', 'tipo_documento', 'tipo_evento', 'sequencia_evento'],
+                nulls_distinct=False,
+                name='resumo_nfe_documento_evento_uniq',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.chave_nfe} - {self.get_tipo_documento_display()}'
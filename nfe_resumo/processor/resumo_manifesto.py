@@ -1,16 +1,15 @@
-import os
 from re import sub
 from lxml import etree
 from django.conf import settings
 from django.utils.dateparse import parse_datetime
 from django.utils.timezone import localtime, now
 from pynfe.entidades.evento import EventoManifestacaoDest
-from pynfe.processamento.comunicacao import ComunicacaoSefaz
 from pynfe.processamento.serializacao import SerializacaoXML
-from pynfe.processamento.assinatura import AssinaturaA1
 from pynfe.entidades.fonte_dados import _fonte_dados
 from nfe_evento.models import EventoNFe, RetornoEvento
+from app.utils import arquivo_xml
 from app.utils.nfe import Nfe
+from app.utils.sefaz import obter_comunicacao_sefaz, obter_assinatura_a1
 
 
 class ManifestoNFeProcessor:
@@ -52,15 +51,10 @@ class ManifestoNFeProcessor:
         serializador = SerializacaoXML(_fonte_dados, homologacao=self.homologacao)
         xml_evento = serializador.serializar_evento(evento)
 
-        assinatura = AssinaturaA1(self.certificado_path, self.certificado_senha)
+        assinatura = obter_assinatura_a1(self.empresa)
         xml_assinado = assinatura.assinar(xml_evento)
 
-        comunicacao = ComunicacaoSefaz(
-            self.uf_autorizadora_nfe,
-            self.certificado_path,
-            self.certificado_senha,
-            self.homologacao,
-        )
+        comunicacao = obter_comunicacao_sefaz(self.empresa, self.uf_autorizadora_nfe, self.homologacao)
 
         resposta = comunicacao.evento(modelo="nfe", evento=xml_assinado)
 
@@ -187,12 +181,7 @@ class ManifestoNFeProcessor:
         uf_chave = self.resumo.chave_nfe[:2]
         uf_autorizadora = codigos_uf.get(uf_chave, "")
 
-        xml_filename = f"manifesto_{self.resumo.chave_nfe}_{now().strftime('%Y%m%d_%H%M%S')}.xml"
-        xml_path = os.path.join("xml", "eventos", xml_filename)
-        os.makedirs(os.path.join(settings.MEDIA_ROOT, "xml", "eventos"), exist_ok=True)
-
-        with open(os.path.join(settings.MEDIA_ROOT, xml_path), "w", encoding="utf-8") as f:
-            f.write(xml_assinado)
+        xml_path = arquivo_xml.salvar_xml(self.empresa.id, xml_assinado)
 
         evento = EventoNFe.objects.create(
             empresa=self.empresa,
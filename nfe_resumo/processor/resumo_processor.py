@@ -1,35 +1,28 @@
-import os
-
-from django.conf import settings
 from django.db import transaction
 
 import xml.etree.ElementTree as ET
 
-from empresa.models import HistoricoNSU
+from app.utils import arquivo_xml
+from empresa.models import CursorNSU
 from nfe_resumo.models import ResumoNFe
 
 
 class ResumoNFeProcessor:
-    def __init__(self, empresa, nsu, file_xml):
+    def __init__(self, empresa, nsu, file_xml, registrar_nsu=True, raiz=None):
         self.empresa = empresa
         self.nsu = nsu
+        # registrar_nsu=False: quem chamou avança o CursorNSU (uma vez por página/lote)
+        self.registrar_nsu = registrar_nsu
         self.file_xml = file_xml
         self.ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-        self.xml = self._abrir_arquivo(file_xml)
-        self.root = self._parse_xml()
+        # raiz: elemento já parseado por quem chamou (ex.: distDFe), o arquivo não é relido
+        self.xml = None if raiz is not None else self._abrir_arquivo(file_xml)
+        self.root = raiz if raiz is not None else self._parse_xml()
         self.tipo_documento = self._identificar_tipo_documento()
 
     def _abrir_arquivo(self, caminho_relativo):
-        if caminho_relativo.startswith('media/'):
-            caminho_relativo = caminho_relativo[6:]
-
-        caminho_completo = os.path.join(settings.MEDIA_ROOT, caminho_relativo)
-
-        if not os.path.exists(caminho_completo):
-            raise FileNotFoundError(f"Arquivo não encontrado: {caminho_completo}")
-
-        with open(caminho_completo, 'r', encoding='utf-8') as file:
-            return file.read()
+        # Acervo (.xml.gz) ou arquivo solto em MEDIA_ROOT
+        return arquivo_xml.ler(caminho_relativo).decode('utf-8')
 
     def _parse_xml(self):
         try:
@@ -47,105 +40,107 @@ class ResumoNFeProcessor:
         else:
             raise ValueError(f'Tipo de documento não suportado: {root_tag}')
 
+    # Chave do conflito: a UniqueConstraint do model. O resEvento é identificado
+    # pelo tipo e sequência do evento (eventos diferentes da mesma chave coexistem)
+    CHAVE_CONFLITO = ['chave_nfe', 'tipo_documento', 'tipo_evento', 'sequencia_evento']
+
+    # Campos atualizados quando o resumo já existe
+    CAMPOS_ATUALIZAVEIS = {
+        'resNFe': [
+            'cnpj_emitente', 'nome_emitente', 'inscricao_estadual', 'data_emissao', 'tipo_nf',
+            'valor_nf', 'digest_value', 'data_recebimento', 'numero_protocolo', 'situacao_nfe',
+            'file_xml', 'updated_at',
+        ],
+        'resEvento': [
+            'cnpj_emitente', 'data_recebimento', 'numero_protocolo', 'descricao_evento', 'orgao',
+            'file_xml', 'updated_at',
+        ],
+    }
+
     def processar(self):
         with transaction.atomic():
-            self._criar_historico_nsu()
-            if self.tipo_documento == 'resNFe':
-                return self._criar_resumo_nfe()
-            else:
-                return self._criar_resumo_evento()
-
-    def _criar_historico_nsu(self):
-        HistoricoNSU.objects.create(empresa=self.empresa, nsu=self.nsu)
-
-    def _criar_resumo_nfe(self):
-        """Cria resumo de NFe (resNFe) com tratamento de duplicidade"""
-        def safe_findtext(path, default=''):
-            found = self.root.find(path, self.ns)
-            return found.text if found is not None else default
-
-        chave_nfe = safe_findtext('nfe:chNFe')
-
-        # Verificar se já existe
-        if ResumoNFe.objects.filter(chave_nfe=chave_nfe, tipo_documento='resNFe').exists():
-            # Atualizar o existente
-            resumo = ResumoNFe.objects.get(chave_nfe=chave_nfe, tipo_documento='resNFe')
-            resumo.cnpj_emitente = safe_findtext('nfe:CNPJ')
-            resumo.nome_emitente = safe_findtext('nfe:xNome')
-            resumo.inscricao_estadual = safe_findtext('nfe:IE')
-            resumo.data_emissao = safe_findtext('nfe:dhEmi')
-            resumo.tipo_nf = int(safe_findtext('nfe:tpNF', '1'))
-            resumo.valor_nf = safe_findtext('nfe:vNF', '0')
-            resumo.digest_value = safe_findtext('nfe:digVal')
-            resumo.data_recebimento = safe_findtext('nfe:dhRecbto')
-            resumo.numero_protocolo = safe_findtext('nfe:nProt')
-            resumo.situacao_nfe = int(safe_findtext('nfe:cSitNFe', '1'))
-            resumo.file_xml = self.file_xml
-            resumo.save()
-            return resumo
-
-        # Criar novo
-        return ResumoNFe.objects.create(
+            if self.registrar_nsu:
+                self._avancar_cursor_nsu()
+            return self.gravar_lote([self])[0]
+
+    @classmethod
+    def gravar_lote(cls, processadores):
+        """
+        Grava os resumos de vários documentos com um INSERT ... ON CONFLICT por
+        tipo de documento. Devolve os ResumoNFe na ordem dos processadores.
+        """
+        resumos = [processador.montar_resumo() for processador in processadores]
+
+        def chave(resumo):
+            return tuple(getattr(resumo, campo) for campo in cls.CHAVE_CONFLITO)
+
+        for tipo_documento, campos in cls.CAMPOS_ATUALIZAVEIS.items():
+            # O mesmo ON CONFLICT não pode tocar a mesma linha duas vezes: vale o último da página
+            unicos = {}
+            for resumo in resumos:
+                if resumo.tipo_documento == tipo_documento:
+                    unicos[chave(resumo)] = resumo
+            if not unicos:
+                continue
+
+            gravados = ResumoNFe.objects.bulk_create(
+                list(unicos.values()),
+                update_conflicts=True,
+                unique_fields=cls.CHAVE_CONFLITO,
+                update_fields=campos,
+            )
+            gravados_por_chave = {chave(resumo): resumo for resumo in gravados}
+            resumos = [
+                gravados_por_chave[chave(resumo)] if resumo.tipo_documento == tipo_documento else resumo
+                for resumo in resumos
+            ]
+
+        return resumos
+
+    def _avancar_cursor_nsu(self):
+        CursorNSU.avancar(self.empresa.id, self.nsu)
+
+    def _findtext(self, path, default=''):
+        found = self.root.find(path, self.ns)
+        return found.text if found is not None else default
+
+    def montar_resumo(self):
+        """ResumoNFe (não salvo) com os dados do documento"""
+        if self.tipo_documento == 'resNFe':
+            return self._montar_resumo_nfe()
+        return self._montar_resumo_evento()
+
+    def _montar_resumo_nfe(self):
+        """Resumo de NFe (resNFe)"""
+        return ResumoNFe(
             empresa=self.empresa,
-            chave_nfe=chave_nfe,
+            chave_nfe=self._findtext('nfe:chNFe'),
             tipo_documento='resNFe',
-            cnpj_emitente=safe_findtext('nfe:CNPJ'),
-            nome_emitente=safe_findtext('nfe:xNome'),
-            inscricao_estadual=safe_findtext('nfe:IE'),
-            data_emissao=safe_findtext('nfe:dhEmi'),
-            tipo_nf=int(safe_findtext('nfe:tpNF', '1')),
-            valor_nf=safe_findtext('nfe:vNF', '0'),
-            digest_value=safe_findtext('nfe:digVal'),
-            data_recebimento=safe_findtext('nfe:dhRecbto'),
-            numero_protocolo=safe_findtext('nfe:nProt'),
-            situacao_nfe=int(safe_findtext('nfe:cSitNFe', '1')),
+            cnpj_emitente=self._findtext('nfe:CNPJ'),
+            nome_emitente=self._findtext('nfe:xNome'),
+            inscricao_estadual=self._findtext('nfe:IE'),
+            data_emissao=self._findtext('nfe:dhEmi'),
+            tipo_nf=int(self._findtext('nfe:tpNF', '1')),
+            valor_nf=self._findtext('nfe:vNF', '0'),
+            digest_value=self._findtext('nfe:digVal'),
+            data_recebimento=self._findtext('nfe:dhRecbto'),
+            numero_protocolo=self._findtext('nfe:nProt'),
+            situacao_nfe=int(self._findtext('nfe:cSitNFe', '1')),
             file_xml=self.file_xml
         )
 
-    def _criar_resumo_evento(self):
-        """Cria resumo de Evento (resEvento) com tratamento de duplicidade"""
-        def safe_findtext(path, default=''):
-            found = self.root.find(path, self.ns)
-            return found.text if found is not None else default
-
-        chave_nfe = safe_findtext('nfe:chNFe')
-        tipo_evento = safe_findtext('nfe:tpEvento')
-        sequencia_evento = int(safe_findtext('nfe:nSeqEvento', '0'))
-
-        # Verificar se já existe
-        if ResumoNFe.objects.filter(
-            chave_nfe=chave_nfe,
-            tipo_documento='resEvento',
-            tipo_evento=tipo_evento,
-            sequencia_evento=sequencia_evento
-        ).exists():
-            # Atualizar o existente
-            resumo = ResumoNFe.objects.get(
-                chave_nfe=chave_nfe,
-                tipo_documento='resEvento',
-                tipo_evento=tipo_evento,
-                sequencia_evento=sequencia_evento
-            )
-            resumo.cnpj_emitente = safe_findtext('nfe:CNPJ')
-            resumo.data_recebimento = safe_findtext('nfe:dhRecbto')
-            resumo.numero_protocolo = safe_findtext('nfe:nProt')
-            resumo.descricao_evento = safe_findtext('nfe:xEvento')
-            resumo.orgao = safe_findtext('nfe:cOrgao')
-            resumo.file_xml = self.file_xml
-            resumo.save()
-            return resumo
-
-        # Criar novo
-        return ResumoNFe.objects.create(
+    def _montar_resumo_evento(self):
+        """Resumo de Evento (resEvento)"""
+        return ResumoNFe(
             empresa=self.empresa,
-            chave_nfe=chave_nfe,
+            chave_nfe=self._findtext('nfe:chNFe'),
             tipo_documento='resEvento',
-            cnpj_emitente=safe_findtext('nfe:CNPJ'),
-            data_recebimento=safe_findtext('nfe:dhRecbto'),
-            numero_protocolo=safe_findtext('nfe:nProt'),
-            tipo_evento=tipo_evento,
-            sequencia_evento=sequencia_evento,
-            descricao_evento=safe_findtext('nfe:xEvento'),
-            orgao=safe_findtext('nfe:cOrgao'),
+            cnpj_emitente=self._findtext('nfe:CNPJ'),
+            data_recebimento=self._findtext('nfe:dhRecbto'),
+            numero_protocolo=self._findtext('nfe:nProt'),
+            tipo_evento=self._findtext('nfe:tpEvento'),
+            sequencia_evento=int(self._findtext('nfe:nSeqEvento', '0')),
+            descricao_evento=self._findtext('nfe:xEvento'),
+            orgao=self._findtext('nfe:cOrgao'),
             file_xml=self.file_xml
         )
@@ -1,3 +1,92 @@
-from django.test import TestCase
+import os
+import tempfile
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from empresa.models import Empresa
+from nfe_resumo.models import ResumoNFe
+from nfe_resumo.processor.resumo_processor import ResumoNFeProcessor
+
+RES_NFE = """<resNFe xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.01">
+<chNFe>{chave}</chNFe><CNPJ>11111111000111</CNPJ><xNome>{nome}</xNome><IE>123</IE>
+<dhEmi>2026-10-01T10:00:00-03:00</dhEmi><tpNF>1</tpNF><vNF>10.00</vNF><digVal>abc</digVal>
+<dhRecbto>2026-10-01T10:05:00-03:00</dhRecbto><nProt>135000000000001</nProt><cSitNFe>1</cSitNFe>
+</resNFe>"""
+
+RES_EVENTO = """<resEvento xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.01">
+<cOrgao>91</cOrgao><CNPJ>11111111000111</CNPJ><chNFe>{chave}</chNFe>
+<dhEvento>2026-10-02T10:00:00-03:00</dhEvento><tpEvento>{tipo}</tpEvento><nSeqEvento>{sequencia}</nSeqEvento>
+<xEvento>{descricao}</xEvento><dhRecbto>2026-10-02T10:05:00-03:00</dhRecbto><nProt>{protocolo}</nProt>
+</resEvento>"""
+
+
+@skipUnless(
+    connection.features.supports_nulls_distinct_unique_constraints,
+    'O ON CONFLICT usa a UniqueConstraint NULLS NOT DISTINCT (PostgreSQL 15+)'
+)
+class ResumoNFeLoteTests(TestCase):
+    """Uma página de resumos vira um INSERT ... ON CONFLICT, sem duplicar chaves já gravadas"""
+
+    @classmethod
+    def setUpTestData(cls):
+        usuario = User.objects.create_user(username='resumo', password='resumo')
+        cls.empresa = Empresa.objects.create(
+            usuario=usuario, razao_social='Empresa Resumo', documento='33444555000166',
+            uf='SP', senha='123', status='1'
+        )
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        os.makedirs(os.path.join(self.media.name, 'xml'))
+        configuracao = override_settings(MEDIA_ROOT=self.media.name)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+    def _processador(self, nsu, chave, nome):
+        return self._processador_xml(nsu, RES_NFE.format(chave=chave, nome=nome))
+
+    def _processador_evento(self, nsu, chave, tipo, sequencia, descricao, protocolo):
+        return self._processador_xml(nsu, RES_EVENTO.format(
+            chave=chave, tipo=tipo, sequencia=sequencia, descricao=descricao, protocolo=protocolo
+        ))
+
+    def _processador_xml(self, nsu, xml):
+        caminho = os.path.join('xml', f'resumo_nsu-{nsu}.xml')
+        with open(os.path.join(self.media.name, caminho), 'w', encoding='utf-8') as arquivo:
+            arquivo.write(xml)
+        return ResumoNFeProcessor(self.empresa, nsu, caminho, registrar_nsu=False)
+
+    def test_lote_com_chave_repetida_atualiza(self):
+        self._processador(1, f'{1:044d}', 'Original').processar()
+
+        processadores = [self._processador(nsu, f'{nsu:044d}', f'Emitente {nsu}') for nsu in range(1, 5)]
+        with self.assertNumQueries(1):
+            resumos = ResumoNFeProcessor.gravar_lote(processadores)
+
+        self.assertEqual(ResumoNFe.objects.count(), 4)
+        self.assertEqual(ResumoNFe.objects.get(chave_nfe=f'{1:044d}').nome_emitente, 'Emitente 1')
+        self.assertTrue(all(resumo.pk for resumo in resumos))
+
+    def test_eventos_diferentes_da_mesma_chave_coexistem(self):
+        chave = f'{7:044d}'
+        self._processador(1, chave, 'Emitente').processar()
+
+        ResumoNFeProcessor.gravar_lote([
+            self._processador_evento(2, chave, '110110', 1, 'Carta de Correcao', '1'),
+            self._processador_evento(3, chave, '110111', 1, 'Cancelamento', '2'),
+        ])
+        # Reenvio do mesmo evento atualiza a linha dele, sem tocar no outro
+        ResumoNFeProcessor.gravar_lote([
+            self._processador_evento(4, chave, '110110', 1, 'Carta de Correcao', '3'),
+        ])
+
+        eventos = ResumoNFe.objects.filter(chave_nfe=chave, tipo_documento='resEvento').order_by('tipo_evento')
+        self.assertEqual(
+            [(evento.tipo_evento, evento.sequencia_evento, evento.numero_protocolo) for evento in eventos],
+            [('110110', 1, '3'), ('110111', 1, '2')],
+        )
+        self.assertEqual(ResumoNFe.objects.filter(chave_nfe=chave, tipo_documento='resNFe').count(), 1)
@@ -0,0 +1,42 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from sistema.models import RotaSistema, GrupoRotaSistema, EmpresaSistema
+from sistema.utils import permissoes
+from sistema.utils.rotas import invalidar_rotas
+
+
+@receiver(post_save, sender=RotaSistema)
+@receiver(post_delete, sender=RotaSistema)
+def invalidar_matcher_rotas(sender, instance, **kwargs):
+    """Rota criada, alterada ou removida: os processos remontam o matcher de rotas"""
+    invalidar_rotas()
+    # O template pode estar no conjunto de qualquer usuário
+    permissoes.invalidar_todas()
+
+
+@receiver(post_save, sender=GrupoRotaSistema)
+@receiver(post_delete, sender=GrupoRotaSistema)
+def invalidar_permissoes_grupo(sender, instance, **kwargs):
+    permissoes.invalidar_usuarios(permissoes.usuarios_do_grupo(instance))
+
+
+@receiver(m2m_changed, sender=GrupoRotaSistema.rotas.through)
+def invalidar_permissoes_rotas_grupo(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        permissoes.invalidar_usuarios(permissoes.usuarios_do_grupo(instance))
+    elif pk_set:
+        # rota.grupos.add(...)/remove(...): pk_set são os grupos
+        permissoes.invalidar_usuarios(permissoes.usuarios_dos_grupos(pk_set))
+    else:
+        # rota.grupos.clear(): os grupos não chegam no signal
+        permissoes.invalidar_todas()
+
+
+@receiver(post_save, sender=EmpresaSistema)
+@receiver(post_delete, sender=EmpresaSistema)
+def invalidar_permissoes_empresa_sistema(sender, instance, **kwargs):
+    permissoes.invalidar_usuarios(permissoes.usuarios_da_empresa(instance.empresa_id))
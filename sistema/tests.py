@@ -1,3 +1,126 @@
-from django.test import TestCase
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from empresa.models import Empresa, Funcionario, RotasPermitidas
+from sistema.models import GrupoRotaSistema, RotaSistema, Sistema
+from sistema.utils.permissoes import obter_permissoes
+from sistema.utils.rotas import MatcherRotas, encontrar_rota
+
+
+class MatcherRotasTests(SimpleTestCase):
+    """Path concreto -> template cadastrado, literais antes de parâmetros"""
+
+    def setUp(self):
+        rotas = [
+            SimpleNamespace(metodo='GET', path='/api/v1/nfes/<int:pk>/'),
+            SimpleNamespace(metodo='GET', path='/api/v1/nfes/matriz/'),
+            SimpleNamespace(metodo='GET', path='/api/v1/nfes/exportar/status/<str:job_id>/'),
+            SimpleNamespace(metodo='PUT', path='/api/v1/sistema/grupo-rota/{id}/'),
+        ]
+        self.matcher = MatcherRotas(rotas)
+
+    def _template(self, path, metodo='GET'):
+        rota = self.matcher.encontrar(path, metodo)
+        return rota.path if rota else None
+
+    def test_literal_vence_parametro(self):
+        self.assertEqual(self._template('/api/v1/nfes/matriz/'), '/api/v1/nfes/matriz/')
+        self.assertEqual(self._template('/api/v1/nfes/123'), '/api/v1/nfes/<int:pk>/')
+
+    def test_tipo_do_parametro_e_metodo(self):
+        self.assertIsNone(self._template('/api/v1/nfes/abc/'))
+        self.assertIsNone(self._template('/api/v1/nfes/123/', 'POST'))
+        self.assertEqual(self._template('/api/v1/sistema/grupo-rota/7/', 'put'), '/api/v1/sistema/grupo-rota/{id}/')
+        self.assertEqual(
+            self._template('/api/v1/nfes/exportar/status/5f0c7c1e/'), '/api/v1/nfes/exportar/status/<str:job_id>/'
+        )
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    ROTAS_SISTEMA_VERIFICACAO_SEGUNDOS=3600,
+)
+class MatcherRotasInvalidacaoTests(TestCase):
+    """Salvar uma RotaSistema remonta o matcher sem esperar a verificação periódica"""
+
+    def test_rota_nova_entra_no_matcher(self):
+        sistema = Sistema.objects.create(nome='Sistema Rotas')
+        self.assertIsNone(encontrar_rota('/api/v1/rotas-teste/1/', 'GET'))
+
+        RotaSistema.objects.create(sistema=sistema, nome='Teste', path='/api/v1/rotas-teste/<int:pk>/', metodo='GET')
+
+        with self.assertNumQueries(1):
+            rota = encontrar_rota('/api/v1/rotas-teste/1/', 'GET')
+        self.assertEqual(rota.path, '/api/v1/rotas-teste/<int:pk>/')
+        with self.assertNumQueries(0):
+            encontrar_rota('/api/v1/rotas-teste/2/', 'GET')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PermissoesFuncionarioTests(TestCase):
+    """Conjunto de permissões calculado uma vez e invalidado pelos signals"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dono = User.objects.create_user(username='dono-permissoes', password='x')
+        cls.usuario = User.objects.create_user(username='func-permissoes', password='x')
+        cls.empresa = Empresa.objects.create(
+            usuario=cls.dono, razao_social='Empresa Permissões', documento='11222333000181',
+            uf='SP', senha='123', status='1'
+        )
+        cls.funcionario = Funcionario.objects.create(
+            user=cls.usuario, empresa=cls.empresa, role=Funcionario.FUNCIONARIO, status='1'
+        )
+        sistema = Sistema.objects.create(nome='Sistema Permissões')
+        cls.rota = RotaSistema.objects.create(
+            sistema=sistema, nome='Nota', path='/api/v1/nfes/<int:pk>/', metodo='get'
+        )
+        cls.grupo = GrupoRotaSistema.objects.create(usuario=cls.dono, sistema=sistema, nome='Leitura')
+
+    def setUp(self):
+        # O locmem sobrevive ao rollback entre os testes
+        cache.clear()
+
+    def test_rota_liberada_sem_query(self):
+        self.grupo.rotas.add(self.rota)
+        RotasPermitidas.objects.create(funcionario=self.funcionario, rota=self.grupo, status='1')
+
+        obter_permissoes(self.usuario.id)
+        with self.assertNumQueries(0):
+            permissoes = obter_permissoes(self.usuario.id)
+        self.assertTrue(permissoes.pode_acessar('GET', '/api/v1/nfes/<int:pk>/'))
+        self.assertFalse(permissoes.pode_acessar('DELETE', '/api/v1/nfes/<int:pk>/'))
+        self.assertFalse(permissoes.admin)
+        self.assertEqual(permissoes.empresas, {self.empresa.id})
+
+    def test_signals_invalidam_o_conjunto(self):
+        RotasPermitidas.objects.create(funcionario=self.funcionario, rota=self.grupo, status='1')
+        self.assertFalse(obter_permissoes(self.usuario.id).pode_acessar('GET', '/api/v1/nfes/<int:pk>/'))
+
+        # Rota adicionada ao grupo (m2m_changed)
+        self.grupo.rotas.add(self.rota)
+        self.assertTrue(obter_permissoes(self.usuario.id).pode_acessar('GET', '/api/v1/nfes/<int:pk>/'))
+
+        # Template alterado (versão global)
+        self.rota.path = '/api/v1/nfes/detalhe/<int:pk>/'
+        self.rota.save()
+        self.assertTrue(obter_permissoes(self.usuario.id).pode_acessar('GET', '/api/v1/nfes/detalhe/<int:pk>/'))
+
+        # Funcionário inativado
+        self.funcionario.status = '0'
+        self.funcionario.save()
+        permissoes = obter_permissoes(self.usuario.id)
+        self.assertFalse(permissoes.ativo)
+        self.assertFalse(permissoes.pode_acessar('GET', '/api/v1/nfes/detalhe/<int:pk>/'))
+        self.assertFalse(obter_permissoes(self.dono.id).gerencia_funcionario(self.funcionario.id))
+
+    def test_escopo_do_dono(self):
+        permissoes = obter_permissoes(self.dono.id)
+
+        self.assertTrue(permissoes.admin)
+        self.assertTrue(permissoes.gerencia_funcionario(self.funcionario.id))
+        self.assertEqual(permissoes.empresas, {self.empresa.id})
+        self.assertFalse(obter_permissoes(self.usuario.id).gerencia_funcionario(-1))
@@ -0,0 +1,186 @@
+"""
+Conjunto de permissões materializado por usuário.
+
+Tudo o que as permissões de rota e de funcionário consultavam a cada request
+(funcionários ativos, grupos de rotas, RotasPermitidas, empresas, sistemas
+bloqueados) é calculado uma vez e guardado no cache compartilhado. Decidir o
+acesso vira consulta a sets em memória, sem tocar no banco:
+
+    permissoes = obter_permissoes(request.user.id)
+    permissoes.pode_acessar('GET', '/api/v1/nfes/gerar-danfe/<int:pk>/')
+
+As rotas entram pelo template cadastrado em RotaSistema (o mesmo devolvido por
+encontrar_rota), então um único par (método, template) cobre todos os ids.
+
+Invalidação (signals dos apps empresa e sistema):
+- Funcionario, RotasPermitidas, GrupoRotaSistema e EmpresaSistema descartam o
+  conjunto apenas dos usuários afetados;
+- RotaSistema troca a versão global: todos os conjuntos são recalculados no
+  próximo acesso (cadastro de rotas é raro e o template muda para todos).
+"""
+
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from empresa.models import Empresa, Funcionario, RotasPermitidas
+from sistema.models import EmpresaSistema, GrupoRotaSistema, RotaSistema
+
+CHAVE_VERSAO = 'permissoes_funcionario_versao'
+
+
+def chave_usuario(user_id):
+    return f'permissoes_funcionario_{user_id}'
+
+
+class PermissoesFuncionario:
+    """Permissões de um usuário: rotas liberadas e escopo de empresas"""
+
+    def __init__(self, versao, vinculos, empresas_dono, rotas, funcionarios_geridos, sistemas_bloqueados):
+        self.versao = versao
+        # (funcionario_id, empresa_id, role, matriz_id, status da empresa, sistema_id) dos vínculos ativos, por id
+        self.vinculos = tuple(vinculos)
+        # (empresa_id, matriz_id, status, sistema_id) das empresas de que é dono, por id
+        self.empresas_dono = tuple(empresas_dono)
+        self.funcionarios = frozenset(vinculo[0] for vinculo in self.vinculos)
+        self.admin = any(vinculo[2] == Funcionario.ADMIN for vinculo in self.vinculos)
+        self.rotas = frozenset(rotas)  # (MÉTODO, template)
+        # Empresas em que é funcionário ativo ou dono
+        self.empresas = frozenset(
+            [vinculo[1] for vinculo in self.vinculos] + [empresa[0] for empresa in self.empresas_dono]
+        )
+        self.funcionarios_geridos = frozenset(funcionarios_geridos)
+        self.sistemas_bloqueados = frozenset(sistemas_bloqueados)  # (empresa_id, sistema_id)
+
+    @property
+    def ativo(self):
+        """Usuário tem ao menos um vínculo ativo como funcionário"""
+        return bool(self.funcionarios)
+
+    def pode_acessar(self, metodo, template):
+        return (metodo.upper(), template) in self.rotas
+
+    def gerencia_funcionario(self, funcionario_id):
+        """Dono da empresa do funcionário ou o próprio funcionário (só vínculos ativos)"""
+        return funcionario_id in self.funcionarios_geridos
+
+    def sistema_liberado(self, empresa_id, sistema_id):
+        return (empresa_id, sistema_id) not in self.sistemas_bloqueados
+
+
+def calcular_permissoes(user_id, versao=None):
+    vinculos = list(
+        Funcionario.objects.filter(user_id=user_id, status='1').order_by('id').values_list(
+            'id', 'empresa_id', 'role', 'empresa__matriz_filial_id', 'empresa__status', 'empresa__sistema_id'
+        )
+    )
+    empresas_dono = list(
+        Empresa.objects.filter(usuario_id=user_id).order_by('id').values_list(
+            'id', 'matriz_filial_id', 'status', 'sistema_id'
+        )
+    )
+
+    # Mesmas regras de PodeAcessarRotasFuncionario: grupo liberado ao funcionário
+    # via RotasPermitidas ou grupo criado pelo próprio usuário
+    rotas = set(
+        RotaSistema.objects.filter(
+            grupos__rotas_permitidas__funcionario__user_id=user_id,
+            grupos__rotas_permitidas__funcionario__status='1',
+            grupos__rotas_permitidas__status='1',
+        ).values_list('metodo', 'path')
+    )
+    rotas.update(RotaSistema.objects.filter(grupos__usuario_id=user_id).values_list('metodo', 'path'))
+
+    funcionarios_geridos = {vinculo[0] for vinculo in vinculos}
+    if empresas_dono:
+        funcionarios_geridos.update(
+            Funcionario.objects.filter(empresa__usuario_id=user_id, status='1').values_list('id', flat=True)
+        )
+
+    empresas = {vinculo[1] for vinculo in vinculos} | {empresa[0] for empresa in empresas_dono}
+    sistemas_bloqueados = EmpresaSistema.objects.filter(
+        empresa_id__in=empresas, ativo=False
+    ).values_list('empresa_id', 'sistema_id') if empresas else []
+
+    return PermissoesFuncionario(
+        versao=versao,
+        vinculos=vinculos,
+        empresas_dono=empresas_dono,
+        rotas=((metodo.upper(), path) for metodo, path in rotas),
+        funcionarios_geridos=funcionarios_geridos,
+        sistemas_bloqueados=sistemas_bloqueados,
+    )
+
+
+def obter_permissoes(user_id):
+    """Conjunto do cache (uma ida ao cache para conjunto + versão) ou recalculado"""
+    chave = chave_usuario(user_id)
+    try:
+        valores = cache.get_many([chave, CHAVE_VERSAO])
+    except Exception as e:
+        print(f"Erro ao ler permissões do cache: {e}")
+        return calcular_permissoes(user_id)
+
+    versao = valores.get(CHAVE_VERSAO)
+    permissoes = valores.get(chave)
+    if permissoes is not None and permissoes.versao == versao:
+        return permissoes
+
+    permissoes = calcular_permissoes(user_id, versao)
+    try:
+        cache.set(chave, permissoes, settings.PERMISSOES_FUNCIONARIO_TTL)
+    except Exception as e:
+        print(f"Erro ao gravar permissões no cache: {e}")
+    return permissoes
+
+
+def _descartar_contextos_request():
+    # Import local: o contexto de empresa (app.utils) é montado a partir deste módulo.
+    # Uma alteração feita pelo próprio request não pode ler o contexto já montado.
+    from app.utils.contexto_empresa import descartar_contextos
+    descartar_contextos()
+
+
+def invalidar_usuarios(user_ids):
+    chaves = [chave_usuario(user_id) for user_id in set(user_ids) if user_id]
+    if not chaves:
+        return
+    _descartar_contextos_request()
+    try:
+        cache.delete_many(chaves)
+    except Exception as e:
+        print(f"Erro ao invalidar permissões: {e}")
+
+
+def invalidar_todas():
+    """Nova versão global: todo conjunto gravado com a versão anterior é recalculado"""
+    _descartar_contextos_request()
+    try:
+        cache.set(CHAVE_VERSAO, uuid.uuid4().hex, None)
+    except Exception as e:
+        print(f"Erro ao gravar versão das permissões: {e}")
+
+
+def usuarios_da_empresa(empresa_id):
+    """Dono e funcionários da empresa"""
+    usuarios = set(Funcionario.objects.filter(empresa_id=empresa_id).values_list('user_id', flat=True))
+    usuarios.update(Empresa.objects.filter(pk=empresa_id).values_list('usuario_id', flat=True))
+    return usuarios
+
+
+def usuarios_do_grupo(grupo):
+    """Criador do grupo e funcionários que o recebem via RotasPermitidas"""
+    usuarios = set(
+        RotasPermitidas.objects.filter(rota=grupo).values_list('funcionario__user_id', flat=True)
+    )
+    usuarios.add(grupo.usuario_id)
+    return usuarios
+
+
+def usuarios_dos_grupos(grupo_ids):
+    usuarios = set(
+        RotasPermitidas.objects.filter(rota_id__in=grupo_ids).values_list('funcionario__user_id', flat=True)
+    )
+    usuarios.update(GrupoRotaSistema.objects.filter(pk__in=grupo_ids).values_list('usuario_id', flat=True))
+    return usuarios
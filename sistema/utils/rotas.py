@@ -0,0 +1,166 @@
+"""
+Matcher compilado das rotas cadastradas em RotaSistema.
+
+As rotas de cada método HTTP viram uma árvore de segmentos (trie) montada uma
+vez por processo: casar um path custa O(quantidade de segmentos), sem consultar
+o banco e sem testar as rotas uma a uma. Segmentos literais são procurados num
+dict; segmentos com parâmetro (<int:pk>, <str:x>, <x> ou {x}) são testados pela
+regex do próprio segmento, sempre depois dos literais.
+
+Salvar ou remover uma RotaSistema troca a versão guardada no cache (signals do
+app sistema). Cada processo confere essa versão no máximo a cada
+ROTAS_SISTEMA_VERIFICACAO_SEGUNDOS e remonta a árvore quando ela muda.
+
+Uso:
+
+    rota = encontrar_rota('/api/v1/nfes/gerar-danfe/123/', 'GET')
+    rota.path  # '/api/v1/nfes/gerar-danfe/<int:pk>/' (template cadastrado)
+"""
+
+import re
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from sistema.models import RotaSistema
+
+CHAVE_VERSAO = 'rotas_sistema_versao'
+
+PADROES_PARAMETRO = {
+    'int': r'[0-9]+',
+    'uuid': r'[a-f0-9-]{36}',
+    'slug': r'[a-z0-9-]+',
+    'str': r'[^/]+',
+}
+_PARAMETRO = re.compile(r'<(?:(\w+):)?\w+>|\{[^}]+\}')
+
+
+def _regex_segmento(segmento):
+    """Regex de um segmento com parâmetros; None se o segmento é literal"""
+    partes = []
+    posicao = 0
+    for parametro in _PARAMETRO.finditer(segmento):
+        partes.append(re.escape(segmento[posicao:parametro.start()]))
+        partes.append(PADROES_PARAMETRO.get(parametro.group(1), r'[^/]+'))
+        posicao = parametro.end()
+
+    if not partes:
+        return None
+    partes.append(re.escape(segmento[posicao:]))
+    return re.compile(''.join(partes))
+
+
+def _segmentos(path):
+    # Barra final opcional: "/api/v1/nfes" e "/api/v1/nfes/" são o mesmo path
+    path = path.strip('/')
+    return path.split('/') if path else []
+
+
+class _No:
+    __slots__ = ('literais', 'parametros', 'rota')
+
+    def __init__(self):
+        self.literais = {}
+        self.parametros = []  # (segmento do template, regex, nó)
+        self.rota = None
+
+
+class MatcherRotas:
+    """Uma trie de segmentos por método HTTP; em templates repetidos vence o primeiro"""
+
+    def __init__(self, rotas):
+        self._raizes = {}
+        for rota in rotas:
+            self._inserir(rota)
+
+    def _inserir(self, rota):
+        no = self._raizes.setdefault(rota.metodo.upper(), _No())
+        for segmento in _segmentos(rota.path):
+            regex = _regex_segmento(segmento)
+            if regex is None:
+                no = no.literais.setdefault(segmento, _No())
+                continue
+
+            filho = next((filho for padrao, _, filho in no.parametros if padrao == segmento), None)
+            if filho is None:
+                filho = _No()
+                no.parametros.append((segmento, regex, filho))
+            no = filho
+
+        if no.rota is None:
+            no.rota = rota
+
+    def encontrar(self, path, metodo):
+        """RotaSistema cujo template casa com o path, ou None"""
+        raiz = self._raizes.get(metodo.upper())
+        if raiz is None:
+            return None
+        return self._buscar(raiz, _segmentos(path), 0)
+
+    def _buscar(self, no, segmentos, indice):
+        if indice == len(segmentos):
+            return no.rota
+
+        segmento = segmentos[indice]
+        filho = no.literais.get(segmento)
+        if filho is not None:
+            rota = self._buscar(filho, segmentos, indice + 1)
+            if rota is not None:
+                return rota
+
+        for _, regex, filho in no.parametros:
+            if regex.fullmatch(segmento):
+                rota = self._buscar(filho, segmentos, indice + 1)
+                if rota is not None:
+                    return rota
+        return None
+
+
+_matcher = None
+_versao = None
+_verificado_em = 0.0
+_lock = threading.Lock()
+
+
+def _versao_cache():
+    try:
+        return cache.get(CHAVE_VERSAO)
+    except Exception as e:
+        print(f"Erro ao ler versão das rotas do sistema: {e}")
+        return _versao
+
+
+def obter_matcher():
+    """Matcher do processo, remontado quando a versão das rotas muda"""
+    global _matcher, _versao, _verificado_em
+
+    agora = time.monotonic()
+    with _lock:
+        if _matcher is not None and agora - _verificado_em < settings.ROTAS_SISTEMA_VERIFICACAO_SEGUNDOS:
+            return _matcher
+
+    versao = _versao_cache()
+    with _lock:
+        if _matcher is None or versao != _versao:
+            _matcher = MatcherRotas(RotaSistema.objects.select_related('sistema').order_by('id'))
+            _versao = versao
+        _verificado_em = agora
+        return _matcher
+
+
+def encontrar_rota(path, metodo):
+    return obter_matcher().encontrar(path, metodo)
+
+
+def invalidar_rotas():
+    """Nova versão no cache (os outros processos remontam) e descarta o matcher deste processo"""
+    global _matcher
+    try:
+        cache.set(CHAVE_VERSAO, uuid.uuid4().hex, None)
+    except Exception as e:
+        print(f"Erro ao gravar versão das rotas do sistema: {e}")
+    with _lock:
+        _matcher = None